@@ -24,7 +24,6 @@ from flask_cors import CORS
 from flasgger import Swagger
 from itsdangerous.url_safe import URLSafeTimedSerializer as Serializer
 
-from api.db import StatusEnum
 from api.db.db_models import close_connection
 from api.db.services import UserService
 from api.utils import CustomJSONEncoder, commands
@@ -146,13 +145,7 @@ def load_user(web_request):
     if authorization:
         try:
             access_token = str(jwt.loads(authorization))
-            user = UserService.query(
-                access_token=access_token, status=StatusEnum.VALID.value
-            )
-            if user:
-                return user[0]
-            else:
-                return None
+            return UserService.get_by_access_token(access_token)
         except Exception as e:
             logging.warning(f"load_user got exception {e}")
             return None
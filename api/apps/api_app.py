@@ -35,9 +35,9 @@ from api.db.services.user_service import UserTenantService
 from api import settings
 from api.utils import get_uuid, current_timestamp, datetime_format
 from api.utils.api_utils import server_error_response, get_data_error_result, get_json_result, validate_request, \
-    generate_confirmation_token
+    generate_confirmation_token, AnswerStreamEncoder
 
-from api.utils.file_utils import filename_type, thumbnail
+from api.utils.file_utils import filename_type, thumbnail, stream_size
 from rag.app.tag import label_question
 from rag.prompts import keyword_extraction
 from rag.utils.storage_factory import STORAGE_IMPL
@@ -101,6 +101,7 @@ def rm():
         for token in req["tokens"]:
             APITokenService.filter_delete(
                 [APIToken.tenant_id == req["tenant_id"], APIToken.token == token])
+            APITokenService.invalidate(token)
         return get_json_result(data=True)
     except Exception as e:
         return server_error_response(e)
@@ -309,11 +310,13 @@ def completion():
 
         def stream():
             nonlocal dia, msg, req, conv
+            # whole answers, without the internal `delta`
+            encoder = AnswerStreamEncoder(1)
             try:
                 for ans in chat(dia, msg, True, **req):
                     fillin_conv(ans)
                     rename_field(ans)
-                    yield "data:" + json.dumps({"code": 0, "message": "", "data": ans},
+                    yield "data:" + json.dumps({"code": 0, "message": "", "data": encoder.encode(ans)},
                                                ensure_ascii=False) + "\n\n"
                 API4ConversationService.append_message(conv.id, conv.to_dict())
             except Exception as e:
@@ -427,8 +430,9 @@ def upload():
         location = filename
         while STORAGE_IMPL.obj_exist(kb_id, location):
             location += "_"
-        blob = request.files['file'].read()
-        STORAGE_IMPL.put(kb_id, location, blob)
+        stream = request.files['file'].stream
+        size = stream_size(stream)
+        STORAGE_IMPL.put_file(kb_id, location, stream, size)
         doc = {
             "id": get_uuid(),
             "kb_id": kb.id,
@@ -438,8 +442,8 @@ def upload():
             "type": filetype,
             "name": filename,
             "location": location,
-            "size": len(blob),
-            "thumbnail": thumbnail(filename, blob)
+            "size": size,
+            "thumbnail": thumbnail(filename, stream)
         }
 
         form_data = request.form
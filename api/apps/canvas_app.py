@@ -20,7 +20,8 @@ from flask_login import login_required, current_user
 from api.db.services.canvas_service import CanvasTemplateService, UserCanvasService
 from api.settings import RetCode
 from api.utils import get_uuid
-from api.utils.api_utils import get_json_result, server_error_response, validate_request, get_data_error_result
+from api.utils.api_utils import get_json_result, server_error_response, validate_request, get_data_error_result, \
+    AnswerStreamEncoder
 from agent.canvas import Canvas
 from peewee import MySQLDatabase, PostgresqlDatabase
 from api.db.db_models import APIToken
@@ -129,6 +130,12 @@ def run():
         return server_error_response(e)
 
     if stream:
+        # `stream_version` 2 streams deltas instead of the whole answer, see AnswerStreamEncoder
+        try:
+            encoder = AnswerStreamEncoder(req.get("stream_version", 1))
+        except ValueError as e:
+            return get_json_result(code=RetCode.ARGUMENT_ERROR, message=str(e))
+
         def sse():
             nonlocal answer, cvs
             try:
@@ -142,7 +149,7 @@ def run():
                     for k in ans.keys():
                         final_ans[k] = ans[k]
                     ans = {"answer": ans["content"], "reference": ans.get("reference", [])}
-                    yield "data:" + json.dumps({"code": 0, "message": "", "data": ans}, ensure_ascii=False) + "\n\n"
+                    yield "data:" + json.dumps({"code": 0, "message": "", "data": encoder.encode(ans)}, ensure_ascii=False) + "\n\n"
 
                 canvas.messages.append({"role": "assistant", "content": final_ans["content"], "id": message_id})
                 canvas.history.append(("assistant", final_ans["content"]))
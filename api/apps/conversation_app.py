@@ -17,10 +17,9 @@ import json
 import re
 import traceback
 from copy import deepcopy
-import trio
 from api.db.db_models import APIToken
 
-from api.db.services.conversation_service import ConversationService, structure_answer
+from api.db.services.conversation_service import ConversationService, ConversationMessageService, structure_answer
 from api.db.services.user_service import UserTenantService
 from flask import request, Response
 from flask_login import login_required, current_user
@@ -31,7 +30,8 @@ from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.llm_service import LLMBundle, TenantService
 from api import settings
 from api.utils.api_utils import get_json_result
-from api.utils.api_utils import server_error_response, get_data_error_result, validate_request
+from api.utils.api_utils import server_error_response, get_data_error_result, validate_request, AnswerStreamEncoder, \
+    run_trio
 from graphrag.general.mind_map_extractor import MindMapExtractor
 from rag.app.tag import label_question
 
@@ -46,13 +46,18 @@ def set_conversation():
     if not is_new:
         del req["conversation_id"]
         try:
+            messages = req.pop("message", None)
+            req.pop("reference", None)
             if not ConversationService.update_by_id(conv_id, req):
                 return get_data_error_result(message="Conversation not found!")
             e, conv = ConversationService.get_by_id(conv_id)
             if not e:
                 return get_data_error_result(
                     message="Fail to update a conversation!")
-            conv = conv.to_dict()
+            if messages is not None:
+                ConversationService.move_inline_messages(conv)
+                ConversationService.replace_messages(conv_id, messages)
+            conv = ConversationService.to_dict(conv)
             return get_json_result(data=conv)
         except Exception as e:
             return server_error_response(e)
@@ -67,7 +72,7 @@ def set_conversation():
             "name": req.get("name", "New conversation"),
             "message": [{"role": "assistant", "content": dia.prompt_config["prologue"]}]
         }
-        ConversationService.save(**conv)
+        ConversationService.create(**conv)
         return get_json_result(data=conv)
     except Exception as e:
         return server_error_response(e)
@@ -77,6 +82,9 @@ def set_conversation():
 @login_required
 def get():
     conv_id = request.args["conversation_id"]
+    # optional window over the messages, a negative offset counting from the end
+    offset = int(request.args.get("offset", 0))
+    limit = int(request.args["limit"]) if request.args.get("limit") else None
     try:
         
         e, conv = ConversationService.get_by_id(conv_id)
@@ -97,7 +105,8 @@ def get():
         def get_value(d, k1, k2):
             return d.get(k1, d.get(k2))
 
-        for ref in conv.reference:
+        messages, references, total = ConversationService.get_messages(conv, offset, limit)
+        for ref in references:
             if isinstance(ref, list):
                 continue
             ref["chunks"] = [{
@@ -111,6 +120,9 @@ def get():
             } for ck in ref.get("chunks", [])]
 
         conv = conv.to_dict()
+        conv["message"] = messages
+        conv["reference"] = references
+        conv["message_total"] = total
         conv["avatar"]=avatar
         return get_json_result(data=conv)
     except Exception as e:
@@ -174,7 +186,7 @@ def list_convsersation():
             order_by=ConversationService.model.create_time,
             reverse=True)
 
-        convs = [d.to_dict() for d in convs]
+        convs = ConversationService.fill_messages([dict(d.to_dict()) for d in convs])
         return get_json_result(data=convs)
     except Exception as e:
         return server_error_response(e)
@@ -197,42 +209,30 @@ def completion():
         e, conv = ConversationService.get_by_id(req["conversation_id"])
         if not e:
             return get_data_error_result(message="Conversation not found!")
-        conv.message = deepcopy(req["messages"])
         e, dia = DialogService.get_by_id(conv.dialog_id)
         if not e:
             return get_data_error_result(message="Dialog not found!")
+        ConversationService.move_inline_messages(conv)
+        # the client sends the whole history, only this turn is stored
+        messages = deepcopy(req["messages"])
         del req["conversation_id"]
         del req["messages"]
 
-        if not conv.reference:
-            conv.reference = []
-        else:
-            def get_value(d, k1, k2):
-                return d.get(k1, d.get(k2))
-
-            for ref in conv.reference:
-                if isinstance(ref, list):
-                    continue
-                ref["chunks"] = [{
-                    "id": get_value(ck, "chunk_id", "id"),
-                    "content": get_value(ck, "content", "content_with_weight"),
-                    "document_id": get_value(ck, "doc_id", "document_id"),
-                    "document_name": get_value(ck, "docnm_kwd", "document_name"),
-                    "dataset_id": get_value(ck, "kb_id", "dataset_id"),
-                    "image_id": get_value(ck, "image_id", "img_id"),
-                    "positions": get_value(ck, "positions", "position_int"),
-                } for ck in ref.get("chunks", [])]
-
-        if not conv.reference:
-            conv.reference = []
-        conv.reference.append({"chunks": [], "doc_aggs": []})
+        conv.message = []
+        conv.reference = [{"chunks": [], "doc_aggs": []}]
+        # `stream_version` 2 streams deltas instead of the whole answer, see AnswerStreamEncoder
+        try:
+            encoder = AnswerStreamEncoder(req.pop("stream_version", 1))
+        except ValueError as e:
+            return get_json_result(code=settings.RetCode.ARGUMENT_ERROR, message=str(e))
+
         def stream():
             nonlocal dia, msg, req, conv
             try:
                 for ans in chat(dia, msg, True, **req):
                     ans = structure_answer(conv, ans, message_id, conv.id)
-                    yield "data:" + json.dumps({"code": 0, "message": "", "data": ans}, ensure_ascii=False) + "\n\n"
-                ConversationService.update_by_id(conv.id, conv.to_dict())
+                    yield "data:" + json.dumps({"code": 0, "message": "", "data": encoder.encode(ans)}, ensure_ascii=False) + "\n\n"
+                ConversationService.save_turn(conv.id, messages, conv.message[-1], conv.reference[-1])
             except Exception as e:
                 traceback.print_exc()
                 yield "data:" + json.dumps({"code": 500, "message": str(e),
@@ -251,8 +251,8 @@ def completion():
         else:
             answer = None
             for ans in chat(dia, msg, **req):
-                answer = structure_answer(conv, ans, message_id, req["conversation_id"])
-                ConversationService.update_by_id(conv.id, conv.to_dict())
+                answer = structure_answer(conv, ans, message_id, conv.id)
+                ConversationService.save_turn(conv.id, messages, conv.message[-1], conv.reference[-1])
                 break
             return get_json_result(data=answer)
     except Exception as e:
@@ -302,18 +302,8 @@ def delete_msg():
     if not e:
         return get_data_error_result(message="Conversation not found!")
 
-    conv = conv.to_dict()
-    for i, msg in enumerate(conv["message"]):
-        if req["message_id"] != msg.get("id", ""):
-            continue
-        assert conv["message"][i + 1]["id"] == req["message_id"]
-        conv["message"].pop(i)
-        conv["message"].pop(i)
-        conv["reference"].pop(max(0, i // 2 - 1))
-        break
-
-    ConversationService.update_by_id(conv["id"], conv)
-    return get_json_result(data=conv)
+    ConversationService.delete_message(conv, req["message_id"])
+    return get_json_result(data=ConversationService.to_dict(conv))
 
 
 @manager.route('/thumbup', methods=['POST'])  # noqa: F821
@@ -326,21 +316,20 @@ def thumbup():
         return get_data_error_result(message="Conversation not found!")
     up_down = req.get("set")
     feedback = req.get("feedback", "")
-    conv = conv.to_dict()
-    for i, msg in enumerate(conv["message"]):
-        if req["message_id"] == msg.get("id", "") and msg.get("role", "") == "assistant":
-            if up_down:
-                msg["thumbup"] = True
-                if "feedback" in msg:
-                    del msg["feedback"]
-            else:
-                msg["thumbup"] = False
-                if feedback:
-                    msg["feedback"] = feedback
-            break
+    answer = ConversationService.get_answer(conv, req["message_id"])
+    if answer:
+        msg = answer.message
+        if up_down:
+            msg["thumbup"] = True
+            if "feedback" in msg:
+                del msg["feedback"]
+        else:
+            msg["thumbup"] = False
+            if feedback:
+                msg["feedback"] = feedback
+        ConversationMessageService.update_by_id(answer.id, {"message": msg})
 
-    ConversationService.update_by_id(conv["id"], conv)
-    return get_json_result(data=conv)
+    return get_json_result(data=ConversationService.to_dict(conv))
 
 
 @manager.route('/ask', methods=['POST'])  # noqa: F821
@@ -387,7 +376,7 @@ def mindmap():
                                            rank_feature=label_question(question, [kb])
                                            )
     mindmap = MindMapExtractor(chat_mdl)
-    mind_map = trio.run(mindmap, [c["content_with_weight"] for c in ranks["chunks"]])
+    mind_map = run_trio(mindmap, [c["content_with_weight"] for c in ranks["chunks"]])
     mind_map = mind_map.output
     if "error" in mind_map:
         return server_error_response(Exception(mind_map["error"]))
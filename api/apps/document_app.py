@@ -72,7 +72,7 @@ def upload():
         raise LookupError("Can't find this knowledgebase!")
 
     err, files = FileService.upload_document(kb, file_objs, current_user.id)
-    files = [f[0] for f in files] # remove the blob
+    files = [f[0] for f in files] # remove the file
     
     if err:
         return get_json_result(
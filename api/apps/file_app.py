@@ -30,7 +30,7 @@ from api.db.services import duplicate_name
 from api.db.services.file_service import FileService
 from api import settings
 from api.utils.api_utils import get_json_result
-from api.utils.file_utils import filename_type
+from api.utils.file_utils import filename_type, stream_size
 from rag.utils.storage_factory import STORAGE_IMPL
 
 
@@ -97,7 +97,7 @@ def upload():
             location = file_obj_names[file_len - 1]
             while STORAGE_IMPL.obj_exist(last_folder.id, location):
                 location += "_"
-            blob = file_obj.read()
+            size = stream_size(file_obj.stream)
             filename = duplicate_name(
                 FileService.query,
                 name=file_obj_names[file_len - 1],
@@ -110,10 +110,10 @@ def upload():
                 "type": filetype,
                 "name": filename,
                 "location": location,
-                "size": len(blob),
+                "size": size,
             }
             file = FileService.insert(file)
-            STORAGE_IMPL.put(last_folder.id, location, blob)
+            STORAGE_IMPL.put_file(last_folder.id, location, file_obj.stream, size)
             file_res.append(file.to_json())
         return get_json_result(data=file_res)
     except Exception as e:
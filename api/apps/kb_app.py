@@ -316,6 +316,7 @@ def knowledge_graph(kb_id):
 
         obj[ty] = content_json
 
+    # the manifest holds the top of the graph, set_graph cut it; older manifests hold the whole graph
     if "nodes" in obj["graph"]:
         obj["graph"]["nodes"] = sorted(obj["graph"]["nodes"], key=lambda x: x.get("pagerank", 0), reverse=True)[:256]
         if "edges" in obj["graph"]:
@@ -17,6 +17,7 @@ import re
 import json
 import time
 
+from api import settings
 from api.db import LLMType
 from api.db.services.conversation_service import ConversationService, iframe_completion
 from api.db.services.conversation_service import completion as rag_completion
@@ -30,7 +31,7 @@ from api.db.services.canvas_service import UserCanvasService
 from api.db.services.dialog_service import DialogService
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.utils import get_uuid
-from api.utils.api_utils import get_error_data_result, validate_request
+from api.utils.api_utils import get_error_data_result, validate_request, AnswerStreamEncoder
 from api.utils.api_utils import get_result, token_required
 from api.db.services.llm_service import LLMBundle
 from api.db.services.file_service import FileService
@@ -54,11 +55,11 @@ def create(tenant_id, chat_id):
     }
     if not conv.get("name"):
         return get_error_data_result(message="`name` can not be empty.")
-    ConversationService.save(**conv)
+    ConversationService.create(**conv)
     e, conv = ConversationService.get_by_id(conv["id"])
     if not e:
         return get_error_data_result(message="Fail to create a session!")
-    conv = conv.to_dict()
+    conv = ConversationService.to_dict(conv)
     conv['messages'] = conv.pop("message")
     conv["chat_id"] = conv.pop("dialog_id")
     del conv["reference"]
@@ -169,6 +170,11 @@ def chat_completion(tenant_id, chat_id):
     if req.get("session_id"):
         if not ConversationService.query(id=req["session_id"], dialog_id=chat_id):
             return get_error_data_result(f"You don't own the session {req['session_id']}")
+    try:
+        # checked here, the stream only builds its encoder once the response started
+        AnswerStreamEncoder(req.get("stream_version", 1))
+    except ValueError as e:
+        return get_error_data_result(str(e), code=settings.RetCode.ARGUMENT_ERROR)
     if req.get("stream", True):
         resp = Response(rag_completion(tenant_id, chat_id, **req), mimetype="text/event-stream")
         resp.headers.add_header("Cache-control", "no-cache")
@@ -22,7 +22,8 @@ from flask_login import login_required, current_user
 from api.db.db_models import APIToken
 from api.db.services.api_service import APITokenService
 from api.db.services.knowledgebase_service import KnowledgebaseService
-from api.db.services.user_service import UserTenantService
+from api.db.services.llm_service import MODEL_REGISTRY
+from api.db.services.user_service import UserService, UserTenantService
 from api import settings
 from api.utils import current_timestamp, datetime_format
 from api.utils.api_utils import (
@@ -35,6 +36,7 @@ from api.versions import get_ragflow_version
 from rag.utils.storage_factory import STORAGE_IMPL, STORAGE_IMPL_TYPE
 from timeit import default_timer as timer
 
+from rag.llm import batching
 from rag.utils.redis_conn import REDIS_CONN
 
 
@@ -166,6 +168,12 @@ def status():
     except Exception:
         logging.exception("get task executor heartbeats failed!")
     res["task_executor_heartbeats"] = task_executor_heartbeats
+    # model calls made by this server process
+    res["llm_latency"] = MODEL_REGISTRY.latency_stats()
+    # token lookups of this server process
+    res["auth_cache"] = {"user": UserService.auth_cache.stats(), "api_token": APITokenService.auth_cache.stats()}
+    # batches of the local embedding and rerank models of this server process
+    res["local_inference"] = batching.stats()
 
     return get_json_result(data=res)
 
@@ -297,4 +305,5 @@ def rm(token):
     APITokenService.filter_delete(
         [APIToken.tenant_id == current_user.id, APIToken.token == token]
     )
+    APITokenService.invalidate(token)
     return get_json_result(data=True)
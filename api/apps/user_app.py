@@ -19,7 +19,7 @@ import re
 from datetime import datetime
 
 from flask import request, session, redirect
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from flask_login import login_required, current_user, login_user, logout_user
 
 from api.db.db_models import TenantLLM
@@ -100,11 +100,13 @@ def login():
     user = UserService.query_user(email, password)
     if user:
         response_data = user.to_json()
+        old_token = user.access_token
         user.access_token = get_uuid()
         login_user(user)
         user.update_time = (current_timestamp(),)
         user.update_date = (datetime_format(datetime.now()),)
         user.save()
+        UserService.invalidate_access_token(old_token)
         msg = "Welcome back!"
         return construct_response(data=response_data, auth=user.get_id(), message=msg)
     else:
@@ -194,9 +196,11 @@ def github_callback():
 
     # User has already registered, try to log in
     user = users[0]
+    old_token = user.access_token
     user.access_token = get_uuid()
     login_user(user)
     user.save()
+    UserService.invalidate_access_token(old_token)
     return redirect("/?auth=%s" % user.get_id())
 
 
@@ -296,9 +300,11 @@ def feishu_callback():
 
     # User has already registered, try to log in
     user = users[0]
+    old_token = user.access_token
     user.access_token = get_uuid()
     login_user(user)
     user.save()
+    UserService.invalidate_access_token(old_token)
     return redirect("/?auth=%s" % user.get_id())
 
 
@@ -351,8 +357,9 @@ def log_out():
         schema:
           type: object
     """
-    current_user.access_token = ""
-    current_user.save()
+    # current_user is rebuilt from the auth cache: only write the column that changes
+    UserService.update_by_id(current_user.id, {"access_token": ""})
+    UserService.invalidate_access_token(current_user.access_token)
     logout_user()
     return get_json_result(data=True)
 
@@ -391,9 +398,8 @@ def setting_user():
     request_data = request.json
     if request_data.get("password"):
         new_password = request_data.get("new_password")
-        if not check_password_hash(
-                current_user.password, decrypt(request_data["password"])
-        ):
+        # the auth cache doesn't keep password hashes
+        if not UserService.query_user(current_user.email, decrypt(request_data["password"])):
             return get_json_result(
                 data=False,
                 code=settings.RetCode.AUTHENTICATION_ERROR,
@@ -421,6 +427,7 @@ def setting_user():
 
     try:
         UserService.update_by_id(current_user.id, update_dict)
+        UserService.invalidate_access_token(current_user.access_token)
         return get_json_result(data=True)
     except Exception as e:
         logging.exception(e)
@@ -699,6 +706,7 @@ def set_tenant_info():
     try:
         tid = req.pop("tenant_id")
         TenantService.update_by_id(tid, req)
+        TenantLLMService.invalidate_model_cache(tid)
         return get_json_result(data=True)
     except Exception as e:
         return server_error_response(e)
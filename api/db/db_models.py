@@ -287,6 +287,9 @@ class BaseDataBase:
     def __init__(self):
         database_config = settings.DATABASE.copy()
         db_name = database_config.pop("name")
+        if settings.API_SERVER_MODE == "gevent":
+            # far more requests than pooled connections run at once, wait for a free one instead of failing
+            database_config.setdefault("timeout", 30)
         self.database_connection = PooledDatabase[settings.DATABASE_TYPE.upper()].value(db_name, **database_config)
         logging.info('init database on cluster mode successfully')
 
@@ -927,11 +930,26 @@ class Conversation(DataBaseModel):
     message = JSONField(null=True)
     reference = JSONField(null=True, default=[])
     user_id = CharField(max_length=255, null=True, help_text="user_id", index=True)
+    message_seq = IntegerField(default=0, help_text="sequence number of the next message in conversation_message")
 
     class Meta:
         db_table = "conversation"
 
 
+class ConversationMessage(DataBaseModel):
+    id = CharField(max_length=32, primary_key=True)
+    conversation_id = CharField(max_length=32, null=False, index=True)
+    seq = IntegerField(null=False, help_text="position in the conversation")
+    message_id = CharField(max_length=64, null=True, index=True, help_text="id of the question or of its answer")
+    role = CharField(max_length=16, null=False, help_text="user|assistant|system")
+    message = JSONField(null=False, default={})
+    reference = JSONField(null=True, help_text="reference of an answer")
+
+    class Meta:
+        db_table = "conversation_message"
+        indexes = ((("conversation_id", "seq"), True),)
+
+
 class APIToken(DataBaseModel):
     tenant_id = CharField(max_length=32, null=False, index=True)
     token = CharField(max_length=255, null=False, index=True)
@@ -1122,3 +1140,11 @@ def migrate_db():
             )
         except Exception:
             pass
+        try:
+            migrate(
+                migrator.add_column("conversation", "message_seq",
+                                    IntegerField(default=0,
+                                                 help_text="sequence number of the next message in conversation_message"))
+            )
+        except Exception:
+            pass
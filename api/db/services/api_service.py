@@ -20,10 +20,27 @@ import peewee
 from api.db.db_models import DB, API4Conversation, APIToken, Dialog
 from api.db.services.common_service import CommonService
 from api.utils import current_timestamp, datetime_format
+from api.utils.auth_cache import AuthCache
 
 
 class APITokenService(CommonService):
     model = APIToken
+    auth_cache = AuthCache("api_token")
+
+    @classmethod
+    def get_tenant_id(cls, token):
+        """The tenant owning the API key `token`, served from the auth cache."""
+        def load():
+            objs = cls.query(token=token)
+            return objs[0].tenant_id if objs else None
+
+        if not token:
+            return None
+        return cls.auth_cache.get(token, load)
+
+    @classmethod
+    def invalidate(cls, token):
+        cls.auth_cache.invalidate(token)
 
     @classmethod
     @DB.connection_context()
@@ -14,18 +14,25 @@
 #  limitations under the License.
 #
 import time
+from collections import defaultdict
 from uuid import uuid4
+from api import settings
 from api.db import StatusEnum
-from api.db.db_models import Conversation, DB
+from api.db.db_models import Conversation, ConversationMessage, DB
 from api.db.services.api_service import API4ConversationService
 from api.db.services.common_service import CommonService
 from api.db.services.dialog_service import DialogService, chat
 from api.utils import get_uuid
+from api.utils.api_utils import AnswerStreamEncoder
 import json
 
 from rag.prompts import chunks_format
 
 
+class ConversationMessageService(CommonService):
+    model = ConversationMessage
+
+
 class ConversationService(CommonService):
     model = Conversation
 
@@ -46,7 +53,184 @@ class ConversationService(CommonService):
 
         sessions = sessions.paginate(page_number, items_per_page)
 
-        return list(sessions.dicts())
+        return cls.fill_messages(list(sessions.dicts()))
+
+    @classmethod
+    @DB.connection_context()
+    def create(cls, **kwargs):
+        """Save a new conversation, its `message` (usually the prologue) going to conversation_message."""
+        messages = kwargs.pop("message", None) or []
+        with DB.atomic():
+            cls.save(message=[], reference=[], message_seq=0, **kwargs)
+            cls.append_messages(kwargs["id"], messages)
+
+    @classmethod
+    @DB.connection_context()
+    def delete_by_id(cls, pid):
+        with DB.atomic():
+            ConversationMessage.delete().where(ConversationMessage.conversation_id == pid).execute()
+            return cls.model.delete().where(cls.model.id == pid).execute()
+
+    @classmethod
+    @DB.connection_context()
+    def append_messages(cls, conv_id, messages, references=None):
+        """
+        Append `messages` to a conversation, with the reference of each one
+        (aligned with `messages`, None if it has none). Nothing else of the
+        conversation is read or written, whatever its length.
+        """
+        if not messages:
+            return
+        references = references or [None] * len(messages)
+        with DB.atomic():
+            seq = cls.model.select(cls.model.message_seq).where(cls.model.id == conv_id).for_update().scalar() or 0
+            ConversationMessageService.insert_many([{
+                "id": get_uuid(),
+                "conversation_id": conv_id,
+                "seq": seq + i,
+                "message_id": str(m["id"])[:64] if m.get("id") else None,
+                "role": m.get("role", ""),
+                "message": m,
+                "reference": r
+            } for i, (m, r) in enumerate(zip(messages, references))])
+            cls.model.update(message_seq=seq + len(messages)).where(cls.model.id == conv_id).execute()
+
+    @classmethod
+    @DB.connection_context()
+    def replace_messages(cls, conv_id, messages):
+        """Replace the whole history, keeping the reference stored for each answer still in it."""
+        M = ConversationMessage
+        with DB.atomic():
+            cls.model.select(cls.model.id).where(cls.model.id == conv_id).for_update().execute()
+            kept = {(r.message_id, r.role): r.reference
+                    for r in M.select(M.message_id, M.role, M.reference).where(M.conversation_id == conv_id)
+                    if r.message_id and r.reference is not None}
+            M.delete().where(M.conversation_id == conv_id).execute()
+            cls.model.update(message_seq=0).where(cls.model.id == conv_id).execute()
+            cls.append_messages(conv_id, messages, [kept.get((m.get("id"), m.get("role"))) for m in messages])
+
+    @classmethod
+    @DB.connection_context()
+    def move_inline_messages(cls, conv):
+        """
+        Move the history of a conversation saved before conversation_message
+        existed, i.e. inline in its `message` and `reference`, to
+        conversation_message. Done once, on its first write.
+        """
+        if not conv.message:
+            return
+        messages, references = conv.message, _align_references(conv.message, conv.reference)
+        conv.message, conv.reference = [], []
+        with DB.atomic():
+            # another request may have moved it meanwhile
+            if not list(cls.model.select(cls.model.id).where(
+                    (cls.model.id == conv.id) & (cls.model.message_seq == 0)).for_update()):
+                return
+            cls.model.update(message=[], reference=[]).where(cls.model.id == conv.id).execute()
+            cls.append_messages(conv.id, messages, references)
+
+    @classmethod
+    @DB.connection_context()
+    def save_turn(cls, conv_id, messages, answer, reference):
+        """
+        Store a question and its answer. `messages` is the history as the
+        client sent it: only what follows the last stored message is
+        appended, the history is only rewritten when the client's has
+        diverged from the stored one.
+        """
+        M = ConversationMessage
+        last = M.select(M.message_id, M.role).where(M.conversation_id == conv_id).order_by(M.seq.desc()).first()
+        start = 0
+        if last:
+            start = None
+            for i in range(len(messages) - 1, -1, -1):
+                if messages[i].get("role") == last.role and (messages[i].get("id") or None) == last.message_id:
+                    start = i + 1
+                    break
+        with DB.atomic():
+            if start is None:
+                cls.replace_messages(conv_id, messages)
+                start = len(messages)
+            new = messages[start:]
+            cls.append_messages(conv_id, new + [answer], [None] * len(new) + [reference])
+
+    @classmethod
+    @DB.connection_context()
+    def get_messages(cls, conv, offset=0, limit=None):
+        """
+        Messages [offset, offset + limit) of a conversation, a negative offset
+        counting from the end, with the references of the answers among them
+        and the total number of messages.
+        """
+        if conv.message:
+            references = _align_references(conv.message, conv.reference)
+            total = len(conv.message)
+            offset = max(0, total + offset) if offset < 0 else offset
+            end = total if limit is None else offset + limit
+            return conv.message[offset:end], [r for r in references[offset:end] if r is not None], total
+
+        M = ConversationMessage
+        rows = M.select().where(M.conversation_id == conv.id)
+        total = rows.count()
+        offset = max(0, total + offset) if offset < 0 else offset
+        rows = rows.order_by(M.seq.asc()).offset(offset)
+        if limit is not None:
+            rows = rows.limit(limit)
+        rows = list(rows)
+        return [r.message for r in rows], [r.reference for r in rows if r.reference is not None], total
+
+    @classmethod
+    @DB.connection_context()
+    def fill_messages(cls, convs: list[dict]) -> list[dict]:
+        """Fill `message` and `reference` of conversation dicts from conversation_message, in one query."""
+        ids = [c["id"] for c in convs if not c.get("message")]
+        if not ids:
+            return convs
+        M = ConversationMessage
+        rows = defaultdict(list)
+        for r in M.select().where(M.conversation_id.in_(ids)).order_by(M.conversation_id, M.seq.asc()):
+            rows[r.conversation_id].append(r)
+        for c in convs:
+            if c["id"] in ids:
+                c["message"] = [r.message for r in rows[c["id"]]]
+                c["reference"] = [r.reference for r in rows[c["id"]] if r.reference is not None]
+        return convs
+
+    @classmethod
+    def to_dict(cls, conv) -> dict:
+        return cls.fill_messages([dict(conv.to_dict())])[0]
+
+    @classmethod
+    @DB.connection_context()
+    def delete_message(cls, conv, message_id):
+        """Delete a question and its answer, both carrying `message_id`."""
+        cls.move_inline_messages(conv)
+        M = ConversationMessage
+        return M.delete().where((M.conversation_id == conv.id) & (M.message_id == message_id)).execute()
+
+    @classmethod
+    @DB.connection_context()
+    def get_answer(cls, conv, message_id):
+        """The stored row of the answer to question `message_id`, or None."""
+        cls.move_inline_messages(conv)
+        M = ConversationMessage
+        return M.select().where((M.conversation_id == conv.id) & (M.message_id == message_id) &
+                                (M.role == "assistant")).first()
+
+
+def _align_references(messages, references):
+    """
+    The reference of each message of a history stored inline, where the
+    references follow the answers after the first message (the prologue).
+    """
+    references = list(references or [])
+    aligned = []
+    for i, m in enumerate(messages):
+        if i > 0 and m.get("role") == "assistant" and references:
+            aligned.append(references.pop(0))
+        else:
+            aligned.append(None)
+    return aligned
 
 
 def structure_answer(conv, ans, message_id, session_id):
@@ -75,7 +259,8 @@ def structure_answer(conv, ans, message_id, session_id):
     return ans
 
 
-def completion(tenant_id, chat_id, question, name="New session", session_id=None, stream=True, **kwargs):
+def completion(tenant_id, chat_id, question, name="New session", session_id=None, stream=True, stream_version=1,
+               **kwargs):
     assert name, "`name` can not be empty."
     dia = DialogService.query(id=chat_id, tenant_id=tenant_id, status=StatusEnum.VALID.value)
     assert dia, "You do not own the chat."
@@ -89,7 +274,7 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
             "message": [{"role": "assistant", "content": dia[0].prompt_config.get("prologue"), "created_at": time.time()}],
             "user_id": kwargs.get("user_id", "")
         }
-        ConversationService.save(**conv)
+        ConversationService.create(**conv)
         yield "data:" + json.dumps({"code": 0, "message": "",
                                     "data": {
                                         "answer": conv["message"][0]["content"],
@@ -107,6 +292,8 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
         raise LookupError("Session does not exist")
 
     conv = conv[0]
+    ConversationService.move_inline_messages(conv)
+    conv.message, _, _ = ConversationService.get_messages(conv, offset=-settings.CONVERSATION_HISTORY_WINDOW)
     msg = []
     question = {
         "content": question,
@@ -123,17 +310,16 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
     message_id = msg[-1].get("id")
     e, dia = DialogService.get_by_id(conv.dialog_id)
 
-    if not conv.reference:
-        conv.reference = []
     conv.message.append({"role": "assistant", "content": "", "id": message_id})
-    conv.reference.append({"chunks": [], "doc_aggs": []})
+    conv.reference = [{"chunks": [], "doc_aggs": []}]
 
     if stream:
+        encoder = AnswerStreamEncoder(stream_version)
         try:
             for ans in chat(dia, msg, True, **kwargs):
                 ans = structure_answer(conv, ans, message_id, session_id)
-                yield "data:" + json.dumps({"code": 0, "data": ans}, ensure_ascii=False) + "\n\n"
-            ConversationService.update_by_id(conv.id, conv.to_dict())
+                yield "data:" + json.dumps({"code": 0, "data": encoder.encode(ans)}, ensure_ascii=False) + "\n\n"
+            ConversationService.append_messages(conv.id, [question, conv.message[-1]], [None, conv.reference[-1]])
         except Exception as e:
             yield "data:" + json.dumps({"code": 500, "message": str(e),
                                         "data": {"answer": "**ERROR**: " + str(e), "reference": []}},
@@ -144,7 +330,7 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
         answer = None
         for ans in chat(dia, msg, False, **kwargs):
             answer = structure_answer(conv, ans, message_id, session_id)
-            ConversationService.update_by_id(conv.id, conv.to_dict())
+            ConversationService.append_messages(conv.id, [question, conv.message[-1]], [None, conv.reference[-1]])
             break
         yield answer
 
@@ -203,10 +389,12 @@ def iframe_completion(dialog_id, question, session_id=None, stream=True, **kwarg
     conv.reference.append({"chunks": [], "doc_aggs": []})
 
     if stream:
+        # whole answers, without the internal `delta`
+        encoder = AnswerStreamEncoder(1)
         try:
             for ans in chat(dia, msg, True, **kwargs):
                 ans = structure_answer(conv, ans, message_id, session_id)
-                yield "data:" + json.dumps({"code": 0, "message": "", "data": ans},
+                yield "data:" + json.dumps({"code": 0, "message": "", "data": encoder.encode(ans)},
                                            ensure_ascii=False) + "\n\n"
             API4ConversationService.append_message(conv.id, conv.to_dict())
         except Exception as e:
@@ -22,13 +22,13 @@ from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
 from io import BytesIO
-import trio
 
 from peewee import fn
 
 from api.db.db_utils import bulk_insert_into_db
 from api import settings
 from api.utils import current_timestamp, get_format_time, get_uuid
+from api.utils.api_utils import run_trio
 from rag.settings import SVR_QUEUE_NAME
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.nlp import search, rag_tokenizer
@@ -114,8 +114,12 @@ class DocumentService(CommonService):
             settings.docStoreConn.update({"kb_id": doc.kb_id, "knowledge_graph_kwd": ["graph"]},
                                          {"removed_kwd": "Y"},
                                          search.index_name(tenant_id), doc.kb_id)
+            settings.docStoreConn.delete({"kb_id": doc.kb_id, "knowledge_graph_kwd": ["subgraph"], "source_id": doc.id},
+                                         search.index_name(tenant_id), doc.kb_id)
             settings.docStoreConn.delete({"kb_id": doc.kb_id, "knowledge_graph_kwd": ["entity", "relation", "graph", "community_report"], "must_not": {"exists": "source_id"}},
                                          search.index_name(tenant_id), doc.kb_id)
+            if STORAGE_IMPL.obj_exist(doc.kb_id, f"raptor_tree_{doc.id}.z"):
+                STORAGE_IMPL.rm(doc.kb_id, f"raptor_tree_{doc.id}.z")
         except Exception:
             pass
         return cls.delete_by_id(doc.id)
@@ -518,9 +522,11 @@ def doc_upload_and_parse(conversation_id, file_objs, user_id):
     exe = ThreadPoolExecutor(max_workers=12)
     threads = []
     doc_nm = {}
-    for d, blob in files:
+    for d, _ in files:
         doc_nm[d["id"]] = d["name"]
-    for d, blob in files:
+    for d, file in files:
+        file.stream.seek(0)
+        blob = file.read()
         kwargs = {
             "callback": dummy,
             "parser_config": parser_config,
@@ -586,7 +592,7 @@ def doc_upload_and_parse(conversation_id, file_objs, user_id):
             from graphrag.general.mind_map_extractor import MindMapExtractor
             mindmap = MindMapExtractor(llm_bdl)
             try:
-                mind_map = trio.run(mindmap, [c["content_with_weight"] for c in docs if c["doc_id"] == doc_id])
+                mind_map = run_trio(mindmap, [c["content_with_weight"] for c in docs if c["doc_id"] == doc_id])
                 mind_map = json.dumps(mind_map.output, ensure_ascii=False, indent=2)
                 if len(mind_map) < 32:
                     raise Exception("Few content: " + mind_map)
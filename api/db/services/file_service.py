@@ -29,7 +29,7 @@ from api.db.services.common_service import CommonService
 from api.db.services.document_service import DocumentService
 from api.db.services.file2document_service import File2DocumentService
 from api.utils import get_uuid
-from api.utils.file_utils import filename_type, thumbnail_img
+from api.utils.file_utils import filename_type, thumbnail_img, stream_size
 from rag.utils.storage_factory import STORAGE_IMPL
 
 
@@ -356,12 +356,13 @@ class FileService(CommonService):
                 location = filename
                 while STORAGE_IMPL.obj_exist(kb.id, location):
                     location += "_"
-                blob = file.read()
-                STORAGE_IMPL.put(kb.id, location, blob)
+                # werkzeug spools large uploads to disk: stream them to the store in parts
+                size = stream_size(file.stream)
+                STORAGE_IMPL.put_file(kb.id, location, file.stream, size)
 
                 doc_id = get_uuid()
 
-                img = thumbnail_img(filename, blob)
+                img = thumbnail_img(filename, file.stream)
                 thumbnail_location = ''
                 if img is not None:
                     thumbnail_location = f'thumbnail_{doc_id}.png'
@@ -376,13 +377,13 @@ class FileService(CommonService):
                     "type": filetype,
                     "name": filename,
                     "location": location,
-                    "size": len(blob),
+                    "size": size,
                     "thumbnail": thumbnail_location
                 }
                 DocumentService.insert(doc)
 
                 FileService.add_file_from_kb(doc, kb_folder["id"], kb.tenant_id)
-                files.append((doc, blob))
+                files.append((doc, file))
             except Exception as e:
                 err.append(file.filename + ": " + str(e))
 
@@ -16,6 +16,13 @@
 import json
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from copy import deepcopy
+from timeit import default_timer as timer
+
+import xxhash
 
 from api.db.services.user_service import TenantService
 from api.utils.file_utils import get_project_base_directory
@@ -24,6 +31,113 @@ from api.db import LLMType
 from api.db.db_models import DB
 from api.db.db_models import LLMFactories, LLM, TenantLLM
 from api.db.services.common_service import CommonService
+from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+
+
+USAGE_PENDING_KEY = "tenant_llm_usage:pending"
+USAGE_FLUSHING_KEY = "tenant_llm_usage:flushing"
+USAGE_FLUSH_INTERVAL = int(os.environ.get("USAGE_FLUSH_INTERVAL", 10))
+
+_usage_flusher_pid = None
+_usage_flusher_lock = threading.Lock()
+
+
+def _start_usage_flusher():
+    global _usage_flusher_pid
+    # a forked child doesn't inherit the thread of its parent
+    if _usage_flusher_pid == os.getpid():
+        return
+    with _usage_flusher_lock:
+        if _usage_flusher_pid == os.getpid():
+            return
+        threading.Thread(target=_flush_usage_periodically, name="usage_flusher", daemon=True).start()
+        _usage_flusher_pid = os.getpid()
+
+
+def _flush_usage_periodically():
+    while True:
+        time.sleep(USAGE_FLUSH_INTERVAL)
+        try:
+            TenantLLMService.flush_usage()
+        except Exception:
+            logging.exception("Fail to flush the token usage.")
+
+
+def model_config_generation_key(tenant_id):
+    return f"tenant_llm_generation:{tenant_id}"
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of resolved model configs and of the provider clients
+    built from them, so that an LLMBundle doesn't hit the database or open a
+    new HTTP connection pool each time. A client is shared by all the
+    concurrent calls of the tenant, so it must not keep per-call state
+    (system prompt, audio buffers) on the instance. Configs expire after `ttl` seconds
+    and whenever the tenant's generation in Redis is bumped by
+    `invalidate`; clients are keyed by their whole config (api key hashed)
+    and the least recently used ones are dropped beyond `size`.
+    """
+
+    def __init__(self, size=256, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._configs = {}
+        self._clients = OrderedDict()
+        self._latency = defaultdict(lambda: {"count": 0, "total": 0.0, "max": 0.0})
+
+    def get_config(self, tenant_id, llm_type, llm_name, loader):
+        key = (tenant_id, str(llm_type), llm_name)
+        generation = REDIS_CONN.get(model_config_generation_key(tenant_id))
+        with self._lock:
+            hit = self._configs.get(key)
+        if hit and hit[0] == generation and hit[1] > time.time():
+            return deepcopy(hit[2])
+        config = loader()
+        with self._lock:
+            self._configs[key] = (generation, time.time() + self.ttl, config)
+        return deepcopy(config)
+
+    def get_client(self, key, builder):
+        with self._lock:
+            if key in self._clients:
+                self._clients.move_to_end(key)
+                return self._clients[key]
+        client = builder()
+        if client is None:
+            return None
+        with self._lock:
+            self._clients[key] = client
+            while len(self._clients) > self.size:
+                self._clients.popitem(last=False)
+        return client
+
+    def invalidate(self, tenant_id):
+        REDIS_CONN.set(model_config_generation_key(tenant_id), str(time.time()), 24 * 3600)
+        with self._lock:
+            for key in [k for k in self._configs if k[0] == tenant_id]:
+                del self._configs[key]
+            for key in [k for k in self._clients if k[0] == tenant_id]:
+                del self._clients[key]
+
+    def record_latency(self, factory, elapsed):
+        with self._lock:
+            st = self._latency[factory]
+            st["count"] += 1
+            st["total"] += elapsed
+            st["max"] = max(st["max"], elapsed)
+
+    def latency_stats(self) -> dict:
+        """Calls, mean and max latency in milliseconds per model provider, since the process started."""
+        with self._lock:
+            return {f: {"count": st["count"],
+                        "avg_ms": "{:.1f}".format(st["total"] / st["count"] * 1000.0),
+                        "max_ms": "{:.1f}".format(st["max"] * 1000.0)}
+                    for f, st in self._latency.items() if st["count"]}
+
+
+MODEL_REGISTRY = ModelRegistry()
 
 
 class LLMFactoriesService(CommonService):
@@ -85,8 +199,18 @@ class TenantLLMService(CommonService):
         return model_name, None
 
     @classmethod
-    @DB.connection_context()
     def get_model_config(cls, tenant_id, llm_type, llm_name=None):
+        return MODEL_REGISTRY.get_config(tenant_id, llm_type, llm_name,
+                                         lambda: cls._get_model_config(tenant_id, llm_type, llm_name))
+
+    @classmethod
+    def invalidate_model_cache(cls, tenant_id):
+        """To be called once the models or the default models of the tenant changed."""
+        MODEL_REGISTRY.invalidate(tenant_id)
+
+    @classmethod
+    @DB.connection_context()
+    def _get_model_config(cls, tenant_id, llm_type, llm_name=None):
         e, tenant = TenantService.get_by_id(tenant_id)
         if not e:
             raise LookupError("Tenant not found")
@@ -126,10 +250,18 @@ class TenantLLMService(CommonService):
         return model_config
 
     @classmethod
-    @DB.connection_context()
     def model_instance(cls, tenant_id, llm_type,
                        llm_name=None, lang="Chinese"):
         model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+        if llm_type == LLMType.TTS.value:
+            # TTS clients keep the audio of the call in progress on the instance: not shareable
+            return cls._build_model(model_config, llm_type, lang)
+        key = (tenant_id, str(llm_type), model_config["llm_factory"], model_config["llm_name"],
+               model_config["api_base"], xxhash.xxh64(str(model_config["api_key"]).encode("utf-8")).hexdigest(), lang)
+        return MODEL_REGISTRY.get_client(key, lambda: cls._build_model(model_config, llm_type, lang))
+
+    @staticmethod
+    def _build_model(model_config, llm_type, lang):
         if llm_type == LLMType.EMBEDDING.value:
             if model_config["llm_factory"] not in EmbeddingModel:
                 return
@@ -174,13 +306,31 @@ class TenantLLMService(CommonService):
             )
 
     @classmethod
-    @DB.connection_context()
     def increase_usage(cls, tenant_id, llm_type, used_tokens, llm_name=None):
+        """
+        Count `used_tokens` for the model. The count is added up in a Redis
+        hash and written to the database by `flush_usage`, which a daemon
+        thread runs every USAGE_FLUSH_INTERVAL seconds; only if Redis can't
+        be reached is it written right away.
+        """
+        if not used_tokens:
+            return True
+        field = json.dumps([tenant_id, str(llm_type), llm_name])
+        if REDIS_CONN.hincrby(USAGE_PENDING_KEY, field, int(used_tokens)):
+            _start_usage_flusher()
+            return True
+
         e, tenant = TenantService.get_by_id(tenant_id)
         if not e:
             logging.error(f"Tenant not found: {tenant_id}")
             return 0
+        mdl = cls._usage_model(tenant, llm_type, llm_name)
+        if mdl is None:
+            return 0
+        return cls._add_used_tokens(tenant_id, *mdl, used_tokens) or 0
 
+    @staticmethod
+    def _usage_model(tenant, llm_type, llm_name=None):
         llm_map = {
             LLMType.EMBEDDING.value: tenant.embd_id,
             LLMType.SPEECH2TEXT.value: tenant.asr_id,
@@ -193,12 +343,15 @@ class TenantLLMService(CommonService):
         mdlnm = llm_map.get(llm_type)
         if mdlnm is None:
             logging.error(f"LLM type error: {llm_type}")
-            return 0
+            return None
 
-        llm_name, llm_factory = TenantLLMService.split_model_name_and_factory(mdlnm)
+        return TenantLLMService.split_model_name_and_factory(mdlnm)
 
+    @classmethod
+    @DB.connection_context()
+    def _add_used_tokens(cls, tenant_id, llm_name, llm_factory, used_tokens):
         try:
-            num = cls.model.update(
+            return cls.model.update(
                 used_tokens=cls.model.used_tokens + used_tokens
             ).where(
                 cls.model.tenant_id == tenant_id,
@@ -209,9 +362,52 @@ class TenantLLMService(CommonService):
             logging.exception(
                 "TenantLLMService.increase_usage got exception,Failed to update used_tokens for tenant_id=%s, llm_name=%s",
                 tenant_id, llm_name)
-            return 0
+            return None
 
-        return num
+    @classmethod
+    @DB.connection_context()
+    def flush_usage(cls):
+        """
+        Write the token counts gathered in Redis to the database with one
+        UPDATE per model. The pending hash is renamed before it's read, and
+        every count is deleted only after its UPDATE, so counts of a flush
+        that failed half way are taken up by the next one.
+        """
+        lock = RedisDistributedLock("tenant_llm_usage:flush_lock", timeout=60, blocking_timeout=0)
+        if not lock.acquire():
+            return
+        try:
+            if not REDIS_CONN.exist(USAGE_FLUSHING_KEY):
+                if not REDIS_CONN.exist(USAGE_PENDING_KEY):
+                    return
+                REDIS_CONN.rename(USAGE_PENDING_KEY, USAGE_FLUSHING_KEY)
+            pending = REDIS_CONN.hgetall(USAGE_FLUSHING_KEY) or {}
+
+            tenants = {}
+            totals = defaultdict(lambda: [0, []])
+            for field, used_tokens in pending.items():
+                tenant_id, llm_type, llm_name = json.loads(field)
+                if tenant_id not in tenants:
+                    e, tenants[tenant_id] = TenantService.get_by_id(tenant_id)
+                    if not e:
+                        logging.error(f"Tenant not found: {tenant_id}")
+                mdl = cls._usage_model(tenants[tenant_id], llm_type, llm_name) if tenants[tenant_id] else None
+                if mdl is None:
+                    REDIS_CONN.hdel(USAGE_FLUSHING_KEY, field)
+                    continue
+                totals[(tenant_id, *mdl)][0] += int(used_tokens)
+                totals[(tenant_id, *mdl)][1].append(field)
+
+            for (tenant_id, llm_name, llm_factory), (used_tokens, fields) in totals.items():
+                if cls._add_used_tokens(tenant_id, llm_name, llm_factory, used_tokens) is None:
+                    continue
+                for field in fields:
+                    REDIS_CONN.hdel(USAGE_FLUSHING_KEY, field)
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                logging.warning("The token usage flush lock had expired.")
 
     @classmethod
     @DB.connection_context()
@@ -235,9 +431,15 @@ class LLMBundle:
             tenant_id, llm_type, llm_name)
         model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
         self.max_length = model_config.get("max_tokens", 8192)
+        self.llm_factory = model_config["llm_factory"]
+
+    def _record_latency(self, st):
+        MODEL_REGISTRY.record_latency(self.llm_factory, timer() - st)
 
     def encode(self, texts: list):
+        st = timer()
         embeddings, used_tokens = self.mdl.encode(texts)
+        self._record_latency(st)
         if not TenantLLMService.increase_usage(
                 self.tenant_id, self.llm_type, used_tokens):
             logging.error(
@@ -245,7 +447,9 @@ class LLMBundle:
         return embeddings, used_tokens
 
     def encode_queries(self, query: str):
+        st = timer()
         emd, used_tokens = self.mdl.encode_queries(query)
+        self._record_latency(st)
         if not TenantLLMService.increase_usage(
                 self.tenant_id, self.llm_type, used_tokens):
             logging.error(
@@ -253,7 +457,9 @@ class LLMBundle:
         return emd, used_tokens
 
     def similarity(self, query: str, texts: list):
+        st = timer()
         sim, used_tokens = self.mdl.similarity(query, texts)
+        self._record_latency(st)
         if not TenantLLMService.increase_usage(
                 self.tenant_id, self.llm_type, used_tokens):
             logging.error(
@@ -261,7 +467,9 @@ class LLMBundle:
         return sim, used_tokens
 
     def describe(self, image, max_tokens=300):
+        st = timer()
         txt, used_tokens = self.mdl.describe(image, max_tokens)
+        self._record_latency(st)
         if not TenantLLMService.increase_usage(
                 self.tenant_id, self.llm_type, used_tokens):
             logging.error(
@@ -269,7 +477,9 @@ class LLMBundle:
         return txt
 
     def transcription(self, audio):
+        st = timer()
         txt, used_tokens = self.mdl.transcription(audio)
+        self._record_latency(st)
         if not TenantLLMService.increase_usage(
                 self.tenant_id, self.llm_type, used_tokens):
             logging.error(
@@ -287,7 +497,9 @@ class LLMBundle:
             yield chunk
 
     def chat(self, system, history, gen_conf):
+        st = timer()
         txt, used_tokens = self.mdl.chat(system, history, gen_conf)
+        self._record_latency(st)
         if isinstance(txt, int) and not TenantLLMService.increase_usage(
                 self.tenant_id, self.llm_type, used_tokens, self.llm_name):
             logging.error(
@@ -296,7 +508,11 @@ class LLMBundle:
         return txt
 
     def chat_streamly(self, system, history, gen_conf):
-        for txt in self.mdl.chat_streamly(system, history, gen_conf):
+        st = timer()
+        for i, txt in enumerate(self.mdl.chat_streamly(system, history, gen_conf)):
+            # latency of a stream is its time to the first delta
+            if i == 0:
+                self._record_latency(st)
             if isinstance(txt, int):
                 if not TenantLLMService.increase_usage(
                         self.tenant_id, self.llm_type, txt, self.llm_name):
@@ -24,12 +24,38 @@ from api.db.db_models import DB, UserTenant
 from api.db.db_models import User, Tenant
 from api.db.services.common_service import CommonService
 from api.utils import get_uuid, current_timestamp, datetime_format
+from api.utils.auth_cache import AuthCache
 from api.db import StatusEnum
 from rag.settings import MINIO
 
 
 class UserService(CommonService):
     model = User
+    auth_cache = AuthCache("user")
+
+    @classmethod
+    def get_by_access_token(cls, access_token):
+        """
+        The valid user logged in with `access_token`, served from the auth
+        cache. Each call gets its own instance, without the password hash,
+        which is never cached: write changes with `update_by_id`, not `save`.
+        """
+        def load():
+            users = cls.query(access_token=access_token, status=StatusEnum.VALID.value)
+            if not users:
+                return None
+            fields = dict(users[0].to_dict())
+            fields.pop("password", None)
+            return fields
+
+        if not access_token:
+            return None
+        fields = cls.auth_cache.get(access_token, load)
+        return cls.model(**fields) if fields else None
+
+    @classmethod
+    def invalidate_access_token(cls, access_token):
+        cls.auth_cache.invalidate(access_token)
 
     @classmethod
     @DB.connection_context()
@@ -18,11 +18,22 @@
 # from beartype.claw import beartype_all  # <-- you didn't sign up for this
 # beartype_all(conf=BeartypeConf(violation_type=UserWarning))    # <-- emit warnings from all code
 
+import os
+
+# Must run before anything else imports socket, ssl or threading. trio is imported first so that its event loop
+# keeps the native epoll and threads; trio.run goes through api.utils.api_utils.run_trio in this mode.
+if os.environ.get("API_SERVER_MODE", "threaded") == "gevent":
+    import trio  # noqa: F401
+    try:
+        from gevent import monkey
+    except ImportError:
+        raise ImportError("API_SERVER_MODE=gevent needs gevent, install it with `uv sync --extra gevent`.")
+    monkey.patch_all()
+
 from api.utils.log_utils import initRootLogger
 initRootLogger("ragflow_server")
 
 import logging
-import os
 import signal
 import sys
 import time
@@ -117,15 +128,22 @@ if __name__ == '__main__':
 
     # start http server
     try:
-        logging.info("RAGFlow HTTP server start...")
-        run_simple(
-            hostname=settings.HOST_IP,
-            port=settings.HOST_PORT,
-            application=app,
-            threaded=True,
-            use_reloader=RuntimeConfig.DEBUG,
-            use_debugger=RuntimeConfig.DEBUG,
-        )
+        logging.info(f"RAGFlow HTTP server start in {settings.API_SERVER_MODE} mode...")
+        if settings.API_SERVER_MODE == "gevent":
+            # a greenlet per connection: streams waiting on the LLM cost no thread
+            from gevent.pool import Pool
+            from gevent.pywsgi import WSGIServer
+            WSGIServer((settings.HOST_IP, settings.HOST_PORT), app,
+                       spawn=Pool(settings.API_MAX_CONNECTIONS), log=None).serve_forever()
+        else:
+            run_simple(
+                hostname=settings.HOST_IP,
+                port=settings.HOST_PORT,
+                application=app,
+                threaded=True,
+                use_reloader=RuntimeConfig.DEBUG,
+                use_debugger=RuntimeConfig.DEBUG,
+            )
     except Exception:
         traceback.print_exc()
         stop_event.set()
@@ -27,6 +27,17 @@ from api.constants import RAG_FLOW_SERVICE_NAME
 
 LIGHTEN = int(os.environ.get('LIGHTEN', "0"))
 
+# "threaded" serves the API with a thread per connection, "gevent" with a greenlet per connection.
+API_SERVER_MODE = os.environ.get("API_SERVER_MODE", "threaded")
+# Connections served at once in gevent mode.
+API_MAX_CONNECTIONS = int(os.environ.get("API_MAX_CONNECTIONS", 2000))
+# Seconds a resolved login or API token is trusted without asking the database, 0 to disable.
+AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL", 30))
+# Share resolved tokens between API workers through Redis.
+AUTH_CACHE_REDIS = int(os.environ.get("AUTH_CACHE_REDIS", "0"))
+# Last messages of a session given to the model as history by the chat completion API.
+CONVERSATION_HISTORY_WINDOW = int(os.environ.get("CONVERSATION_HISTORY_WINDOW", 64))
+
 LLM = None
 LLM_FACTORY = None
 LLM_BASE_URL = None
@@ -26,6 +26,7 @@ from urllib.parse import quote, urlencode
 from uuid import uuid1
 
 import requests
+import trio
 from flask import (
     Response, jsonify, send_file, make_response,
     request as flask_request,
@@ -33,7 +34,7 @@ from flask import (
 from itsdangerous import URLSafeTimedSerializer
 from werkzeug.http import HTTP_STATUS_CODES
 
-from api.db.db_models import APIToken
+from api.db.services.api_service import APITokenService
 from api import settings
 
 from api.utils import CustomJSONEncoder, get_uuid
@@ -211,16 +212,65 @@ def get_json_result(code=settings.RetCode.SUCCESS, message='success', data=None)
     return jsonify(response)
 
 
+def run_trio(async_fn, *args):
+    """
+    trio.run, on a native thread of gevent's pool when the server runs in
+    gevent mode, where running trio's event loop in a greenlet would stall
+    every other connection.
+    """
+    if settings.API_SERVER_MODE == "gevent":
+        import gevent
+        return gevent.get_hub().threadpool.apply(trio.run, (async_fn, *args))
+    return trio.run(async_fn, *args)
+
+
+class AnswerStreamEncoder:
+    """
+    Data of the SSE events of a streamed answer. With `version` 1 every event
+    carries the whole answer so far. With version 2 an event carries `seq`,
+    its number in the stream, and `delta`, the text appended to the previous
+    answer; an answer that doesn't extend the previous one, such as the final
+    one with citations, is sent whole as `answer`. Empty fields are left out,
+    so the reference only comes with the final event.
+    """
+
+    def __init__(self, version=1):
+        try:
+            self.version = int(version or 1)
+        except (TypeError, ValueError):
+            raise ValueError(f"`stream_version` should be an integer, not {version!r}.")
+        self.seq = 0
+        self.sent = ""
+
+    def encode(self, ans: dict) -> dict:
+        delta = ans.pop("delta", None)
+        if self.version < 2:
+            return ans
+        answer = ans.get("answer") or ""
+        event = {k: v for k, v in ans.items() if k != "answer" and v not in (None, "", {}, [])}
+        event["seq"] = self.seq
+        self.seq += 1
+        # producers passing `delta` already know the answer only grew
+        if delta is not None:
+            event["delta"] = delta
+        elif answer.startswith(self.sent):
+            event["delta"] = answer[len(self.sent):]
+        else:
+            event["answer"] = answer
+        self.sent = answer
+        return event
+
+
 def apikey_required(func):
     @wraps(func)
     def decorated_function(*args, **kwargs):
         token = flask_request.headers.get('Authorization').split()[1]
-        objs = APIToken.query(token=token)
-        if not objs:
+        tenant_id = APITokenService.get_tenant_id(token)
+        if not tenant_id:
             return build_error_result(
                 message='API-KEY is invalid!', code=settings.RetCode.FORBIDDEN
             )
-        kwargs['tenant_id'] = objs[0].tenant_id
+        kwargs['tenant_id'] = tenant_id
         return func(*args, **kwargs)
 
     return decorated_function
@@ -293,13 +343,13 @@ def token_required(func):
         if len(authorization_list) < 2:
             return get_json_result(data=False, message="Please check your authorization format.")
         token = authorization_list[1]
-        objs = APIToken.query(token=token)
-        if not objs:
+        tenant_id = APITokenService.get_tenant_id(token)
+        if not tenant_id:
             return get_json_result(
                 data=False, message='Authentication error: API key is invalid!',
                 code=settings.RetCode.AUTHENTICATION_ERROR
             )
-        kwargs['tenant_id'] = objs[0].tenant_id
+        kwargs['tenant_id'] = tenant_id
         return func(*args, **kwargs)
 
     return decorated_function
@@ -0,0 +1,113 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from api import settings
+from rag.utils.redis_conn import REDIS_CONN
+
+# how long a worker trusts its own copy when the entries are shared in Redis
+LOCAL_TTL_WITH_REDIS = 5
+
+
+class AuthCache:
+    """
+    Short-lived cache of what an auth token resolves to, so that polling
+    clients don't cost a database lookup per request. Entries live
+    `AUTH_CACHE_TTL` seconds in the worker; with `AUTH_CACHE_REDIS` they are
+    also shared through Redis and the worker keeps its copy only a few
+    seconds. Only successful lookups are cached, keyed by a hash of the
+    token. `invalidate` must be called whenever a token is revoked or what
+    it resolves to changes.
+    """
+
+    def __init__(self, kind, size=10000):
+        self.kind = kind
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"hit": 0, "miss": 0, "total": 0.0}
+
+    @property
+    def ttl(self):
+        return settings.AUTH_CACHE_TTL
+
+    def _key(self, token):
+        return f"auth:{self.kind}:" + hashlib.sha256(str(token).encode("utf-8")).hexdigest()
+
+    def _local_ttl(self):
+        return min(self.ttl, LOCAL_TTL_WITH_REDIS) if settings.AUTH_CACHE_REDIS else self.ttl
+
+    def get(self, token, loader):
+        """What `token` resolves to, calling `loader()` on a miss. None results are not cached."""
+        start = time.perf_counter()
+        if self.ttl <= 0:
+            value = loader()
+            self._record(False, start)
+            return value
+
+        key = self._key(token)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit and hit[0] > time.time():
+                self._entries.move_to_end(key)
+        if hit and hit[0] > time.time():
+            self._record(True, start)
+            return hit[1]
+
+        value = None
+        if settings.AUTH_CACHE_REDIS:
+            cached = REDIS_CONN.get(key)
+            if cached:
+                value = json.loads(cached)
+        cached = value is not None
+        if not cached:
+            value = loader()
+            if value is not None and settings.AUTH_CACHE_REDIS:
+                REDIS_CONN.set(key, json.dumps(value, ensure_ascii=False, default=str), self.ttl)
+        if value is not None:
+            with self._lock:
+                self._entries[key] = (time.time() + self._local_ttl(), value)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        self._record(cached, start)
+        return value
+
+    def invalidate(self, token):
+        if not token:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries.pop(key, None)
+        if settings.AUTH_CACHE_REDIS:
+            REDIS_CONN.delete(key)
+
+    def _record(self, hit, start):
+        with self._lock:
+            self._stats["hit" if hit else "miss"] += 1
+            self._stats["total"] += time.perf_counter() - start
+
+    def stats(self) -> dict:
+        """Lookups, hit rate and mean lookup time in milliseconds, since the process started."""
+        with self._lock:
+            n = self._stats["hit"] + self._stats["miss"]
+            return {"lookups": n,
+                    "hit_rate": "{:.3f}".format(self._stats["hit"] / n if n else 0.0),
+                    "avg_ms": "{:.3f}".format(self._stats["total"] / n * 1000.0 if n else 0.0),
+                    "entries": len(self._entries)}
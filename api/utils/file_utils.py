@@ -17,11 +17,8 @@ import base64
 import json
 import os
 import re
-import sys
-import threading
 from io import BytesIO
 
-import pdfplumber
 from PIL import Image
 from cachetools import LRUCache, cached
 from ruamel.yaml import YAML
@@ -32,10 +29,6 @@ from api.constants import IMG_BASE64_PREFIX
 PROJECT_BASE = os.getenv("RAG_PROJECT_BASE") or os.getenv("RAG_DEPLOY_BASE")
 RAG_BASE = os.getenv("RAG_BASE")
 
-LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
-if LOCK_KEY_pdfplumber not in sys.modules:
-    sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
-
 
 def get_project_base_directory(*args):
     global PROJECT_BASE
@@ -178,28 +171,34 @@ def filename_type(filename):
 def thumbnail_img(filename, blob):
     """
     MySQL LongText max length is 65535
+    `blob` is either the file's bytes or a seekable file object.
     """
     filename = filename.lower()
+    if hasattr(blob, "read"):
+        blob.seek(0)
+        stream = blob
+    else:
+        stream = BytesIO(blob)
     if re.match(r".*\.pdf$", filename):
-        with sys.modules[LOCK_KEY_pdfplumber]:
-            pdf = pdfplumber.open(BytesIO(blob))
+        # rag.utils imports this module
+        from rag.utils.pdf_render import PdfRenderer
+        # only the first page is rendered, in-process and at a low resolution
+        with PdfRenderer(stream) as renderer:
             buffered = BytesIO()
             resolution = 32
             img = None
             for _ in range(10):
-                # https://github.com/jsvine/pdfplumber?tab=readme-ov-file#creating-a-pageimage-with-to_image
-                pdf.pages[0].to_image(resolution=resolution).annotated.save(buffered, format="png")
+                renderer.render(0, resolution).save(buffered, format="png")
                 img = buffered.getvalue()
                 if len(img) >= 64000 and resolution >= 2:
                     resolution = resolution / 2
                     buffered = BytesIO()
                 else:
                     break
-        pdf.close()
         return img
 
     elif re.match(r".*\.(jpg|jpeg|png|tif|gif|icon|ico|webp)$", filename):
-        image = Image.open(BytesIO(blob))
+        image = Image.open(stream)
         image.thumbnail((30, 30))
         buffered = BytesIO()
         image.save(buffered, format="png")
@@ -209,7 +208,7 @@ def thumbnail_img(filename, blob):
         import aspose.slides as slides
         import aspose.pydrawing as drawing
         try:
-            with slides.Presentation(BytesIO(blob)) as presentation:
+            with slides.Presentation(stream) as presentation:
                 buffered = BytesIO()
                 scale = 0.03
                 img = None
@@ -238,6 +237,14 @@ def thumbnail(filename, blob):
         return ''
 
 
+def stream_size(stream):
+    """Size in bytes of a seekable file object, which is rewound to its start."""
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
 def traversal_files(base):
     for root, ds, fs in os.walk(base):
         for f in fs:
@@ -12,7 +12,9 @@
 #
 
 import logging
-from openpyxl import load_workbook, Workbook
+from itertools import islice
+
+from openpyxl import load_workbook
 import sys
 from io import BytesIO
 
@@ -23,77 +25,85 @@ import pandas as pd
 
 class RAGFlowExcelParser:
     @staticmethod
-    def _load_excel_to_workbook(file_like_object):
+    def _iter_sheets(file_like_object):
+        """
+        (sheet name, rows, number of rows) of each sheet, rows being an
+        iterator over tuples of cell values. Workbooks openpyxl can read are
+        streamed in read-only mode: a row is parsed when it is reached and the
+        rest of a sheet isn't read once the caller stops; their number of rows
+        is None when the sheet doesn't record its dimension. Other formats
+        (xls) are read by pandas.
+        """
         try:
-            return load_workbook(file_like_object)
+            wb = load_workbook(file_like_object, read_only=True, data_only=True)
         except Exception as e:
-            logging.info(f"****wxy: openpyxl load error: {e}, try pandas instead")
+            logging.info(f"openpyxl load error: {e}, try pandas instead")
+            if hasattr(file_like_object, "seek"):
+                file_like_object.seek(0)
             try:
-                df = pd.read_excel(file_like_object)
-                wb = Workbook()
-                ws = wb.active
-                ws.title = "Data"
-                for col_num, column_name in enumerate(df.columns, 1):
-                    ws.cell(row=1, column=col_num, value=column_name)
-                for row_num, row in enumerate(df.values, 2):
-                    for col_num, value in enumerate(row, 1):
-                        ws.cell(row=row_num, column=col_num, value=value)
-                return wb
+                sheets = pd.read_excel(file_like_object, sheet_name=None, header=None, dtype=object)
             except Exception as e_pandas:
-                raise Exception(f"****wxy: pandas read error: {e_pandas}, original openpyxl error: {e}")
+                raise Exception(f"pandas read error: {e_pandas}, original openpyxl error: {e}")
+            for sheetname, df in sheets.items():
+                yield str(sheetname), (tuple(None if pd.isna(v) else v for v in r)
+                                       for r in df.itertuples(index=False, name=None)), len(df)
+            return
+        try:
+            for sheetname in wb.sheetnames:
+                ws = wb[sheetname]
+                yield sheetname, ws.iter_rows(values_only=True), ws.max_row
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _file_like(fnm):
+        return BytesIO(fnm) if not isinstance(fnm, str) else fnm
 
     def html(self, fnm, chunk_rows=256):
-        file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
         tb_chunks = []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for sheetname, rows, _ in RAGFlowExcelParser._iter_sheets(self._file_like(fnm)):
+            header = next(rows, None)
+            if header is None:
                 continue
 
             tb_rows_0 = "<tr>"
-            for t in list(rows[0]):
-                tb_rows_0 += f"<th>{t.value}</th>"
+            for t in header:
+                tb_rows_0 += f"<th>{t}</th>"
             tb_rows_0 += "</tr>"
 
-            for chunk_i in range((len(rows) - 1) // chunk_rows + 1):
+            while True:
+                chunk = list(islice(rows, chunk_rows))
                 tb = ""
                 tb += f"<table><caption>{sheetname}</caption>"
                 tb += tb_rows_0
-                for r in list(
-                  rows[1 + chunk_i * chunk_rows: 1 + (chunk_i + 1) * chunk_rows]
-                ):
+                for r in chunk:
                     tb += "<tr>"
-                    for i, c in enumerate(r):
-                        if c.value is None:
+                    for v in r:
+                        if v is None:
                             tb += "<td></td>"
                         else:
-                            tb += f"<td>{c.value}</td>"
+                            tb += f"<td>{v}</td>"
                     tb += "</tr>"
                 tb += "</table>\n"
                 tb_chunks.append(tb)
+                if len(chunk) < chunk_rows:
+                    break
 
         return tb_chunks
 
     def __call__(self, fnm):
-        file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
-
         res = []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for sheetname, rows, _ in RAGFlowExcelParser._iter_sheets(self._file_like(fnm)):
+            ti = next(rows, None)
+            if ti is None:
                 continue
-            ti = list(rows[0])
-            for r in list(rows[1:]):
+            for r in rows:
                 fields = []
-                for i, c in enumerate(r):
-                    if not c.value:
+                for i, v in enumerate(r):
+                    if not v:
                         continue
-                    t = str(ti[i].value) if i < len(ti) else ""
-                    t += ("：" if t else "") + str(c.value)
+                    t = str(ti[i]) if i < len(ti) else ""
+                    t += ("：" if t else "") + str(v)
                     fields.append(t)
                 line = "; ".join(fields)
                 if sheetname.lower().find("sheet") < 0:
@@ -104,17 +114,16 @@ class RAGFlowExcelParser:
     @staticmethod
     def row_number(fnm, binary):
         if fnm.split(".")[-1].lower().find("xls") >= 0:
-            wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary))
             total = 0
-            for sheetname in wb.sheetnames:
-                ws = wb[sheetname]
-                total += len(list(ws.rows))
+            # counted rather than taken from the recorded dimension, which some writers get wrong
+            for _, rows, _ in RAGFlowExcelParser._iter_sheets(BytesIO(binary)):
+                total += sum(1 for _ in rows)
             return total
 
         if fnm.split(".")[-1].lower() in ["csv", "txt"]:
             encoding = find_codec(binary)
             txt = binary.decode(encoding, errors="ignore")
-            return len(txt.split("\n"))
+            return txt.count("\n") + 1
 
 
 if __name__ == "__main__":
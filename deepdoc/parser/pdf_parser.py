@@ -18,8 +18,7 @@ import logging
 import os
 import random
 from timeit import default_timer as timer
-import sys
-import threading
+from collections import OrderedDict
 
 import xgboost as xgb
 from io import BytesIO
@@ -30,15 +29,135 @@ import numpy as np
 from pypdf import PdfReader as pdf2_read
 
 from api import settings
+from rag.settings import PDF_STREAMING_WINDOW, PDF_TEXT_LAYER_FIRST
 from api.utils.file_utils import get_project_base_directory
 from deepdoc.vision import OCR, Recognizer, LayoutRecognizer, TableStructureRecognizer
+from deepdoc.vision.geometry import BoxIndex
 from rag.nlp import rag_tokenizer
+from rag.utils.pdf_render import PdfRenderer
 from copy import deepcopy
 from huggingface_hub import snapshot_download
 
-LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
-if LOCK_KEY_pdfplumber not in sys.modules:
-    sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
+
+class LazyPageImage:
+    """
+    Stand-in for a rendered page image. Only the page size is held in
+    memory; pixels are rendered from the source PDF when they are needed.
+    """
+
+    def __init__(self, pages, index, size):
+        self._pages = pages
+        self._index = index
+        self.size = size
+
+    def image(self):
+        return self._pages.render(self._index)
+
+    def crop(self, box=None):
+        return self.image().crop(box)
+
+    def convert(self, *args, **kwargs):
+        return self.image().convert(*args, **kwargs)
+
+    def __array__(self, dtype=None, copy=None):
+        arr = np.asarray(self.image())
+        return arr.astype(dtype) if dtype else arr
+
+
+class LazyPageImages:
+    """
+    Page images of a PDF rendered on demand at `72 * zoomin` DPI. At most
+    `window` rendered pages are kept in an LRU cache, so the memory used by
+    page images does not grow with the page count. `close` releases the
+    renderer between the phases of a parse; a page asked for afterwards,
+    e.g. to crop a chunk's image, opens it again.
+    """
+
+    # keys of pdfplumber chars the parser relies on after extraction
+    CHAR_KEYS = ("text", "x0", "x1", "top", "bottom", "width", "height")
+
+    def __init__(self, fnm, page_from, zoomin, window):
+        self._page_from = page_from
+        self._zoomin = zoomin
+        self._window = max(1, window)
+        self._sizes = []
+        self._cache = OrderedDict()
+        self._fnm = fnm
+        self._renderer = None
+        # pdfplumber only extracts chars, pages are rendered by PdfRenderer
+        self._pdf = pdfplumber.open(fnm) if isinstance(
+            fnm, str) else pdfplumber.open(BytesIO(fnm))
+        self.total_page = len(self._pdf.pages)
+
+    def extract_chars(self, page_to, has_color, text_layer_usable):
+        page_chars, text_layer = [], []
+        try:
+            for page in self._pdf.pages[self._page_from:page_to]:
+                chars = [c for c in page.dedupe_chars().chars if has_color(c)]
+                text_layer.append(text_layer_usable(page, chars))
+                page_chars.append([{k: c[k] for k in self.CHAR_KEYS} for c in chars])
+                page.flush_cache()
+        finally:
+            # chars are only extracted once
+            self._pdf.close()
+            self._pdf = None
+        return page_chars, text_layer
+
+    def _get_renderer(self):
+        if self._renderer is None:
+            self._renderer = PdfRenderer(self._fnm)
+        return self._renderer
+
+    def render_at(self, i, zoomin):
+        return self._get_renderer().render(self._page_from + i, 72 * zoomin)
+
+    def prefetch(self, start, end):
+        """Render the pages in [start, end) that aren't cached, in parallel."""
+        missing = [i for i in range(start, end) if i not in self._cache][:self._window]
+        for i, img in zip(missing, self._get_renderer().render_pages(
+                [self._page_from + i for i in missing], 72 * self._zoomin)):
+            self._put(i, img)
+
+    def render(self, i):
+        if i in self._cache:
+            self._cache.move_to_end(i)
+            return self._cache[i]
+        img = self.render_at(i, self._zoomin)
+        self._put(i, img)
+        return img
+
+    def _put(self, i, img):
+        if i == len(self._sizes):
+            self._sizes.append(img.size)
+        self._cache[i] = img
+        while len(self._cache) > self._window:
+            self._cache.popitem(last=False)
+
+    def close(self):
+        self._cache.clear()
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+        if self._renderer is not None:
+            self._renderer.close()
+            self._renderer = None
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self._sizes):
+            raise IndexError("page image index out of range")
+        return LazyPageImage(self, i, self._sizes[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
 
 class RAGFlowPdfParser:
     def __init__(self):
@@ -83,6 +202,8 @@ class RAGFlowPdfParser:
                 model_dir, "updown_concat_xgb.model"))
 
         self.page_from = 0
+        self.page_layout_pred = None
+        self.page_text_layer = []
 
     def __char_width(self, c):
         return (c["x1"] - c["x0"]) // max(len(c["text"]), 1)
@@ -112,18 +233,25 @@ class RAGFlowPdfParser:
         ]
         return any([re.match(p, b["text"]) for p in proj_patt])
 
-    def _updown_concat_features(self, up, down):
+    def _updown_concat_features(self, up, down, tkn_cache=None):
+        def tokenize(txt):
+            if tkn_cache is None:
+                return rag_tokenizer.tokenize(txt).split()
+            if txt not in tkn_cache:
+                tkn_cache[txt] = rag_tokenizer.tokenize(txt).split()
+            return tkn_cache[txt]
+
         w = max(self.__char_width(up), self.__char_width(down))
         h = max(self.__height(up), self.__height(down))
         y_dis = self._y_dis(up, down)
         LEN = 6
-        tks_down = rag_tokenizer.tokenize(down["text"][:LEN]).split()
-        tks_up = rag_tokenizer.tokenize(up["text"][-LEN:]).split()
+        tks_down = tokenize(down["text"][:LEN])
+        tks_up = tokenize(up["text"][-LEN:])
         tks_all = up["text"][-LEN:].strip() \
                   + (" " if re.match(r"[a-zA-Z0-9]+",
                                      up["text"][-1] + down["text"][0]) else "") \
                   + down["text"][:LEN].strip()
-        tks_all = rag_tokenizer.tokenize(tks_all).split()
+        tks_all = tokenize(tks_all)
         fea = [
             up.get("R", -1) == down.get("R", -1),
             y_dis / h,
@@ -172,17 +300,10 @@ class RAGFlowPdfParser:
     @staticmethod
     def sort_X_by_page(arr, threashold):
         # sort using y1 first and then x1
-        arr = sorted(arr, key=lambda r: (r["page_number"], r["x0"], r["top"]))
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                # restore the order using th
-                if abs(arr[j + 1]["x0"] - arr[j]["x0"]) < threashold \
-                        and arr[j + 1]["top"] < arr[j]["top"] \
-                        and arr[j + 1]["page_number"] == arr[j]["page_number"]:
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
+        pages = {}
+        for r in arr:
+            pages.setdefault(r["page_number"], []).append(r)
+        return [r for pn in sorted(pages.keys()) for r in Recognizer.sort_X_firstly(pages[pn], threashold)]
 
     def _has_color(self, o):
         if o.get("ncs", "") == "DeviceGray":
@@ -251,17 +372,18 @@ class RAGFlowPdfParser:
         clmns = sorted([r for r in self.tb_cpns if re.match(
             r"table column$", r["label"])], key=lambda x: (x["pn"], x["layoutno"], x["x0"]))
         clmns = Recognizer.layouts_cleanup(self.boxes, clmns, 5, 0.5)
+        rows_index, headers_index, spans_index = BoxIndex(rows), BoxIndex(headers), BoxIndex(spans)
         for b in self.boxes:
             if b.get("layout_type", "") != "table":
                 continue
-            ii = Recognizer.find_overlapped_with_threashold(b, rows, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threashold(b, rows_index, thr=0.3)
             if ii is not None:
                 b["R"] = ii
                 b["R_top"] = rows[ii]["top"]
                 b["R_bott"] = rows[ii]["bottom"]
 
             ii = Recognizer.find_overlapped_with_threashold(
-                b, headers, thr=0.3)
+                b, headers_index, thr=0.3)
             if ii is not None:
                 b["H_top"] = headers[ii]["top"]
                 b["H_bott"] = headers[ii]["bottom"]
@@ -275,7 +397,7 @@ class RAGFlowPdfParser:
                 b["C_left"] = clmns[ii]["x0"]
                 b["C_right"] = clmns[ii]["x1"]
 
-            ii = Recognizer.find_overlapped_with_threashold(b, spans, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threashold(b, spans_index, thr=0.3)
             if ii is not None:
                 b["H_top"] = spans[ii]["top"]
                 b["H_bott"] = spans[ii]["bottom"]
@@ -283,7 +405,82 @@ class RAGFlowPdfParser:
                 b["H_right"] = spans[ii]["x1"]
                 b["SP"] = ii
 
+    def _text_layer_usable(self, page, chars):
+        """
+        Whether the PDF's own text layer of a page is good enough to replace
+        OCR: enough characters, no undecodable (cid:N) glyphs or private-use
+        code points, mostly upright text and no large images whose text
+        would only be visible to OCR.
+        """
+        if not PDF_TEXT_LAYER_FIRST or len(chars) < 16:
+            return False
+        texts = [c["text"] for c in chars]
+        if sum([1 for t in texts if t.startswith("(cid:")]) > len(texts) * 0.01:
+            return False
+        broken = sum([1 for t in texts for ch in t
+                      if ch == "\ufffd" or "\ue000" <= ch <= "\uf8ff" or (ord(ch) < 32 and ch not in "\t\r\n")])
+        if broken > len(texts) * 0.02:
+            return False
+        if sum([1 for c in chars if not c.get("upright", True)]) > len(chars) * 0.05:
+            return False
+
+        page_area = float(page.width * page.height)
+        if page_area <= 0:
+            return False
+        img_area = 0
+        for im in page.images:
+            w = min(im["x1"], page.width) - max(im["x0"], 0)
+            h = min(im["bottom"], page.height) - max(im["top"], 0)
+            img_area += max(w, 0) * max(h, 0)
+        if img_area > page_area * 0.5:
+            return False
+        char_area = sum([(c["x1"] - c["x0"]) * (c["bottom"] - c["top"]) for c in chars])
+        return char_area >= page_area * 0.005
+
+    def _text_layer_boxes(self, pagenum, chars):
+        """
+        Build text line boxes straight from the character geometry of a page,
+        splitting a row wherever the horizontal gap is much wider than a char.
+        """
+        chars = [c for c in chars if c["text"] and c["bottom"] > c["top"]]
+        if not chars:
+            return []
+        mw = np.median([c["width"] for c in chars if c["text"].strip()] or [8])
+        rows = []
+        for c in sorted(chars, key=lambda c: (c["top"], c["x0"])):
+            mid = (c["top"] + c["bottom"]) / 2
+            if rows and rows[-1]["top"] <= mid <= rows[-1]["bottom"]:
+                rows[-1]["chars"].append(c)
+                rows[-1]["bottom"] = max(rows[-1]["bottom"], c["bottom"])
+                continue
+            rows.append({"top": c["top"], "bottom": c["bottom"], "chars": [c]})
+
+        bxs = []
+        for r in rows:
+            b = None
+            for c in sorted(r["chars"], key=lambda c: c["x0"]):
+                if b is None or c["x0"] - b["x1"] > 2 * mw or c["x0"] < b["x0"]:
+                    b = {"x0": c["x0"], "x1": c["x1"], "top": c["top"], "bottom": c["bottom"],
+                         "text": "", "page_number": pagenum}
+                    bxs.append(b)
+                b["text"] += c["text"]
+                b["x1"] = max(b["x1"], c["x1"])
+                b["top"] = min(b["top"], c["top"])
+                b["bottom"] = max(b["bottom"], c["bottom"])
+        for b in bxs:
+            b["text"] = b["text"].strip()
+        return Recognizer.sort_Y_firstly([b for b in bxs if b["text"]], self.mean_height[pagenum - 1] / 3)
+
     def __ocr(self, pagenum, img, chars, ZM=3):
+        if pagenum - 1 < len(self.page_text_layer) and self.page_text_layer[pagenum - 1]:
+            start = timer()
+            bxs = self._text_layer_boxes(pagenum, chars)
+            if bxs and self.mean_height[-1] == 0:
+                self.mean_height[-1] = np.median([b["bottom"] - b["top"] for b in bxs])
+            self.boxes.append(bxs)
+            logging.info(f"__ocr built {len(bxs)} boxes from text layer cost {timer() - start}s")
+            return
+
         start = timer()
         bxs = self.ocr.detect(np.array(img))
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
@@ -302,9 +499,10 @@ class RAGFlowPdfParser:
         )
         
         # merge chars in the same rect
+        bxs_index = BoxIndex(bxs)
         for c in Recognizer.sort_Y_firstly(
                 chars, self.mean_height[pagenum - 1] // 4):
-            ii = Recognizer.find_overlapped(c, bxs)
+            ii = Recognizer.find_overlapped(c, bxs_index)
             if ii is None:
                 self.lefted_chars.append(c)
                 continue
@@ -344,7 +542,7 @@ class RAGFlowPdfParser:
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
         self.boxes, self.page_layout = self.layouter(
-            self.page_images, self.boxes, ZM, drop=drop)
+            self.page_images, self.boxes, ZM, drop=drop, layouts=self.page_layout_pred)
         # cumlative Y
         for i in range(len(self.boxes)):
             self.boxes[i]["top"] += \
@@ -459,6 +657,64 @@ class RAGFlowPdfParser:
             bxs.pop(i + 1)
         self.boxes = bxs
 
+    def _concat_rule(self, up, down, offset, concat_between_pages=True):
+        """
+        Rule-based part of deciding whether `down`, the `offset`-th box after
+        `up` in the remaining boxes, continues `up`. Returns "stop" when no
+        later box can continue `up`, "skip" to try the next box, "concat" to
+        chain it and "model" when the up/down concat model has to decide.
+        """
+        ydis = self._y_dis(up, down)
+        smpg = up["page_number"] == down["page_number"]
+        mh = self.mean_height[up["page_number"] - 1]
+        mw = self.mean_width[up["page_number"] - 1]
+        if smpg and ydis > mh * 4:
+            return "stop"
+        if not smpg and ydis > mh * 16:
+            return "stop"
+        if not concat_between_pages and down["page_number"] > up["page_number"]:
+            return "stop"
+
+        if up.get("R", "") != down.get(
+                "R", "") and up["text"][-1:] != "，":
+            return "skip"
+
+        if re.match(r"[0-9]{2,3}/[0-9]{3}$", up["text"]) \
+                or re.match(r"[0-9]{2,3}/[0-9]{3}$", down["text"]) \
+                or not down["text"].strip():
+            return "skip"
+
+        if not down["text"].strip() or not up["text"].strip():
+            return "skip"
+
+        if up["x1"] < down["x0"] - 10 * \
+                mw or up["x0"] > down["x1"] + 10 * mw:
+            return "skip"
+
+        if offset < 5 and up.get("layout_type") == "text":
+            if up.get("layoutno", "1") == down.get(
+                    "layoutno", "2"):
+                return "concat"
+            return "skip"
+        return "model"
+
+    def _updown_concat_candidates(self, boxes, concat_between_pages=True, window=12):
+        pairs = []
+        for u in range(len(boxes)):
+            for k, d in enumerate(range(u + 1, min(u + 1 + window, len(boxes)))):
+                rule = self._concat_rule(boxes[u], boxes[d], k, concat_between_pages)
+                if rule == "stop":
+                    break
+                if rule == "model":
+                    pairs.append((u, d))
+        return pairs
+
+    def _updown_concat_scores(self, boxes, pairs, tkn_cache=None):
+        if not pairs:
+            return {}
+        fea = [self._updown_concat_features(boxes[u], boxes[d], tkn_cache) for u, d in pairs]
+        return dict(zip(pairs, self.updown_cnt_mdl.predict(xgb.DMatrix(fea))))
+
     def _concat_downward(self, concat_between_pages=True):
         # count boxes in the same row as a feature
         for i in range(len(self.boxes)):
@@ -478,66 +734,45 @@ class RAGFlowPdfParser:
 
         # concat between rows
         boxes = deepcopy(self.boxes)
+        # score every pair the chaining below may ask the model about in one
+        # prediction, then resolve the chains greedily from the scores
+        tkn_cache = {}
+        scores = self._updown_concat_scores(
+            boxes, self._updown_concat_candidates(boxes, concat_between_pages), tkn_cache)
+        # remaining boxes are kept in a doubly linked list so that a chain
+        # can be taken out without shifting the whole list
+        n = len(boxes)
+        nxt = list(range(1, n + 1)) + [0]
+        prv = [n] + list(range(n))
         blocks = []
-        while boxes:
+        while nxt[n] != n:
             chunks = []
-
-            def dfs(up, dp):
-                chunks.append(up)
-                i = dp
-                while i < min(dp + 12, len(boxes)):
-                    ydis = self._y_dis(up, boxes[i])
-                    smpg = up["page_number"] == boxes[i]["page_number"]
-                    mh = self.mean_height[up["page_number"] - 1]
-                    mw = self.mean_width[up["page_number"] - 1]
-                    if smpg and ydis > mh * 4:
-                        break
-                    if not smpg and ydis > mh * 16:
+            chain = []
+            cur = nxt[n]
+            while cur is not None:
+                chunks.append(boxes[cur])
+                chain.append(cur)
+                up, down_i, cur = boxes[cur], nxt[cur], None
+                k = 0
+                while k < 12 and down_i != n:
+                    rule = self._concat_rule(up, boxes[down_i], k, concat_between_pages)
+                    if rule == "stop":
                         break
-                    down = boxes[i]
-                    if not concat_between_pages and down["page_number"] > up["page_number"]:
+                    if rule == "model":
+                        pair = (chain[-1], down_i)
+                        if pair not in scores:
+                            # boxes taken by earlier chains widened the window
+                            scores.update(self._updown_concat_scores(boxes, [pair], tkn_cache))
+                        rule = "concat" if scores[pair] > 0.5 else "skip"
+                    if rule == "concat":
+                        cur = down_i
                         break
+                    down_i = nxt[down_i]
+                    k += 1
 
-                    if up.get("R", "") != down.get(
-                            "R", "") and up["text"][-1] != "，":
-                        i += 1
-                        continue
-
-                    if re.match(r"[0-9]{2,3}/[0-9]{3}$", up["text"]) \
-                            or re.match(r"[0-9]{2,3}/[0-9]{3}$", down["text"]) \
-                            or not down["text"].strip():
-                        i += 1
-                        continue
-
-                    if not down["text"].strip() or not up["text"].strip():
-                        i += 1
-                        continue
-
-                    if up["x1"] < down["x0"] - 10 * \
-                            mw or up["x0"] > down["x1"] + 10 * mw:
-                        i += 1
-                        continue
-
-                    if i - dp < 5 and up.get("layout_type") == "text":
-                        if up.get("layoutno", "1") == down.get(
-                                "layoutno", "2"):
-                            dfs(down, i + 1)
-                            boxes.pop(i)
-                            return
-                        i += 1
-                        continue
-
-                    fea = self._updown_concat_features(up, down)
-                    if self.updown_cnt_mdl.predict(
-                            xgb.DMatrix([fea]))[0] <= 0.5:
-                        i += 1
-                        continue
-                    dfs(down, i + 1)
-                    boxes.pop(i)
-                    return
-
-            dfs(boxes[0], 1)
-            boxes.pop(0)
+            for i in chain:
+                nxt[prv[i]] = nxt[i]
+                prv[nxt[i]] = prv[i]
             if chunks:
                 blocks.append(chunks)
 
@@ -954,17 +1189,15 @@ class RAGFlowPdfParser:
     @staticmethod
     def total_page_number(fnm, binary=None):
         try:
-            with sys.modules[LOCK_KEY_pdfplumber]:
-                pdf = pdfplumber.open(
-                    fnm) if not binary else pdfplumber.open(BytesIO(binary))
+            pdf = pdfplumber.open(
+                fnm) if not binary else pdfplumber.open(BytesIO(binary))
             total_page = len(pdf.pages)
             pdf.close()
             return total_page 
         except Exception:
             logging.exception("total_page_number")
 
-    def __images__(self, fnm, zoomin=3, page_from=0,
-                   page_to=299, callback=None):
+    def _reset_pages(self, page_from):
         self.lefted_chars = []
         self.mean_height = []
         self.mean_width = []
@@ -973,24 +1206,10 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
-        start = timer()
-        try:
-            with sys.modules[LOCK_KEY_pdfplumber]:
-                self.pdf = pdfplumber.open(fnm) if isinstance(
-                    fnm, str) else pdfplumber.open(BytesIO(fnm))
-                self.page_images = [p.to_image(resolution=72 * zoomin).annotated for i, p in
-                                    enumerate(self.pdf.pages[page_from:page_to])]
-                try:
-                    self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                except Exception as e:
-                    logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                    self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
-                    
-                self.total_page = len(self.pdf.pages)
-        except Exception:
-            logging.exception("RAGFlowPdfParser __images__")
-        logging.info(f"__images__ dedupe_chars cost {timer() - start}s")
+        self.page_layout_pred = None
+        self.page_text_layer = []
 
+    def _load_outlines(self, fnm):
         self.outlines = []
         try:
             self.pdf = pdf2_read(fnm if isinstance(fnm, str) else BytesIO(fnm))
@@ -1010,55 +1229,158 @@ class RAGFlowPdfParser:
             self.pdf.close()
         if not self.outlines:
             logging.warning("Miss outlines")
-        
 
-        logging.debug("Images converted.")
+    def _detect_english(self):
         self.is_english = [re.search(r"[a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(
             random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i]))))) for i in
                            range(len(self.page_chars))]
         if sum([1 if e else 0 for e in self.is_english]) > len(
-                self.page_images) / 2:
+                self.page_chars) / 2:
             self.is_english = True
         else:
             self.is_english = False
 
+    def _ocr_page(self, i, img, zoomin):
+        text_layer = i < len(self.page_text_layer) and self.page_text_layer[i]
+        chars = self.page_chars[i] if not self.is_english or text_layer else []
+        self.mean_height.append(
+            np.median(sorted([c["height"] for c in chars])) if chars else 0
+        )
+        self.mean_width.append(
+            np.median(sorted([c["width"] for c in chars])) if chars else 8
+        )
+        self.page_cum_height.append(img.size[1] / zoomin)
+        j = 0
+        while j + 1 < len(chars):
+            if chars[j]["text"] and chars[j + 1]["text"] \
+                    and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"]) \
+                    and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"],
+                                                                   chars[j]["width"]) / 2:
+                chars[j]["text"] += " "
+            j += 1
+
+        self.__ocr(i + 1, img, chars, zoomin)
+        return chars
+
+    def _detect_english_by_boxes(self, has_chars):
+        if not self.is_english and not has_chars and self.boxes:
+            bxes = [b for bxs in self.boxes for b in bxs]
+            self.is_english = re.search(r"[\na-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}",
+                                        "".join([b["text"] for b in random.choices(bxes, k=min(30, len(bxes)))]))
+
+        logging.debug("Is it English:", self.is_english)
+
+    def __images__(self, fnm, zoomin=3, page_from=0,
+                   page_to=299, callback=None):
+        if PDF_STREAMING_WINDOW > 0:
+            return self._images_streaming(fnm, zoomin, page_from, page_to, callback, PDF_STREAMING_WINDOW)
+
+        self._reset_pages(page_from)
         start = timer()
-        for i, img in enumerate(self.page_images):
-            chars = self.page_chars[i] if not self.is_english else []
-            self.mean_height.append(
-                np.median(sorted([c["height"] for c in chars])) if chars else 0
-            )
-            self.mean_width.append(
-                np.median(sorted([c["width"] for c in chars])) if chars else 8
-            )
-            self.page_cum_height.append(img.size[1] / zoomin)
-            j = 0
-            while j + 1 < len(chars):
-                if chars[j]["text"] and chars[j + 1]["text"] \
-                        and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"]) \
-                        and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"],
-                                                                       chars[j]["width"]) / 2:
-                    chars[j]["text"] += " "
-                j += 1
+        try:
+            self.pdf = pdfplumber.open(fnm) if isinstance(
+                fnm, str) else pdfplumber.open(BytesIO(fnm))
+            with PdfRenderer(fnm) as renderer:
+                self.page_images = renderer.render_pages(
+                    range(len(self.pdf.pages))[page_from:page_to], 72 * zoomin)
+            try:
+                self.page_chars = []
+                for page in self.pdf.pages[page_from:page_to]:
+                    chars = [c for c in page.dedupe_chars().chars if self._has_color(c)]
+                    self.page_chars.append(chars)
+                    self.page_text_layer.append(self._text_layer_usable(page, chars))
+            except Exception as e:
+                logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+                self.page_text_layer = []
+
+            self.total_page = len(self.pdf.pages)
+            self.pdf.close()
+        except Exception:
+            logging.exception("RAGFlowPdfParser __images__")
+        logging.info(f"__images__ dedupe_chars cost {timer() - start}s")
 
-            self.__ocr(i + 1, img, chars, zoomin)
+        self._load_outlines(fnm)
+
+        logging.debug("Images converted.")
+        self._detect_english()
+
+        start = timer()
+        for i, img in enumerate(self.page_images):
+            self._ocr_page(i, img, zoomin)
             if callback and i % 6 == 5:
                 callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
         logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
 
-        if not self.is_english and not any(
-                [c for c in self.page_chars]) and self.boxes:
-            bxes = [b for bxs in self.boxes for b in bxs]
-            self.is_english = re.search(r"[\na-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}",
-                                        "".join([b["text"] for b in random.choices(bxes, k=min(30, len(bxes)))]))
-
-        logging.debug("Is it English:", self.is_english)
+        self._detect_english_by_boxes(any([c for c in self.page_chars]))
 
         self.page_cum_height = np.cumsum(self.page_cum_height)
         assert len(self.page_cum_height) == len(self.page_images) + 1
         if len(self.boxes) == 0 and zoomin < 9:
             self.__images__(fnm, zoomin * 3, page_from, page_to, callback)
 
+    def _images_streaming(self, fnm, zoomin, page_from, page_to, callback, window):
+        """
+        Render, OCR and detect layouts `window` pages at a time. Only the
+        compact chars and boxes of every page are kept; page images are
+        re-rendered from the source PDF on demand (see LazyPageImages), and a
+        page without any detected text is retried at a higher zoom on its own.
+        """
+        self._close_page_images()
+        self._reset_pages(page_from)
+        self.page_layout_pred = []
+        start = timer()
+        self.page_chars = []
+        try:
+            self.page_images = LazyPageImages(fnm, page_from, zoomin, window)
+            self.total_page = self.page_images.total_page
+            try:
+                self.page_chars, self.page_text_layer = self.page_images.extract_chars(
+                    page_to, self._has_color, self._text_layer_usable)
+            except Exception as e:
+                logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                self.page_chars = [[] for _ in range(max(0, min(page_to, self.total_page) - page_from))]
+                self.page_text_layer = []
+        except Exception:
+            logging.exception("RAGFlowPdfParser _images_streaming")
+            self.page_images = []
+        logging.info(f"_images_streaming dedupe_chars cost {timer() - start}s")
+
+        self._load_outlines(fnm)
+        self._detect_english()
+        has_chars = any([c for c in self.page_chars])
+
+        start = timer()
+        page_cnt = len(self.page_chars) if self.page_images else 0
+        for st in range(0, page_cnt, window):
+            self.page_images.prefetch(st, min(st + window, page_cnt))
+            imgs = []
+            for i in range(st, min(st + window, page_cnt)):
+                img = self.page_images.render(i)
+                lefted = len(self.lefted_chars)
+                chars = self._ocr_page(i, img, zoomin)
+                if not self.boxes[-1] and zoomin < 9:
+                    self.boxes.pop()
+                    del self.lefted_chars[lefted:]
+                    self.__ocr(i + 1, self.page_images.render_at(i, zoomin * 3), chars, zoomin * 3)
+                self.page_chars[i] = []
+                imgs.append(img)
+            self.page_layout_pred.extend(self.layouter.forward(imgs, thr=0.2))
+            if callback:
+                callback(prog=min(st + window, page_cnt) * 0.6 / page_cnt, msg="")
+        logging.info(f"_images_streaming {page_cnt} pages cost {timer() - start}s")
+
+        self._detect_english_by_boxes(has_chars)
+
+        self.page_cum_height = np.cumsum(self.page_cum_height)
+        assert len(self.page_cum_height) == len(self.page_images) + 1
+        self._close_page_images()
+
+    def _close_page_images(self):
+        # the renderer, its temporary file and the rendered pages; later crops open the renderer again
+        if isinstance(getattr(self, "page_images", None), LazyPageImages):
+            self.page_images.close()
+
     def __call__(self, fnm, need_image=True, zoomin=3, return_html=False):
         self.__images__(fnm, zoomin)
         self._layouts_rec(zoomin)
@@ -1068,7 +1390,9 @@ class RAGFlowPdfParser:
         self._filter_forpages()
         tbls = self._extract_table_figure(
             need_image, zoomin, return_html, False)
-        return self.__filterout_scraps(deepcopy(self.boxes), zoomin), tbls
+        res = self.__filterout_scraps(deepcopy(self.boxes), zoomin)
+        self._close_page_images()
+        return res, tbls
 
     def remove_tag(self, txt):
         return re.sub(r"@@[\t0-9.-]+?##", "", txt)
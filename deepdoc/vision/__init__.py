@@ -14,9 +14,6 @@
 #  limitations under the License.
 #
 import io
-import sys
-import threading
-import pdfplumber
 
 from .ocr import OCR
 from .recognizer import Recognizer
@@ -24,16 +21,12 @@ from .layout_recognizer import LayoutRecognizer4YOLOv10 as LayoutRecognizer
 from .table_structure_recognizer import TableStructureRecognizer
 
 
-LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
-if LOCK_KEY_pdfplumber not in sys.modules:
-    sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
-
-
 def init_in_out(args):
     from PIL import Image
     import os
     import traceback
     from api.utils.file_utils import traversal_files
+    from rag.utils.pdf_render import PdfRenderer
     images = []
     outputs = []
 
@@ -42,14 +35,11 @@ def init_in_out(args):
 
     def pdf_pages(fnm, zoomin=3):
         nonlocal outputs, images
-        with sys.modules[LOCK_KEY_pdfplumber]:
-            pdf = pdfplumber.open(fnm)
-            images = [p.to_image(resolution=72 * zoomin).annotated for i, p in
-                                enumerate(pdf.pages)]
+        with PdfRenderer(fnm) as renderer:
+            images = renderer.render_pages(range(len(renderer)), 72 * zoomin)
 
         for i, page in enumerate(images):
             outputs.append(os.path.split(fnm)[-1] + f"_{i}.jpg")
-        pdf.close()
 
     def images_and_outputs(fnm):
         nonlocal outputs, images
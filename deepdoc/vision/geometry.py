@@ -0,0 +1,187 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+from collections import defaultdict
+
+import numpy as np
+
+# column order of the array representation of boxes
+X0, TOP, X1, BOTTOM = 0, 1, 2, 3
+
+
+def boxes_to_array(boxes):
+    """Turn a list of box dicts into an (N, 4) float array of x0, top, x1, bottom."""
+    if not boxes:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.array([[b["x0"], b["top"], b["x1"], b["bottom"]] for b in boxes], dtype=np.float64)
+
+
+def intersection_areas(box, arr):
+    """Intersection area between one box dict and every row of a box array."""
+    w = np.minimum(arr[:, X1], box["x1"]) - np.maximum(arr[:, X0], box["x0"])
+    h = np.minimum(arr[:, BOTTOM], box["bottom"]) - np.maximum(arr[:, TOP], box["top"])
+    return np.maximum(w, 0) * np.maximum(h, 0)
+
+
+def overlapped_ratios(box, arr):
+    """
+    Vectorised `Recognizer.overlapped_area(box, b)` for every b of `arr`:
+    the intersection as a fraction of the area of `box`.
+    """
+    area = (box["x1"] - box["x0"]) * (box["bottom"] - box["top"])
+    if area == 0:
+        return np.zeros(len(arr))
+    return intersection_areas(box, arr) / area
+
+
+def overlapped_ratios_of(arr, box):
+    """
+    Vectorised `Recognizer.overlapped_area(b, box)` for every b of `arr`:
+    the intersection as a fraction of the area of each b.
+    """
+    areas = (arr[:, X1] - arr[:, X0]) * (arr[:, BOTTOM] - arr[:, TOP])
+    ov = intersection_areas(box, arr)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(areas != 0, ov / np.where(areas != 0, areas, 1), 0)
+
+
+def cluster_lines(primary, secondary, thr):
+    """
+    Reading-order permutation: sort by `primary`, start a new line at the
+    first value at least `thr` past the first value of the current line,
+    then order by line and `secondary`. Lines are anchored on their first
+    box, so a run of staggered boxes doesn't chain into a single line.
+    Unlike a pairwise comparator with a threshold this is a total order, so
+    the result does not depend on the sort algorithm.
+    """
+    primary = np.asarray(primary, dtype=np.float64)
+    secondary = np.asarray(secondary, dtype=np.float64)
+    if len(primary) < 2:
+        return np.arange(len(primary))
+    if not thr or not np.isfinite(thr) or thr < 0:
+        thr = 0
+    order = np.argsort(primary, kind="stable")
+    values = primary[order]
+    new_line = np.zeros(len(values), dtype=np.int64)
+    i = 0
+    while True:
+        i = max(i + 1, int(np.searchsorted(values, values[i] + thr, side="left")))
+        if i >= len(values):
+            break
+        new_line[i] = 1
+    line_no = np.cumsum(new_line)
+    return order[np.lexsort((secondary[order], line_no))]
+
+
+def sort_by_rows(boxes, thr):
+    """Boxes grouped into rows by `top` (within `thr`) and ordered left to right."""
+    if len(boxes) < 2:
+        return list(boxes)
+    order = cluster_lines([b["top"] for b in boxes], [b["x0"] for b in boxes], thr)
+    return [boxes[i] for i in order]
+
+
+def sort_by_columns(boxes, thr):
+    """Boxes grouped into columns by `x0` (within `thr`) and ordered top to bottom."""
+    if len(boxes) < 2:
+        return list(boxes)
+    order = cluster_lines([b["x0"] for b in boxes], [b["top"] for b in boxes], thr)
+    return [boxes[i] for i in order]
+
+
+class BoxIndex:
+    """
+    Grid index over the vertical axis of a list of boxes. Each box is
+    registered in every horizontal band it spans, so an overlap query only
+    looks at the boxes sharing a band with the query box and evaluates
+    them with NumPy instead of scanning the whole list.
+    """
+
+    def __init__(self, boxes, cell=None):
+        self.boxes = boxes
+        self.arr = boxes_to_array(boxes)
+        self.cells = defaultdict(list)
+        self.y0 = 0
+        self.cell = 1
+        if not len(self.arr):
+            return
+        heights = self.arr[:, BOTTOM] - self.arr[:, TOP]
+        self.cell = cell or max(float(np.median(heights)), 1.)
+        self.y0 = float(self.arr[:, TOP].min())
+        for i, (c0, c1) in enumerate(zip(self._cell_of(self.arr[:, TOP]), self._cell_of(self.arr[:, BOTTOM]))):
+            for c in range(c0, c1 + 1):
+                self.cells[c].append(i)
+
+    def _cell_of(self, y):
+        return np.floor((np.asarray(y) - self.y0) / self.cell).astype(int)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def candidates(self, box):
+        """Indices of the boxes that may overlap `box`, in list order."""
+        if not self.cells:
+            return np.zeros(0, dtype=int)
+        c0, c1 = self._cell_of([box["top"], box["bottom"]])
+        if c1 - c0 > len(self.cells):
+            idx = [i for c in self.cells if c0 <= c <= c1 for i in self.cells[c]]
+        else:
+            idx = [i for c in range(c0, c1 + 1) for i in self.cells.get(c, [])]
+        return np.unique(np.asarray(idx, dtype=int))
+
+    def find_overlapped(self, box):
+        """
+        Index of the box that has the largest share of its own area covered
+        by `box` (first one on ties), or None if nothing overlaps.
+        """
+        idx = self.candidates(box)
+        if not len(idx):
+            return
+        ov = overlapped_ratios_of(self.arr[idx], box)
+        i = int(np.argmax(ov))
+        if ov[i] <= 0:
+            return
+        return int(idx[i])
+
+    def find_overlapped_with_threashold(self, box, thr=0.3):
+        """
+        Same selection as `Recognizer.find_overlapped_with_threashold`: the
+        last box maximising (share of `box` covered, share of itself
+        covered) among those covering at least `thr` of `box`.
+        """
+        idx = self.candidates(box)
+        if not len(idx):
+            return
+        ov = overlapped_ratios(box, self.arr[idx])
+        ok = ov >= thr
+        if not ok.any():
+            return
+        idx, ov = idx[ok], ov[ok]
+        _ov = overlapped_ratios_of(self.arr[idx], box)
+        best = ov == ov.max()
+        best &= _ov == _ov[best].max()
+        return int(idx[np.nonzero(best)[0][-1]])
+
+    def covered_area(self, box):
+        """Total intersection area between `box` and the indexed boxes."""
+        idx = self.candidates(box)
+        if not len(idx):
+            return 0
+        arr = self.arr[idx]
+        ov = intersection_areas(box, arr)
+        # degenerate boxes never count, as in Recognizer.overlapped_area
+        ov[(arr[:, X1] == arr[:, X0]) | (arr[:, BOTTOM] == arr[:, TOP])] = 0
+        return float(ov.sum())
@@ -25,7 +25,8 @@ from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
 from deepdoc.vision import Recognizer
-from deepdoc.vision.operators import nms
+from deepdoc.vision.operators import batched_nms
+from deepdoc.vision.geometry import BoxIndex
 
 
 class LayoutRecognizer(Recognizer):
@@ -58,7 +59,7 @@ class LayoutRecognizer(Recognizer):
         self.garbage_layouts = ["footer", "header", "reference"]
 
     def __call__(self, image_list, ocr_res, scale_factor=3,
-                 thr=0.2, batch_size=16, drop=True):
+                 thr=0.2, batch_size=16, drop=True, layouts=None):
         def __is_garbage(b):
             patt = [r"^•+$", r"(版权归©|免责条款|地址[:：])", r"\.{3,}", "^[0-9]{1,2} / ?[0-9]{1,2}$",
                     r"^[0-9]{1,2} of [0-9]{1,2}$", "^http://[^ ]{12,}",
@@ -67,7 +68,8 @@ class LayoutRecognizer(Recognizer):
                     ]
             return any([re.search(p, b["text"]) for p in patt])
 
-        layouts = super().__call__(image_list, thr, batch_size)
+        if layouts is None:
+            layouts = super().__call__(image_list, thr, batch_size)
         # save_results(image_list, layouts, self.labels, output_dir='output/', threshold=0.7)
         assert len(image_list) == len(ocr_res)
         # Tag layout type
@@ -92,6 +94,7 @@ class LayoutRecognizer(Recognizer):
             def findLayout(ty):
                 nonlocal bxs, lts, self
                 lts_ = [lt for lt in lts if lt["type"] == ty]
+                lts_index = BoxIndex(lts_)
                 i = 0
                 while i < len(bxs):
                     if bxs[i].get("layout_type"):
@@ -101,7 +104,7 @@ class LayoutRecognizer(Recognizer):
                         bxs.pop(i)
                         continue
 
-                    ii = self.find_overlapped_with_threashold(bxs[i], lts_,
+                    ii = self.find_overlapped_with_threashold(bxs[i], lts_index,
                                                               thr=0.4)
                     if ii is None:  # belong to nothing
                         bxs[i]["layout_type"] = ""
@@ -228,14 +231,7 @@ class LayoutRecognizer4YOLOv10(LayoutRecognizer):
                                 inputs["scale_factor"][1]])
         boxes = np.multiply(boxes, input_shape, dtype=np.float32)
 
-        unique_class_ids = np.unique(class_ids)
-        indices = []
-        for class_id in unique_class_ids:
-            class_indices = np.where(class_ids == class_id)[0]
-            class_boxes = boxes[class_indices, :]
-            class_scores = scores[class_indices]
-            class_keep_boxes = nms(class_boxes, class_scores, 0.45)
-            indices.extend(class_indices[class_keep_boxes])
+        indices = batched_nms(boxes, scores, class_ids, 0.45, pixel_offset=1)
 
         return [{
             "type": self.label_list[class_ids[i]].lower(),
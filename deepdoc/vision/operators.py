@@ -723,3 +723,40 @@ def nms(bboxes, scores, iou_thresh):
         idx = np.where(ious <= iou_thresh)[0]
         index = index[idx + 1]
     return indices
+
+
+def batched_nms(bboxes, scores, class_ids, iou_thresh, pixel_offset=0, strict=False):
+    """
+    Class-aware NMS over all boxes of an image in a single pass: a kept box
+    only suppresses the boxes of its class, which lets one suppression loop
+    replace one loop per class. IoUs are computed as `nms` does: areas from
+    the raw corners, `pixel_offset` added to the intersection sides only.
+    Boxes are suppressed above `iou_thresh`, or from it on when `strict`.
+    Returns kept indices grouped by class id (ascending) and by descending
+    score within a class, the same order as running `nms` class by class.
+    """
+    import numpy as np
+    if len(bboxes) == 0:
+        return []
+    bboxes = np.asarray(bboxes)
+    scores = np.asarray(scores)
+    class_ids = np.asarray(class_ids)
+    x1, y1, x2, y2 = bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3]
+    areas = (y2 - y1) * (x2 - x1)
+
+    keep = []
+    index = np.argsort(scores, kind="stable")[::-1]
+    while index.size > 0:
+        i = index[0]
+        keep.append(i)
+        rest = index[1:]
+        w = np.maximum(0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]) + pixel_offset)
+        h = np.maximum(0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]) + pixel_offset)
+        overlaps = w * h
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ious = overlaps / (areas[i] + areas[rest] - overlaps)
+        kept = ious < iou_thresh if strict else ious <= iou_thresh
+        index = rest[kept | (class_ids[rest] != class_ids[i])]
+    keep = np.asarray(keep)
+    keep = keep[np.argsort(class_ids[keep], kind="stable")]
+    return keep.tolist()
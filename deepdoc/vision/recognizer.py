@@ -19,14 +19,14 @@ import os
 import math
 import numpy as np
 import cv2
-from functools import cmp_to_key
 
 
 from api.utils.file_utils import get_project_base_directory
 from .operators import *  # noqa: F403
-from .operators import preprocess
+from .operators import preprocess, batched_nms
 from . import operators
 from .ocr import load_model
+from .geometry import BoxIndex, sort_by_rows, sort_by_columns
 
 class Recognizer:
     def __init__(self, label_list, task_name, model_dir=None):
@@ -50,32 +50,26 @@ class Recognizer:
         self.output_names = [node.name for node in self.ort_sess.get_outputs()]
         self.input_shape = self.ort_sess.get_inputs()[0].shape[2:4]
         self.label_list = label_list
+        # A symbolic or dynamic leading dimension means the exported model
+        # accepts several images per run.
+        batch_dim = self.ort_sess.get_inputs()[0].shape[0]
+        self.supports_batching = not isinstance(batch_dim, int) or batch_dim != 1
 
     @staticmethod
     def sort_Y_firstly(arr, threashold):
-        def cmp(c1, c2):
-            diff = c1["top"] - c2["top"]
-            if abs(diff) < threashold:
-                diff = c1["x0"] - c2["x0"]
-            return diff
-        arr = sorted(arr, key=cmp_to_key(cmp))
-        return arr
+        return sort_by_rows(arr, threashold)
 
     @staticmethod
     def sort_X_firstly(arr, threashold):
-        def cmp(c1, c2):
-            diff = c1["x0"] - c2["x0"]
-            if abs(diff) < threashold:
-                diff = c1["top"] - c2["top"]
-            return diff
-        arr = sorted(arr, key=cmp_to_key(cmp))
-        return arr
+        return sort_by_columns(arr, threashold)
 
     @staticmethod
     def sort_C_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["x0"], r["top"]))
         arr = Recognizer.sort_X_firstly(arr, thr)
+        if all(["C" in a for a in arr]):
+            return sorted(arr, key=lambda a: (a["C"], a["top"]))
         for i in range(len(arr) - 1):
             for j in range(i, -1, -1):
                 # restore the order using th
@@ -96,6 +90,8 @@ class Recognizer:
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["top"], r["x0"]))
         arr = Recognizer.sort_Y_firstly(arr, thr)
+        if all(["R" in a for a in arr]):
+            return sorted(arr, key=lambda a: (a["R"], a["x0"]))
         for i in range(len(arr) - 1):
             for j in range(i, -1, -1):
                 if "R" not in arr[j] or "R" not in arr[j + 1]:
@@ -139,6 +135,7 @@ class Recognizer:
                         a["bottom"] < b["top"],
                         a["top"] > b["bottom"]])
 
+        box_index = None
         i = 0
         while i + 1 < len(layouts):
             j = i + 1
@@ -161,12 +158,10 @@ class Recognizer:
                     layouts.pop(i)
                 continue
 
-            area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not notOverlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not notOverlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            if box_index is None:
+                box_index = BoxIndex(boxes)
+            area_i = box_index.covered_area(layouts[i])
+            area_i_1 = box_index.covered_area(layouts[j])
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -217,6 +212,8 @@ class Recognizer:
 
     @staticmethod
     def find_overlapped(box, boxes_sorted_by_y, naive=False):
+        if isinstance(boxes_sorted_by_y, BoxIndex):
+            return boxes_sorted_by_y.find_overlapped(box)
         if not boxes_sorted_by_y:
             return
         bxs = boxes_sorted_by_y
@@ -266,6 +263,8 @@ class Recognizer:
 
     @staticmethod
     def find_overlapped_with_threashold(box, boxes, thr=0.3):
+        if isinstance(boxes, BoxIndex):
+            return boxes.find_overlapped_with_threashold(box, thr)
         if not boxes:
             return
         max_overlapped_i, max_overlapped, _max_overlapped = None, thr, 0
@@ -281,6 +280,30 @@ class Recognizer:
 
         return max_overlapped_i
 
+    def stack_inputs(self, inputs):
+        """
+        Merge the per-image inputs produced by `preprocess` into one feed
+        dict. Every image has already been resized to the same fixed shape,
+        so the tensors are concatenated along the batch axis.
+        """
+        feed = {}
+        for k in self.input_names:
+            feed[k] = np.concatenate([np.asarray(ins[k], dtype=np.float32) for ins in inputs], axis=0)
+        return feed
+
+    def split_outputs(self, outputs, batch_len):
+        """
+        Split the output of one batched run back into per-image outputs
+        shaped like the output of a single-image run.
+        """
+        if "scale_factor" in self.input_names and len(outputs) > 1:
+            # Paddle detectors emit every box of the batch in one array
+            # together with the number of boxes that belong to each image.
+            bbox_num = np.asarray(outputs[1]).reshape(-1).astype(int)
+            offsets = np.concatenate([[0], np.cumsum(bbox_num)])
+            return [outputs[0][offsets[i]:offsets[i + 1]] for i in range(batch_len)]
+        return [outputs[0][i:i + 1] for i in range(batch_len)]
+
     def preprocess(self, image_list):
         inputs = []
         if "scale_factor" in self.input_names:
@@ -337,46 +360,6 @@ class Recognizer:
             y[:, 3] = x[:, 1] + x[:, 3] / 2
             return y
 
-        def compute_iou(box, boxes):
-            # Compute xmin, ymin, xmax, ymax for both boxes
-            xmin = np.maximum(box[0], boxes[:, 0])
-            ymin = np.maximum(box[1], boxes[:, 1])
-            xmax = np.minimum(box[2], boxes[:, 2])
-            ymax = np.minimum(box[3], boxes[:, 3])
-
-            # Compute intersection area
-            intersection_area = np.maximum(0, xmax - xmin) * np.maximum(0, ymax - ymin)
-
-            # Compute union area
-            box_area = (box[2] - box[0]) * (box[3] - box[1])
-            boxes_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
-            union_area = box_area + boxes_area - intersection_area
-
-            # Compute IoU
-            iou = intersection_area / union_area
-
-            return iou
-
-        def iou_filter(boxes, scores, iou_threshold):
-            sorted_indices = np.argsort(scores)[::-1]
-
-            keep_boxes = []
-            while sorted_indices.size > 0:
-                # Pick the last box
-                box_id = sorted_indices[0]
-                keep_boxes.append(box_id)
-
-                # Compute IoU of the picked box with the rest
-                ious = compute_iou(boxes[box_id, :], boxes[sorted_indices[1:], :])
-
-                # Remove boxes with IoU over the threshold
-                keep_indices = np.where(ious < iou_threshold)[0]
-
-                # print(keep_indices.shape, sorted_indices.shape)
-                sorted_indices = sorted_indices[keep_indices + 1]
-
-            return keep_boxes
-
         boxes = np.squeeze(boxes).T
         # Filter out object confidence scores below threshold
         scores = np.max(boxes[:, 4:], axis=1)
@@ -392,14 +375,7 @@ class Recognizer:
         boxes = np.multiply(boxes, input_shape, dtype=np.float32)
         boxes = xywh2xyxy(boxes)
 
-        unique_class_ids = np.unique(class_ids)
-        indices = []
-        for class_id in unique_class_ids:
-            class_indices = np.where(class_ids == class_id)[0]
-            class_boxes = boxes[class_indices, :]
-            class_scores = scores[class_indices]
-            class_keep_boxes = iou_filter(class_boxes, class_scores, 0.2)
-            indices.extend(class_indices[class_keep_boxes])
+        indices = batched_nms(boxes, scores, class_ids, 0.2, strict=True)
 
         return [{
             "type": self.label_list[class_ids[i]].lower(),
@@ -423,9 +399,14 @@ class Recognizer:
             batch_image_list = imgs[start_index:end_index]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
-            for ins in inputs:
-                bb = self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
-                res.append(bb)
+            if not self.supports_batching or len(inputs) == 1:
+                for ins in inputs:
+                    bb = self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
+                    res.append(bb)
+                continue
+            outputs = self.ort_sess.run(None, self.stack_inputs(inputs), self.run_options)
+            for ins, out in zip(inputs, self.split_outputs(outputs, len(inputs))):
+                res.append(self.postprocess(out, ins, thr))
 
         #seeit.save_results(image_list, res, self.label_list, threshold=thr)
 
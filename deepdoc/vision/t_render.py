@@ -0,0 +1,95 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pdfplumber
+
+from api.utils.file_utils import traversal_files
+from rag.utils.pdf_render import PdfRenderer
+
+
+def pdfplumber_pages(fnm, resolution, lock):
+    # how pages were rendered before PdfRenderer: pdfplumber under one lock of the process
+    with lock:
+        pdf = pdfplumber.open(fnm)
+        images = [p.to_image(resolution=resolution).annotated for p in pdf.pages]
+    pdf.close()
+    return len(images)
+
+
+def renderer_pages(fnm, resolution, workers):
+    with PdfRenderer(fnm, workers=workers) as renderer:
+        return len(renderer.render_pages(range(len(renderer)), resolution))
+
+
+def run(render, files, concurrency):
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pages = sum(pool.map(render, files))
+    return pages, time.time() - start
+
+
+def main(args):
+    if os.path.isdir(args.inputs):
+        files = [f for f in traversal_files(args.inputs) if f.lower().endswith(".pdf")]
+    else:
+        files = [args.inputs]
+    # every thread renders whole documents, as concurrent parsing tasks do
+    files = [files[i % len(files)] for i in range(max(len(files), args.concurrency * args.rounds))]
+    resolution = 72 * args.zoomin
+
+    configs = [("pdfplumber + global lock", lambda f, lock=threading.Lock(): pdfplumber_pages(f, resolution, lock))]
+    for w in [int(w) for w in args.workers.split(",")]:
+        name = "PdfRenderer in-process" if w <= 1 else f"PdfRenderer {w} workers"
+        configs.append((name, lambda f, w=w: renderer_pages(f, resolution, w)))
+
+    print(f"{len(files)} documents, {args.concurrency} at a time, {resolution} DPI, {os.cpu_count()} CPUs")
+    for name, render in configs:
+        # warm up: spawn the workers and load the libraries
+        run(render, files[:args.concurrency], args.concurrency)
+        pages, elapsed = run(render, files, args.concurrency)
+        print(f"{name:<28}{pages:>8} pages {elapsed:>9.2f}s {pages / elapsed:>9.1f} pages/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inputs',
+                        help="Directory where to find PDFs, or a file path to a single PDF",
+                        required=True)
+    parser.add_argument('--concurrency', help="Documents rendered at the same time. Default: 4",
+                        type=int, default=4)
+    parser.add_argument('--rounds', help="Documents rendered by each thread. Default: 2",
+                        type=int, default=2)
+    parser.add_argument('--workers', help="Comma separated numbers of render workers to compare. Default: '0,2,4'",
+                        default="0,2,4")
+    parser.add_argument('--zoomin', help="Pages are rendered at 72 * zoomin DPI. Default: 3",
+                        type=int, default=3)
+    args = parser.parse_args()
+    main(args)
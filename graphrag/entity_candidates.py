@@ -0,0 +1,132 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Candidate pairs for entity resolution. Instead of comparing every pair of
+entities of a type, names are put into blocks that share a normalized key or
+a MinHash/LSH band of their character n-grams (optionally also their nearest
+neighbours by name embedding), and only names sharing a block are paired.
+"""
+import logging
+import re
+from collections import defaultdict
+
+import numpy as np
+import xxhash
+
+from rag.nlp import is_english
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"[\W_]+", "", name.lower())
+
+
+def char_ngrams(name: str, n: int | None = None) -> set[str]:
+    """Character n-grams of the normalized name: trigrams for English, bigrams otherwise."""
+    s = normalize_name(name)
+    if not s:
+        return set()
+    if n is None:
+        n = 3 if is_english(s) else 2
+    if len(s) <= n:
+        return {s}
+    return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+
+class MinHashLSH:
+    """MinHash signatures of n-gram sets, cut into `bands` bands for locality-sensitive bucketing."""
+
+    def __init__(self, num_perm=64, bands=16, seed=1):
+        assert num_perm % bands == 0
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+
+    def signature(self, grams: set[str]) -> np.ndarray:
+        h = np.array([xxhash.xxh64_intdigest(g.encode("utf-8")) for g in grams], dtype=np.uint64)
+        # multiply-shift hashing, the uint64 overflow is intended
+        with np.errstate(over="ignore"):
+            return ((h[:, None] * self.a + self.b) >> np.uint64(32)).min(axis=0)
+
+    def band_keys(self, grams: set[str]) -> list[tuple]:
+        sig = self.signature(grams)
+        return [(i, sig[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+
+
+def _block_pairs(members: list[int], keys: list[str], max_block_size: int) -> set[tuple[int, int]]:
+    if len(members) <= max_block_size:
+        return {(a, b) if a < b else (b, a) for i, a in enumerate(members) for b in members[i + 1:]}
+    # oversized block: only pair each name with its neighbours in sorted order
+    members = sorted(members, key=lambda i: keys[i])
+    pairs = set()
+    for i, a in enumerate(members):
+        for b in members[i + 1:i + max_block_size]:
+            pairs.add((a, b) if a < b else (b, a))
+    return pairs
+
+
+def _ann_pairs(vectors: list, top_k: int, threshold: float, chunk=1024) -> set[tuple[int, int]]:
+    idx = [i for i, v in enumerate(vectors) if v is not None]
+    if len(idx) < 2:
+        return set()
+    m = np.array([vectors[i] for i in idx], dtype=np.float32)
+    m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    k = min(top_k + 1, len(idx))
+    pairs = set()
+    for s in range(0, len(idx), chunk):
+        sims = m[s:s + chunk] @ m.T
+        nn = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        for r, cols in enumerate(nn):
+            for c in cols:
+                if s + r != c and sims[r, c] >= threshold:
+                    a, b = idx[s + r], idx[c]
+                    pairs.add((a, b) if a < b else (b, a))
+    return pairs
+
+
+def candidate_pairs(names: list[str], max_block_size=64, num_perm=64, bands=16,
+                    vectors: list | None = None, ann_top_k=5, ann_threshold=0.9) -> list[tuple[str, str]]:
+    """
+    Pairs of names worth asking the LLM about. Names are blocked by their
+    normalized form and by the LSH bands of their n-grams; blocks larger
+    than `max_block_size` fall back to a sorted-neighbourhood window of that
+    size. If name embeddings are given (`vectors`, aligned with `names`),
+    each name is also paired with its `ann_top_k` nearest neighbours whose
+    cosine similarity reaches `ann_threshold`.
+    """
+    lsh = MinHashLSH(num_perm, bands)
+    keys = [normalize_name(n) for n in names]
+    blocks = defaultdict(list)
+    for i, name in enumerate(names):
+        if not keys[i]:
+            continue
+        blocks[("key", keys[i])].append(i)
+        for band in lsh.band_keys(char_ngrams(name)):
+            blocks[band].append(i)
+
+    pairs = set()
+    oversized = 0
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        oversized += len(members) > max_block_size
+        pairs |= _block_pairs(members, keys, max_block_size)
+    if vectors is not None:
+        pairs |= _ann_pairs(vectors, ann_top_k, ann_threshold)
+    if oversized:
+        logging.info(f"candidate_pairs: {oversized} blocks over {max_block_size} names were windowed")
+    return [(names[a], names[b]) for a, b in sorted(pairs)]
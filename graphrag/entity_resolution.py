@@ -13,7 +13,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-import itertools
+import logging
 import re
 import time
 from dataclasses import dataclass
@@ -27,11 +27,14 @@ from rag.nlp import is_english
 import editdistance
 from graphrag.entity_resolution_prompt import ENTITY_RESOLUTION_PROMPT
 from rag.llm.chat_model import Base as CompletionLLM
-from graphrag.utils import perform_variable_replacements, chat_limiter
+from graphrag.entity_candidates import candidate_pairs
+from graphrag.utils import perform_variable_replacements, chat_limiter, embed_with_cache
 
 DEFAULT_RECORD_DELIMITER = "##"
 DEFAULT_ENTITY_INDEX_DELIMITER = "<|>"
 DEFAULT_RESOLUTION_RESULT_DELIMITER = "&&"
+# candidate pairs asked per resolution prompt
+RESOLUTION_BATCH_SIZE = 100
 
 
 @dataclass
@@ -39,6 +42,8 @@ class EntityResolutionResult:
     """Entity resolution result class definition."""
     graph: nx.Graph
     removed_entities: list
+    # kept entities and the neighbours of the removed ones, whose edges changed
+    changed_entities: set
 
 
 class EntityResolution(Extractor):
@@ -56,7 +61,8 @@ class EntityResolution(Extractor):
             get_entity: Callable | None = None,
             set_entity: Callable | None = None,
             get_relation: Callable | None = None,
-            set_relation: Callable | None = None
+            set_relation: Callable | None = None,
+            embed_model=None
     ):
         super().__init__(llm_invoker, get_entity=get_entity, set_entity=set_entity, get_relation=get_relation, set_relation=set_relation)
         """Init method definition."""
@@ -66,6 +72,7 @@ class EntityResolution(Extractor):
         self._entity_index_dilimiter_key = "entity_index_delimiter"
         self._resolution_result_delimiter_key = "resolution_result_delimiter"
         self._input_text_key = "input_text"
+        self._embed_model = embed_model
 
     async def __call__(self, graph: nx.Graph, prompt_variables: dict[str, Any] | None = None) -> EntityResolutionResult:
         """Call method definition."""
@@ -92,17 +99,24 @@ class EntityResolution(Extractor):
 
         candidate_resolution = {entity_type: [] for entity_type in entity_types}
         for k, v in node_clusters.items():
-            candidate_resolution[k] = [(a, b) for a, b in itertools.combinations(v, 2) if self.is_similarity(a, b)]
+            vectors = None
+            if self._embed_model:
+                vectors = await trio.to_thread.run_sync(lambda: embed_with_cache(self._embed_model, [(n, n) for n in v]))
+            pairs = await trio.to_thread.run_sync(lambda: candidate_pairs(v, vectors=vectors))
+            candidate_resolution[k] = [(a, b) for a, b in pairs if self.is_similarity(a, b)]
+        logging.info(f"Entity resolution: {sum(len(v) for v in candidate_resolution.values())} candidate pairs "
+                     f"among {len(nodes)} entities")
 
         resolution_result = set()
         async with trio.open_nursery() as nursery:
-            for candidate_resolution_i in candidate_resolution.items():
-                if not candidate_resolution_i[1]:
-                    continue
-                nursery.start_soon(lambda: self._resolve_candidate(candidate_resolution_i, resolution_result))
+            for ty, candidates in candidate_resolution.items():
+                for i in range(0, len(candidates), RESOLUTION_BATCH_SIZE):
+                    batch = (ty, candidates[i:i + RESOLUTION_BATCH_SIZE])
+                    nursery.start_soon(self._resolve_candidate, batch, resolution_result)
 
         connect_graph = nx.Graph()
         removed_entities = []
+        changed_entities = set()
         connect_graph.add_edges_from(resolution_result)
         all_entities_data = []
         all_relationships_data = []
@@ -111,11 +125,13 @@ class EntityResolution(Extractor):
             sub_connect_graph = connect_graph.subgraph(sub_connect_graph)
             remove_nodes = list(sub_connect_graph.nodes)
             keep_node = remove_nodes.pop()
+            changed_entities.add(keep_node)
             await self._merge_nodes(keep_node, self._get_entity_(remove_nodes), all_entities_data)
             for remove_node in remove_nodes:
                 removed_entities.append(remove_node)
                 remove_node_neighbors = graph[remove_node]
                 remove_node_neighbors = list(remove_node_neighbors)
+                changed_entities.update(remove_node_neighbors)
                 for remove_node_neighbor in remove_node_neighbors:
                     rel = self._get_relation_(remove_node, remove_node_neighbor)
                     if graph.has_edge(remove_node, remove_node_neighbor):
@@ -145,7 +161,8 @@ class EntityResolution(Extractor):
 
         return EntityResolutionResult(
             graph=graph,
-            removed_entities=removed_entities
+            removed_entities=removed_entities,
+            changed_entities=changed_entities - set(removed_entities)
         )
 
     async def _resolve_candidate(self, candidate_resolution_i, resolution_result):
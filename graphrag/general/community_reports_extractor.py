@@ -8,8 +8,9 @@ Reference:
 import logging
 import json
 import re
+from collections import defaultdict
 from typing import Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import networkx as nx
 import pandas as pd
 from graphrag.general import leiden
@@ -29,6 +30,45 @@ class CommunityReportsResult:
 
     output: list[str]
     structured_output: list[dict]
+    # ids of the existing reports still describing a community, with its new weight and entities
+    kept: dict[str, dict] = field(default_factory=dict)
+
+
+class CommunityReportMatcher:
+    """
+    Pairs a community with the existing report of the most similar entity
+    set, provided that at most `change_threshold` of their union differs
+    (1 - Jaccard similarity). Each report is paired at most once.
+    """
+
+    def __init__(self, reports: dict[str, dict], change_threshold: float):
+        self.change_threshold = change_threshold
+        self.members = {}
+        self.by_entity = defaultdict(set)
+        self.used = set()
+        for id, r in reports.items():
+            ents = r.get("entities_kwd") or []
+            if isinstance(ents, str):
+                ents = [ents]
+            self.members[id] = set(ents)
+            for e in ents:
+                self.by_entity[e].add(id)
+
+    def match(self, entities: list[str]) -> str | None:
+        ents = set(entities)
+        candidates = set()
+        for e in ents:
+            candidates |= self.by_entity.get(e, set())
+        best, best_sim = None, 0.0
+        for id in sorted(candidates - self.used):
+            m = self.members[id]
+            sim = len(ents & m) / len(ents | m)
+            if sim > best_sim:
+                best, best_sim = id, sim
+        if best is None or 1 - best_sim > self.change_threshold:
+            return None
+        self.used.add(best)
+        return best
 
 
 class CommunityReportsExtractor(Extractor):
@@ -53,7 +93,17 @@ class CommunityReportsExtractor(Extractor):
         self._extraction_prompt = COMMUNITY_REPORT_PROMPT
         self._max_report_length = max_report_length or 1500
 
-    async def __call__(self, graph: nx.Graph, callback: Callable | None = None):
+    async def __call__(self, graph: nx.Graph, callback: Callable | None = None, existing_reports: dict | None = None,
+                       change_threshold: float = 0.0):
+        """
+        Detect the communities of `graph` and write a report for each. A
+        community matching one of `existing_reports` (see
+        CommunityReportMatcher) keeps that report and is only listed in
+        `kept`; reports are generated for the other ones.
+        """
+        existing_reports = existing_reports or {}
+        matcher = CommunityReportMatcher(existing_reports, change_threshold)
+        kept = {}
         for node_degree in graph.degree:
             graph.nodes[str(node_degree[0])]["rank"] = int(node_degree[1])
 
@@ -68,6 +118,12 @@ class CommunityReportsExtractor(Extractor):
             for cm_id, ents in comm.items():
                 weight = ents["weight"]
                 ents = ents["nodes"]
+                report_id = matcher.match(ents)
+                if report_id is not None:
+                    kept[report_id] = {"weight": weight, "entities": ents}
+                    add_community_info2graph(graph, ents, existing_reports[report_id].get("docnm_kwd", ""))
+                    over += 1
+                    continue
                 ent_df = pd.DataFrame(self._get_entity_(ents)).dropna()#[{"entity": n, **graph.nodes[n]} for n in ents])
                 if ent_df.empty or "entity_name" not in ent_df.columns:
                     continue
@@ -119,9 +175,12 @@ class CommunityReportsExtractor(Extractor):
                 if callback:
                     callback(msg=f"Communities: {over}/{total}, elapsed: {timer() - st}s, used tokens: {token_count}")
 
+        if callback:
+            callback(msg=f"Communities: {len(kept)} reports kept, {len(res_dict)} generated.")
         return CommunityReportsResult(
             structured_output=res_dict,
             output=res_str,
+            kept=kept,
         )
 
     def _get_text_output(self, parsed_output: dict) -> str:
@@ -13,23 +13,45 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import json
 import logging
+import math
 import re
 from collections import defaultdict, Counter
 from copy import deepcopy
 from typing import Callable
 import trio
+import xxhash
 
 from graphrag.general.graph_prompt import SUMMARIZE_DESCRIPTIONS_PROMPT
 from graphrag.utils import get_llm_cache, set_llm_cache, handle_single_entity_extraction, \
     handle_single_relationship_extraction, split_string_by_multi_markers, flat_uniq_list, chat_limiter
 from rag.llm.chat_model import Base as CompletionLLM
 from rag.prompts import message_fit_in
-from rag.utils import truncate
+from rag.settings import GRAPHRAG_PACK_TOKENS
+from rag.utils import truncate, num_tokens_from_string
+from rag.utils.redis_conn import REDIS_CONN
 
 GRAPH_FIELD_SEP = "<SEP>"
 DEFAULT_ENTITY_TYPES = ["organization", "person", "geo", "event", "category"]
 ENTITY_EXTRACTION_MAX_GLEANINGS = 2
+EXTRACTION_CHECKPOINT_TTL = 7 * 24 * 3600
+PREFETCH_BATCH_SIZE = 512
+
+
+def graphrag_extraction_key(kb_id, doc_id) -> str:
+    return f"graphrag:extraction:{kb_id}:{doc_id}"
+
+
+def _dumps_extraction(maybe_nodes: dict, maybe_edges: dict, token_count: int) -> str:
+    return json.dumps({"nodes": maybe_nodes,
+                       "edges": [[src, tgt, v] for (src, tgt), v in maybe_edges.items()],
+                       "tokens": token_count}, ensure_ascii=False)
+
+
+def _loads_extraction(value: str):
+    obj = json.loads(value)
+    return obj["nodes"], {(src, tgt): v for src, tgt, v in obj["edges"]}, obj["tokens"]
 
 
 class Extractor:
@@ -44,6 +66,7 @@ class Extractor:
         set_entity: Callable | None = None,
         get_relation: Callable | None = None,
         set_relation: Callable | None = None,
+        prefetch: Callable | None = None,
     ):
         self._llm = llm_invoker
         self._language = language
@@ -52,6 +75,7 @@ class Extractor:
         self._set_entity_ = set_entity
         self._get_relation_ = get_relation
         self._set_relation_ = set_relation
+        self._prefetch_ = prefetch
 
     def _chat(self, system, history, gen_conf):
         hist = deepcopy(history)
@@ -92,32 +116,99 @@ class Extractor:
                 )
         return dict(maybe_nodes), dict(maybe_edges)
 
+    def _pack_chunks(self, chunks: list[str]) -> list[str]:
+        """Concatenate consecutive chunks into prompts of up to GRAPHRAG_PACK_TOKENS tokens."""
+        max_tokens = int(self._llm.max_length * 0.8)
+        budget = min(GRAPHRAG_PACK_TOKENS, max_tokens)
+        packs, pack, pack_tokens = [], [], 0
+        for ck in chunks:
+            ck = truncate(ck, max_tokens)
+            tokens = num_tokens_from_string(ck)
+            if pack and pack_tokens + tokens > budget:
+                packs.append("\n\n".join(pack))
+                pack, pack_tokens = [], 0
+            pack.append(ck)
+            pack_tokens += tokens
+        if pack:
+            packs.append("\n\n".join(pack))
+        return packs
+
+    def _pack_key(self, content: str) -> str:
+        return xxhash.xxh64(json.dumps([self._llm.llm_name, type(self).__name__, self._entity_types, self._language,
+                                        content], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    async def _extract_pack(self, doc_id: str, key: str, content: str, send_channel):
+        async with send_channel:
+            result = await self._process_single_content((doc_id, content))
+            await send_channel.send((key, result, False))
+
     async def __call__(
         self, doc_id: str, chunks: list[str],
-            callback: Callable | None = None
+            callback: Callable | None = None,
+            checkpoint_key: str | None = None
     ):
-
+        """
+        Extract the entities and relations of `chunks` and merge them into the
+        existing graph. Chunks are packed into prompts of GRAPHRAG_PACK_TOKENS
+        tokens. With `checkpoint_key`, the result of every pack is saved to a
+        Redis hash as soon as it arrives and packs already found there are not
+        sent to the LLM again, so a failed task resumes where it stopped.
+        """
         self.callback = callback
         start_ts = trio.current_time()
-        out_results = []
-        async with trio.open_nursery() as nursery:
-            for i, ck in enumerate(chunks):
-                ck = truncate(ck, int(self._llm.max_length*0.8))
-                nursery.start_soon(lambda: self._process_single_content((doc_id, ck), i, len(chunks), out_results))
+        packs = self._pack_chunks(chunks)
+        done = {}
+        if checkpoint_key:
+            done = await trio.to_thread.run_sync(lambda: REDIS_CONN.hgetall(checkpoint_key)) or {}
 
         maybe_nodes = defaultdict(list)
         maybe_edges = defaultdict(list)
         sum_token_count = 0
-        for m_nodes, m_edges, token_count in out_results:
-            for k, v in m_nodes.items():
-                maybe_nodes[k].extend(v)
-            for k, v in m_edges.items():
-                maybe_edges[tuple(sorted(k))].extend(v)
-            sum_token_count += token_count
+        num_done, num_resumed = 0, 0
+        unfetched_names, unfetched_pairs = set(), set()
+        send_channel, receive_channel = trio.open_memory_channel(math.inf)
+        async with trio.open_nursery() as nursery:
+            async with send_channel:
+                for ck in packs:
+                    key = self._pack_key(ck)
+                    if key in done:
+                        send_channel.send_nowait((key, _loads_extraction(done[key]), True))
+                    else:
+                        nursery.start_soon(self._extract_pack, doc_id, key, ck, send_channel.clone())
+
+            # fold every result in as it arrives, prefetching the existing entities and relations meanwhile
+            async with receive_channel:
+                async for key, (m_nodes, m_edges, token_count), resumed in receive_channel:
+                    if resumed:
+                        num_resumed += 1
+                    else:
+                        sum_token_count += token_count
+                        if checkpoint_key:
+                            value = _dumps_extraction(m_nodes, m_edges, token_count)
+                            await trio.to_thread.run_sync(
+                                lambda: REDIS_CONN.hset(checkpoint_key, key, value, EXTRACTION_CHECKPOINT_TTL))
+                    for k, v in m_nodes.items():
+                        maybe_nodes[k].extend(v)
+                        unfetched_names.add(k)
+                    for k, v in m_edges.items():
+                        k = tuple(sorted(k))
+                        maybe_edges[k].extend(v)
+                        unfetched_names.update(k)
+                        unfetched_pairs.add(k)
+                    num_done += 1
+                    if self.callback:
+                        self.callback(0.5 + 0.1 * num_done / len(packs), msg=f"Entities extraction of {num_done}/{len(packs)} chunk packs done, {len(m_nodes)} nodes, {len(m_edges)} edges, {token_count} tokens{', resumed' if resumed else ''}.")
+                    if self._prefetch_ and len(unfetched_names) >= PREFETCH_BATCH_SIZE:
+                        names, pairs = list(unfetched_names), list(unfetched_pairs)
+                        unfetched_names, unfetched_pairs = set(), set()
+                        await trio.to_thread.run_sync(lambda: self._prefetch_(names, pairs))
+
         now = trio.current_time()
         if callback:
-            callback(msg = f"Entities and relationships extraction done, {len(maybe_nodes)} nodes, {len(maybe_edges)} edges, {sum_token_count} tokens, {now-start_ts:.2f}s.")
+            callback(msg = f"Entities and relationships extraction done, {len(maybe_nodes)} nodes, {len(maybe_edges)} edges, {sum_token_count} tokens, {len(chunks)} chunks in {len(packs)} packs, {num_resumed} resumed, {now-start_ts:.2f}s.")
         start_ts = now
+        if self._prefetch_ and unfetched_names:
+            await trio.to_thread.run_sync(lambda: self._prefetch_(list(unfetched_names), list(unfetched_pairs)))
         logging.info("Entities merging...")
         all_entities_data = []
         async with trio.open_nursery() as nursery:
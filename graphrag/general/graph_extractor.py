@@ -57,6 +57,7 @@ class GraphExtractor(Extractor):
         set_entity: Callable | None = None,
         get_relation: Callable | None = None,
         set_relation: Callable | None = None,
+        prefetch: Callable | None = None,
         tuple_delimiter_key: str | None = None,
         record_delimiter_key: str | None = None,
         input_text_key: str | None = None,
@@ -66,7 +67,7 @@ class GraphExtractor(Extractor):
         max_gleanings: int | None = None,
         on_error: ErrorHandlerFn | None = None,
     ):
-        super().__init__(llm_invoker, language, entity_types, get_entity, set_entity, get_relation, set_relation)
+        super().__init__(llm_invoker, language, entity_types, get_entity, set_entity, get_relation, set_relation, prefetch)
         """Init method definition."""
         # TODO: streamline construction
         self._llm = llm_invoker
@@ -102,7 +103,7 @@ class GraphExtractor(Extractor):
             self._entity_types_key: ",".join(DEFAULT_ENTITY_TYPES),
         }
 
-    async def _process_single_content(self, chunk_key_dp: tuple[str, str], chunk_seq: int, num_chunks: int, out_results):
+    async def _process_single_content(self, chunk_key_dp: tuple[str, str]):
         token_count = 0
         chunk_key = chunk_key_dp[0]
         content = chunk_key_dp[1]
@@ -143,6 +144,4 @@ class GraphExtractor(Extractor):
         records = [re.sub(r"^\(|\)$", "", r.strip()) for r in results.split(record_delimiter)]
         records = [r for r in records if r.strip()]
         maybe_nodes, maybe_edges = self._entities_and_relations(chunk_key, records, tuple_delimiter)
-        out_results.append((maybe_nodes, maybe_edges, token_count))
-        if self.callback:
-            self.callback(0.5+0.1*len(out_results)/num_chunks, msg = f"Entities extraction of chunk {chunk_seq} {len(out_results)}/{num_chunks} done, {len(maybe_nodes)} nodes, {len(maybe_edges)} edges, {token_count} tokens.")
+        return maybe_nodes, maybe_edges, token_count
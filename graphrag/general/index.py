@@ -24,35 +24,39 @@ from graphrag.light.graph_extractor import GraphExtractor as LightKGExt
 from graphrag.general.graph_extractor import GraphExtractor as GeneralKGExt
 from graphrag.general.community_reports_extractor import CommunityReportsExtractor
 from graphrag.entity_resolution import EntityResolution
-from graphrag.general.extractor import Extractor
+from graphrag.general.extractor import Extractor, graphrag_extraction_key
 from graphrag.utils import (
-    graph_merge,
     set_entity,
     get_relation,
     set_relation,
     get_entity,
-    get_graph,
+    load_graph,
+    forget_graph,
     set_graph,
     chunk_id,
     update_nodes_pagerank_nhop_neighbour,
     does_graph_contains,
-    get_graph_doc_ids,
+    GraphWriteBuffer,
+    get_community_reports,
 )
 from rag.nlp import rag_tokenizer, search
-from rag.utils.redis_conn import REDIS_CONN
+from rag.settings import GRAPH_SNAPSHOT_INTERVAL, GRAPHRAG_COMMUNITY_CHANGE_THRESHOLD
+from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
 
 
-def graphrag_task_set(tenant_id, kb_id, doc_id) -> bool:
-    key = f"graphrag:{tenant_id}:{kb_id}"
-    ok = REDIS_CONN.set(key, doc_id, exp=3600 * 24)
-    if not ok:
-        raise Exception(f"Faild to set the {key} to {doc_id}")
+GRAPH_MERGE_LOCK_TTL = 600
 
 
-def graphrag_task_get(tenant_id, kb_id) -> str | None:
-    key = f"graphrag:{tenant_id}:{kb_id}"
-    doc_id = REDIS_CONN.get(key)
-    return doc_id
+def graphrag_merge_key(tenant_id, kb_id) -> str:
+    return f"graphrag:merge_pending:{tenant_id}:{kb_id}"
+
+
+def graphrag_merge_submit(tenant_id, kb_id, doc_id, with_resolution, with_community):
+    """Queue a document whose subgraph is written for the next merge of its KB."""
+    member = json.dumps({"doc_id": doc_id, "resolution": bool(with_resolution), "community": bool(with_community)},
+                        sort_keys=True)
+    if not REDIS_CONN.sadd(graphrag_merge_key(tenant_id, kb_id), member):
+        raise Exception(f"Faild to queue {doc_id} for the graph merge of kb {kb_id}")
 
 
 async def run_graphrag(
@@ -72,7 +76,7 @@ async def run_graphrag(
     ):
         chunks.append(d["content_with_weight"])
 
-    graph, doc_ids = await update_graph(
+    subgraph = await extract_subgraph(
         LightKGExt
         if row["parser_config"]["graphrag"]["method"] != "general"
         else GeneralKGExt,
@@ -86,37 +90,75 @@ async def run_graphrag(
         embedding_model,
         callback,
     )
-    if not graph:
+    if subgraph is None:
         return
-    if with_resolution or with_community:
-        graphrag_task_set(tenant_id, kb_id, doc_id)
-    if with_resolution:
-        await resolve_entities(
-            graph,
-            doc_ids,
-            tenant_id,
-            kb_id,
-            doc_id,
-            chat_model,
-            embedding_model,
-            callback,
-        )
-    if with_community:
-        await extract_community(
-            graph,
-            doc_ids,
-            tenant_id,
-            kb_id,
-            doc_id,
-            chat_model,
-            embedding_model,
-            callback,
-        )
+    graphrag_merge_submit(tenant_id, kb_id, doc_id, with_resolution, with_community)
+    await merge_pending_graphs(tenant_id, kb_id, doc_id, chat_model, embedding_model, callback)
     now = trio.current_time()
     callback(msg=f"GraphRAG for doc {doc_id} done in {now - start:.2f} seconds.")
     return
 
 
+async def merge_pending_graphs(tenant_id, kb_id, doc_id, chat_model, embedding_model, callback):
+    """
+    Single writer of the KB graph. Every document queues itself and then tries
+    to take the merge lock of its KB; the holder folds all queued subgraphs
+    into the graph at once and runs PageRank, resolution and community
+    detection once per batch, while the others leave their documents to it.
+    """
+    key = graphrag_merge_key(tenant_id, kb_id)
+    while True:
+        lock = RedisDistributedLock(f"graphrag:merge_lock:{tenant_id}:{kb_id}", timeout=GRAPH_MERGE_LOCK_TTL,
+                                    blocking_timeout=0)
+        if not await trio.to_thread.run_sync(lock.acquire):
+            callback(msg=f"Another graphrag task is merging kb {kb_id}, it will merge doc {doc_id} too.")
+            return
+        try:
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(_keep_lock, lock)
+                while True:
+                    members = REDIS_CONN.smembers(key) or set()
+                    if not members:
+                        break
+                    await _merge_batch(tenant_id, kb_id, members, chat_model, embedding_model, callback)
+                    for m in members:
+                        REDIS_CONN.srem(key, m)
+                nursery.cancel_scope.cancel()
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                logging.warning(f"The graph merge lock of kb {kb_id} had expired.")
+        # a document queued after the last check may have seen the lock still held
+        if not REDIS_CONN.smembers(key):
+            return
+
+
+async def _keep_lock(lock):
+    while True:
+        await trio.sleep(GRAPH_MERGE_LOCK_TTL / 3)
+        await trio.to_thread.run_sync(lock.reacquire)
+
+
+async def _merge_batch(tenant_id, kb_id, members, chat_model, embedding_model, callback):
+    batch = [json.loads(m) for m in members]
+    start = trio.current_time()
+    graph, doc_ids = await merge_graph(tenant_id, kb_id, doc_ids=[b["doc_id"] for b in batch])
+    callback(msg=f"Merged {len(batch)} subgraphs into the graph of kb {kb_id} in {trio.current_time() - start:.2f}s.")
+    if not graph:
+        return
+    doc_id = batch[-1]["doc_id"]
+    try:
+        if any(b["resolution"] for b in batch):
+            await resolve_entities(graph, doc_ids, tenant_id, kb_id, doc_id, chat_model, embedding_model, callback)
+        if any(b["community"] for b in batch):
+            await extract_community(graph, doc_ids, tenant_id, kb_id, doc_id, chat_model, embedding_model, callback)
+    except BaseException:
+        # the graph kept in memory may be half resolved: read it back from storage next time
+        forget_graph(kb_id)
+        raise
+
+
 async def update_graph(
     extractor: Extractor,
     tenant_id: str,
@@ -128,22 +170,45 @@ async def update_graph(
     llm_bdl,
     embed_bdl,
     callback,
+):
+    subgraph = await extract_subgraph(extractor, tenant_id, kb_id, doc_id, chunks, language, entity_types,
+                                      llm_bdl, embed_bdl, callback)
+    if subgraph is None:
+        return None, None
+    return await merge_graph(tenant_id, kb_id, callback, [doc_id])
+
+
+async def extract_subgraph(
+    extractor: Extractor,
+    tenant_id: str,
+    kb_id: str,
+    doc_id: str,
+    chunks: list[str],
+    language,
+    entity_types,
+    llm_bdl,
+    embed_bdl,
+    callback,
 ):
     contains = await does_graph_contains(tenant_id, kb_id, doc_id)
     if contains:
         callback(msg=f"Graph already contains {doc_id}, cancel myself")
-        return None, None
+        return None
     start = trio.current_time()
+    buf = GraphWriteBuffer(tenant_id, kb_id, embed_bdl)
     ext = extractor(
         llm_bdl,
         language=language,
         entity_types=entity_types,
-        get_entity=partial(get_entity, tenant_id, kb_id),
-        set_entity=partial(set_entity, tenant_id, kb_id, embed_bdl),
-        get_relation=partial(get_relation, tenant_id, kb_id),
-        set_relation=partial(set_relation, tenant_id, kb_id, embed_bdl),
+        get_entity=buf.get_entity,
+        set_entity=buf.set_entity,
+        get_relation=buf.get_relation,
+        set_relation=buf.set_relation,
+        prefetch=buf.prefetch,
     )
-    ents, rels = await ext(doc_id, chunks, callback)
+    checkpoint_key = graphrag_extraction_key(kb_id, doc_id)
+    ents, rels = await ext(doc_id, chunks, callback, checkpoint_key)
+    await trio.to_thread.run_sync(buf.flush)
     subgraph = nx.Graph()
     for en in ents:
         subgraph.add_node(en["entity_name"], entity_type=en["entity_type"])
@@ -172,35 +237,33 @@ async def update_graph(
             [{"id": cid, **chunk}], search.index_name(tenant_id), kb_id
         )
     )
+    REDIS_CONN.delete(checkpoint_key)
     now = trio.current_time()
     callback(msg=f"generated subgraph for doc {doc_id} in {now - start:.2f} seconds.")
-    start = now
+    return subgraph
 
-    while True:
-        new_graph = subgraph
-        now_docids = set([doc_id])
-        old_graph, old_doc_ids = await get_graph(tenant_id, kb_id)
-        if old_graph is not None:
-            logging.info("Merge with an exiting graph...................")
-            new_graph = graph_merge(old_graph, subgraph)
-        await update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, new_graph, 2)
-        if old_doc_ids:
-            for old_doc_id in old_doc_ids:
-                now_docids.add(old_doc_id)
-        old_doc_ids2 = await get_graph_doc_ids(tenant_id, kb_id)
-        delta_doc_ids = set(old_doc_ids2) - set(old_doc_ids)
-        if delta_doc_ids:
-            callback(
-                msg="The global graph has changed during merging, try again"
-            )
-            await trio.sleep(1)
-            continue
-        break
-    await set_graph(tenant_id, kb_id, new_graph, list(now_docids))
+
+async def merge_graph(tenant_id, kb_id, callback=None, doc_ids=()):
+    """Fold the subgraphs written since the last snapshot into the KB graph."""
+    start = trio.current_time()
+    merged = set()
+    for _ in range(3):
+        new_graph, now_docids, pending, nodes = await load_graph(tenant_id, kb_id)
+        merged |= nodes
+        # subgraphs of `doc_ids` are just written and may not be searchable yet
+        if set(doc_ids) <= set(now_docids or []):
+            break
+        await trio.sleep(1)
+    if new_graph is None:
+        return None, None
+    await update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, new_graph, 2, merged)
+    if len(pending) >= GRAPH_SNAPSHOT_INTERVAL or len(pending) == len(now_docids):
+        await set_graph(tenant_id, kb_id, new_graph, list(now_docids))
     now = trio.current_time()
-    callback(
-        msg=f"merging subgraph for doc {doc_id} into the global graph done in {now - start:.2f} seconds."
-    )
+    if callback:
+        callback(
+            msg=f"merging {len(pending)} subgraphs into the global graph done in {now - start:.2f} seconds."
+        )
     return new_graph, now_docids
 
 
@@ -214,12 +277,6 @@ async def resolve_entities(
     embed_bdl,
     callback,
 ):
-    working_doc_id = graphrag_task_get(tenant_id, kb_id)
-    if doc_id != working_doc_id:
-        callback(
-            msg=f"Another graphrag task of doc_id {working_doc_id} is working on this kb, cancel myself"
-        )
-        return
     start = trio.current_time()
     er = EntityResolution(
         llm_bdl,
@@ -227,19 +284,14 @@ async def resolve_entities(
         set_entity=partial(set_entity, tenant_id, kb_id, embed_bdl),
         get_relation=partial(get_relation, tenant_id, kb_id),
         set_relation=partial(set_relation, tenant_id, kb_id, embed_bdl),
+        embed_model=embed_bdl,
     )
     reso = await er(graph)
     graph = reso.graph
     callback(msg=f"Graph resolution removed {len(reso.removed_entities)} nodes.")
-    await update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, graph, 2)
+    await update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, graph, 2, reso.changed_entities)
     callback(msg="Graph resolution updated pagerank.")
 
-    working_doc_id = graphrag_task_get(tenant_id, kb_id)
-    if doc_id != working_doc_id:
-        callback(
-            msg=f"Another graphrag task of doc_id {working_doc_id} is working on this kb, cancel myself"
-        )
-        return
     await set_graph(tenant_id, kb_id, graph, doc_ids)
 
     await trio.to_thread.run_sync(
@@ -289,12 +341,6 @@ async def extract_community(
     embed_bdl,
     callback,
 ):
-    working_doc_id = graphrag_task_get(tenant_id, kb_id)
-    if doc_id != working_doc_id:
-        callback(
-            msg=f"Another graphrag task of doc_id {working_doc_id} is working on this kb, cancel myself"
-        )
-        return
     start = trio.current_time()
     ext = CommunityReportsExtractor(
         llm_bdl,
@@ -303,29 +349,28 @@ async def extract_community(
         get_relation=partial(get_relation, tenant_id, kb_id),
         set_relation=partial(set_relation, tenant_id, kb_id, embed_bdl),
     )
-    cr = await ext(graph, callback=callback)
+    existing = await trio.to_thread.run_sync(lambda: get_community_reports(tenant_id, kb_id))
+    cr = await ext(graph, callback=callback, existing_reports=existing,
+                   change_threshold=GRAPHRAG_COMMUNITY_CHANGE_THRESHOLD)
     community_structure = cr.structured_output
     community_reports = cr.output
-    working_doc_id = graphrag_task_get(tenant_id, kb_id)
-    if doc_id != working_doc_id:
-        callback(
-            msg=f"Another graphrag task of doc_id {working_doc_id} is working on this kb, cancel myself"
-        )
-        return
     await set_graph(tenant_id, kb_id, graph, doc_ids)
 
     now = trio.current_time()
     callback(
-        msg=f"Graph extracted {len(cr.structured_output)} communities in {now - start:.2f}s."
+        msg=f"Graph extracted {len(cr.structured_output) + len(cr.kept)} communities, {len(cr.kept)} unchanged, in {now - start:.2f}s."
     )
     start = now
-    await trio.to_thread.run_sync(
-        lambda: settings.docStoreConn.delete(
-            {"knowledge_graph_kwd": "community_report", "kb_id": kb_id},
-            search.index_name(tenant_id),
-            kb_id,
+    removed = [id for id in existing if id not in cr.kept]
+    if removed:
+        await trio.to_thread.run_sync(
+            lambda: settings.docStoreConn.delete(
+                {"id": removed},
+                search.index_name(tenant_id),
+                kb_id,
+            )
         )
-    )
+    chunks = []
     for stru, rep in zip(community_structure, community_reports):
         obj = {
             "report": rep,
@@ -354,14 +399,23 @@ async def extract_community(
         #    chunk["q_%d_vec" % len(ebd[0])] = ebd[0]
         # except Exception as e:
         #    logging.exception(f"Fail to embed entity relation: {e}")
+        chunks.append({"id": chunk_id(chunk), **chunk})
+    for b in range(0, len(chunks), 128):
         await trio.to_thread.run_sync(
-            lambda: settings.docStoreConn.insert(
-                [{"id": chunk_id(chunk), **chunk}], search.index_name(tenant_id)
-            )
+            lambda: settings.docStoreConn.insert(chunks[b:b + 128], search.index_name(tenant_id), kb_id)
+        )
+    # unchanged reports get the new weights and members, and cover the documents merged since
+    kept = [{"id": id, "weight_flt": k["weight"], "entities_kwd": k["entities"], "important_kwd": k["entities"],
+             "source_id": doc_ids} for id, k in cr.kept.items()]
+    for b in range(0, len(kept), 512):
+        errors = await trio.to_thread.run_sync(
+            lambda: settings.docStoreConn.updateBatch(kept[b:b + 512], search.index_name(tenant_id), kb_id)
         )
+        if errors:
+            logging.error(f"Fail to update {len(errors)} community reports of kb {kb_id}: {errors[:3]}")
 
     now = trio.current_time()
     callback(
-        msg=f"Graph indexed {len(cr.structured_output)} communities in {now - start:.2f}s."
+        msg=f"Graph indexed {len(cr.structured_output)} new community reports, removed {len(removed)}, in {now - start:.2f}s."
     )
     return community_structure, community_reports
@@ -0,0 +1,130 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import heapq
+import logging
+
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+
+
+def pagerank(graph: nx.Graph, nstart: dict | None = None, alpha=0.85, max_iter=100, tol=1.0e-6, weight="weight") -> dict:
+    """
+    Power-iteration PageRank over a sparse transition matrix, the same model
+    as `nx.pagerank` (uniform teleport, dangling nodes spread uniformly).
+    `nstart` warm-starts the iteration from a previous rank vector; nodes
+    missing from it start at the average rank, so after a small delta of
+    the graph only a few iterations are needed.
+    """
+    nodes = list(graph)
+    N = len(nodes)
+    if N == 0:
+        return {}
+
+    A = nx.to_scipy_sparse_array(graph, nodelist=nodes, weight=weight, dtype=float, format="csr")
+    out = np.asarray(A.sum(axis=1)).ravel()
+    dangling = out == 0
+    inv = np.zeros(N)
+    inv[~dangling] = 1.0 / out[~dangling]
+    M = (sp.diags(inv) @ A).T.tocsr()
+
+    p = np.full(N, 1.0 / N)
+    if nstart:
+        x = np.array([nstart.get(n, np.nan) for n in nodes], dtype=float)
+        known = ~np.isnan(x)
+        x[~known] = x[known].mean() if known.any() else 1.0 / N
+        x /= x.sum()
+    else:
+        x = p.copy()
+
+    for i in range(max_iter):
+        xlast = x
+        x = alpha * (M @ xlast + xlast[dangling].sum() * p) + (1 - alpha) * p
+        if np.abs(x - xlast).sum() < N * tol:
+            logging.debug(f"pagerank converged in {i + 1} iterations over {N} nodes")
+            break
+    else:
+        logging.warning(f"pagerank didn't converge in {max_iter} iterations over {N} nodes")
+    return dict(zip(nodes, x.tolist()))
+
+
+def changed_ranks(ranks: dict, previous: dict, rel_tol=0.01) -> dict:
+    """The ranks that are new or moved by more than `rel_tol` from `previous`."""
+    res = {}
+    for n, r in ranks.items():
+        old = previous.get(n)
+        if old is None or abs(r - old) > rel_tol * old:
+            res[n] = r
+    return res
+
+
+def n_hop_paths(graph: nx.Graph, node, n_hop: int) -> list[dict]:
+    """
+    Paths of up to `n_hop` edges starting from `node` that don't walk back
+    over an edge already in the path, with the weight of each edge.
+    """
+    paths = [(node, nbr) for nbr in graph.neighbors(node)]
+    for _ in range(n_hop - 1):
+        extended = []
+        for path in paths:
+            last = path[-1]
+            if last in path[:-1]:
+                extended.append(path)
+                continue
+            walked = set(zip(path[:-1], path[1:]))
+            grown = False
+            for nbr in graph.neighbors(last):
+                if (last, nbr) in walked or (nbr, last) in walked:
+                    continue
+                extended.append(path + (nbr,))
+                grown = True
+            if not grown:
+                extended.append(path)
+        paths = extended
+
+    return [{"path": path, "weights": [graph.edges[f, t].get("weight", 0) for f, t in zip(path[:-1], path[1:])]}
+            for path in paths]
+
+
+def n_hop_neighbourhood(graph: nx.Graph, nodes, n_hop: int) -> set:
+    """
+    Nodes whose `n_hop_paths` may go through an edge of `nodes`, i.e. the
+    nodes within `n_hop - 1` edges of them.
+    """
+    seen = set([n for n in nodes if n in graph])
+    frontier = set(seen)
+    for _ in range(n_hop - 1):
+        frontier = set([nbr for n in frontier for nbr in graph.neighbors(n)]) - seen
+        if not frontier:
+            break
+        seen |= frontier
+    return seen
+
+
+def graph_view(graph: nx.Graph, max_nodes=256, max_edges=128) -> dict:
+    """
+    Node-link data of the part of the graph the knowledge graph view shows:
+    the `max_nodes` nodes of highest PageRank and the `max_edges` heaviest
+    edges between them, with the size of the whole graph.
+    """
+    nodes = heapq.nlargest(max_nodes, graph.nodes(data=True), key=lambda n: n[1].get("pagerank", 0))
+    kept = set([n for n, _ in nodes])
+    edges = [(f, t, d) for f, t, d in graph.subgraph(kept).edges(data=True) if f != t]
+    edges = heapq.nlargest(max_edges, edges, key=lambda e: e[2].get("weight", 0))
+    return {"directed": graph.is_directed(), "multigraph": False, "graph": {},
+            "nodes": [{**d, "id": n} for n, d in nodes],
+            "edges": [{**d, "source": f, "target": t} for f, t, d in edges],
+            "node_count": graph.number_of_nodes(), "edge_count": graph.number_of_edges()}
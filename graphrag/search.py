@@ -16,13 +16,14 @@
 import json
 import logging
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 import json_repair
 import pandas as pd
 
 from api.utils import get_uuid
 from graphrag.query_analyze_prompt import PROMPTS
-from graphrag.utils import get_entity_type2sampels, get_llm_cache, set_llm_cache, get_relation
+from graphrag.utils import get_entity_type2sampels, get_llm_cache, set_llm_cache
 from rag.utils import num_tokens_from_string
 from rag.utils.doc_store_conn import OrderByExpr
 
@@ -30,6 +31,9 @@ from rag.nlp.search import Dealer, index_name
 
 
 class KGSearch(Dealer):
+    # shared by all requests: the lookups of one retrieval are independent doc-store calls
+    _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="kg_search")
+
     def _chat(self, llm_bdl, system, history, gen_conf):
         response = get_llm_cache(llm_bdl.llm_name, system, history, gen_conf)
         if response:
@@ -124,12 +128,18 @@ class KGSearch(Dealer):
             [], filters, [matchDense], OrderByExpr(), 0, N, idxnms, kb_ids)
         return self._relation_info_from_(es_res, sim_thr)
 
-    def get_relevant_ents_by_types(self, types, filters, idxnms, kb_ids, N=56):
+    def get_relevant_ents_by_types(self, types, filters, idxnms, kb_ids, N=56, entities=None):
         if not types:
             return {}
         filters = deepcopy(filters)
         filters["knowledge_graph_kwd"] = "entity"
         filters["entity_type_kwd"] = types
+        if entities is not None:
+            # only whether these entities are of the types matters for ranking
+            if not entities:
+                return {}
+            filters["entity_kwd"] = list(entities)
+            N = len(filters["entity_kwd"])
         ordr = OrderByExpr()
         ordr.desc("rank_flt")
         es_res = self.dataStore.search(["entity_kwd", "rank_flt"], [], filters, [], ordr, 0, N,
@@ -154,6 +164,8 @@ class KGSearch(Dealer):
             tenant_ids = tenant_ids.split(",")
         idxnms = [index_name(tid) for tid in tenant_ids]
         ty_kwds = []
+        rels_job = self._executor.submit(self.get_relevant_relations_by_txt, qst, filters, idxnms, kb_ids, emb_mdl,
+                                         rel_sim_threshold)
         try:
             ty_kwds, ents = self.query_rewrite(llm, qst, [index_name(tid) for tid in tenant_ids], kb_ids)
             logging.info(f"Q: {qst}, Types: {ty_kwds}, Entities: {ents}")
@@ -163,8 +175,7 @@ class KGSearch(Dealer):
             pass
 
         ents_from_query = self.get_relevant_ents_by_keywords(ents, filters, idxnms, kb_ids, emb_mdl, ent_sim_threshold)
-        ents_from_types = self.get_relevant_ents_by_types(ty_kwds, filters, idxnms, kb_ids, 10000)
-        rels_from_txt = self.get_relevant_relations_by_txt(qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold)
+        rels_from_txt = rels_job.result()
         nhop_pathes = defaultdict(dict)
         for _, ent in ents_from_query.items():
             nhops = ent.get("n_hop_ents", [])
@@ -182,6 +193,11 @@ class KGSearch(Dealer):
                         nhop_pathes[(f, t)]["sim"] = ent["sim"] / (2 + i)
                     nhop_pathes[(f, t)]["pagerank"] = wts[i]
 
+        ranked_ents = set(ents_from_query.keys())
+        for pair in list(rels_from_txt.keys()) + list(nhop_pathes.keys()):
+            ranked_ents.update(pair)
+        ents_from_types = self.get_relevant_ents_by_types(ty_kwds, filters, idxnms, kb_ids, entities=ranked_ents)
+
         logging.info("Retrieved entities: {}".format(list(ents_from_query.keys())))
         logging.info("Retrieved relations: {}".format(list(rels_from_txt.keys())))
         logging.info("Retrieved entities from types({}): {}".format(ty_kwds, list(ents_from_types.keys())))
@@ -235,15 +251,16 @@ class KGSearch(Dealer):
                 ents = ents[:-1]
                 break
 
+        missing = [(f, t) for (f, t), rel in rels_from_txt if not rel.get("description")]
+        # the reports are fetched meanwhile, and cut to the tokens the relations leave
+        comm_job = self._executor.submit(self._community_retrival_, [n for n, _ in ents_from_query], filters, kb_ids,
+                                         idxnms, comm_topn)
+        descriptions = self._relation_descriptions(missing, filters, idxnms, kb_ids)
         for (f, t), rel in rels_from_txt:
             if not rel.get("description"):
-                for tid in tenant_ids:
-                    rela = get_relation(tid, kb_ids, f, t)
-                    if rela:
-                        break
-                else:
+                if (f, t) not in descriptions:
                     continue
-                rel["description"] = rela["description"]
+                rel["description"] = descriptions[(f, t)]
             desc = rel["description"]
             try:
                 desc = json.loads(desc).get("description", "")
@@ -269,11 +286,21 @@ class KGSearch(Dealer):
         else:
             relas = ""
 
+        comms = []
+        for txt in comm_job.result():
+            max_token -= num_tokens_from_string(txt)
+            if max_token <= 0:
+                break
+            comms.append(txt)
+        if comms:
+            comms = "\n---- Community Report ----\n" + "\n".join(comms)
+        else:
+            comms = ""
+
         return {
                 "chunk_id": get_uuid(),
                 "content_ltks": "",
-                "content_with_weight": ents + relas + self._community_retrival_([n for n, _ in ents_from_query], filters, kb_ids, idxnms,
-                                                        comm_topn, max_token),
+                "content_with_weight": ents + relas + comms,
                 "doc_id": "",
                 "docnm_kwd": "Related content in Knowledge Graph",
                 "kb_id": kb_ids,
@@ -286,7 +313,35 @@ class KGSearch(Dealer):
                 "positions": [],
             }
 
-    def _community_retrival_(self, entities, condition, kb_ids, idxnms, topn, max_token):
+    def _relation_descriptions(self, pairs, filters, idxnms, kb_ids) -> dict:
+        """Descriptions of the given relations, fetched with a single search."""
+        if not pairs:
+            return {}
+        ents = list(set([n for p in pairs for n in p]))
+        fltr = deepcopy(filters)
+        fltr["knowledge_graph_kwd"] = "relation"
+        fltr["from_entity_kwd"] = ents
+        fltr["to_entity_kwd"] = ents
+        fields = ["content_with_weight", "from_entity_kwd", "to_entity_kwd"]
+        es_res = self.dataStore.search(fields, [], fltr, [], OrderByExpr(), 0, len(ents) * len(ents),
+                                       idxnms, kb_ids)
+        found = {}
+        for _, r in self.dataStore.getFields(es_res, fields).items():
+            f, t = r.get("from_entity_kwd"), r.get("to_entity_kwd")
+            f = f[0] if isinstance(f, list) else f
+            t = t[0] if isinstance(t, list) else t
+            try:
+                found[tuple(sorted([f, t]))] = json.loads(r["content_with_weight"])["description"]
+            except Exception:
+                continue
+        res = {}
+        for f, t in pairs:
+            desc = found.get(tuple(sorted([f, t])))
+            if desc is not None:
+                res[(f, t)] = desc
+        return res
+
+    def _community_retrival_(self, entities, condition, kb_ids, idxnms, topn) -> list[str]:
         ## Community retrieval
         fields = ["docnm_kwd", "content_with_weight"]
         odr = OrderByExpr()
@@ -302,11 +357,7 @@ class KGSearch(Dealer):
             obj = json.loads(row["content_with_weight"])
             txts.append("# {}. {}\n## Content\n{}\n## Evidences\n{}\n".format(
                 ii + 1, row["docnm_kwd"], obj["report"], obj["evidences"]))
-            max_token -= num_tokens_from_string(str(txts[-1]))
-
-        if not txts:
-            return ""
-        return "\n---- Community Report ----\n" + "\n".join(txts)
+        return txts
 
 
 if __name__ == "__main__":
@@ -11,8 +11,8 @@ import json
 import logging
 import re
 import time
-from collections import defaultdict
-from copy import deepcopy
+import zlib
+from collections import OrderedDict, defaultdict
 from hashlib import md5
 from typing import Any, Callable
 import os
@@ -24,9 +24,11 @@ import xxhash
 from networkx.readwrite import json_graph
 
 from api import settings
+from graphrag.graph_analytics import pagerank, changed_ranks, n_hop_paths, n_hop_neighbourhood, graph_view
 from rag.nlp import search, rag_tokenizer
 from rag.utils.doc_store_conn import OrderByExpr
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.storage_factory import STORAGE_IMPL
 
 ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
@@ -148,21 +150,29 @@ def set_tags_to_cache(kb_ids, tags):
 
 
 def graph_merge(g1, g2):
-    g = g2.copy()
-    for n, attr in g1.nodes(data=True):
-        if n not in g2.nodes():
-            g.add_node(n, **attr)
-            continue
+    """
+    Merge `g2` into `g1` in place, touching only the nodes and edges of `g2`,
+    so that folding a document's subgraph into the KB graph costs as much as
+    the subgraph. The attributes of `g2` win, edges found in both get one
+    more weight, and `rank` (the degree) is updated for the nodes of `g2`.
+    """
+    for n, attr in g2.nodes(data=True):
+        if g1.has_node(n):
+            g1.nodes[n].update(attr)
+        else:
+            g1.add_node(n, **attr)
 
-    for source, target, attr in g1.edges(data=True):
-        if g.has_edge(source, target):
-            g[source][target].update({"weight": attr.get("weight", 0)+1})
+    for source, target, attr in g2.edges(data=True):
+        if g1.has_edge(source, target):
+            weight = g1[source][target].get("weight", 0) + 1
+            g1[source][target].update(attr)
+            g1[source][target]["weight"] = weight
             continue
-        g.add_edge(source, target)#, **attr)
+        g1.add_edge(source, target, **attr)
 
-    for node_degree in g.degree:
-        g.nodes[str(node_degree[0])]["rank"] = int(node_degree[1])
-    return g
+    for n in g2.nodes():
+        g1.nodes[n]["rank"] = int(g1.degree(n))
+    return g1
 
 
 def compute_args_hash(*args):
@@ -258,7 +268,7 @@ def get_entity(tenant_id, kb_id, ent_name):
     return res
 
 
-def set_entity(tenant_id, kb_id, embd_mdl, ent_name, meta):
+def entity_chunk(kb_id, ent_name, meta):
     chunk = {
         "important_kwd": [ent_name],
         "title_tks": rag_tokenizer.tokenize(ent_name),
@@ -272,6 +282,11 @@ def set_entity(tenant_id, kb_id, embd_mdl, ent_name, meta):
         "available_int": 0
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
+    return chunk
+
+
+def set_entity(tenant_id, kb_id, embd_mdl, ent_name, meta):
+    chunk = entity_chunk(kb_id, ent_name, meta)
     res = settings.retrievaler.search({"entity_kwd": ent_name, "size": 1, "fields": []},
                                       search.index_name(tenant_id), [kb_id])
     if res.ids:
@@ -317,7 +332,7 @@ def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
     return res
 
 
-def set_relation(tenant_id, kb_id, embd_mdl, from_ent_name, to_ent_name, meta):
+def relation_chunk(kb_id, from_ent_name, to_ent_name, meta):
     chunk = {
         "from_entity_kwd": from_ent_name,
         "to_entity_kwd": to_ent_name,
@@ -331,6 +346,11 @@ def set_relation(tenant_id, kb_id, embd_mdl, from_ent_name, to_ent_name, meta):
         "available_int": 0
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
+    return chunk
+
+
+def set_relation(tenant_id, kb_id, embd_mdl, from_ent_name, to_ent_name, meta):
+    chunk = relation_chunk(kb_id, from_ent_name, to_ent_name, meta)
     res = settings.retrievaler.search({"from_entity_kwd": to_ent_name, "to_entity_kwd": to_ent_name, "size": 1, "fields": []},
                                       search.index_name(tenant_id), [kb_id])
 
@@ -352,152 +372,414 @@ def set_relation(tenant_id, kb_id, embd_mdl, from_ent_name, to_ent_name, meta):
             chunk["q_%d_vec" % len(ebd)] = ebd
         settings.docStoreConn.insert([{"id": chunk_id(chunk), **chunk}], search.index_name(tenant_id), kb_id)
 
+
+def embed_with_cache(embd_mdl, items, batch_size=32):
+    """
+    Embed many texts at once. `items` is a list of (cache_key, text) pairs;
+    cached vectors are reused and the misses are encoded `batch_size` at a
+    time. Returns one vector (or None on failure) per item.
+    """
+    vectors = [get_embed_cache(embd_mdl.llm_name, k) for k, _ in items]
+    misses = [i for i, v in enumerate(vectors) if v is None]
+    for b in range(0, len(misses), batch_size):
+        batch = misses[b:b + batch_size]
+        try:
+            ebds, _ = embd_mdl.encode([items[i][1] for i in batch])
+        except Exception as e:
+            logging.exception(f"Fail to embed entities/relations: {e}")
+            continue
+        for i, ebd in zip(batch, ebds):
+            vectors[i] = ebd
+            set_embed_cache(embd_mdl.llm_name, items[i][0], ebd)
+    return vectors
+
+
+class GraphWriteBuffer:
+    """
+    Collects the entity and relation upserts of one document. Existing
+    entities and relations are looked up with a few paged multi-term
+    searches (`prefetch`) and written back on `flush`: new ones are embedded
+    in batches and bulk inserted, existing ones are updated in place, without
+    their vectors unless the text embedded for them changed, and skipped when
+    nothing changed at all.
+    """
+
+    # pairs of a relation lookup: relations are matched on both ends among all
+    # the names of the batch, a small batch keeps that cross product small
+    relation_batch_size = 64
+
+    def __init__(self, tenant_id, kb_id, embd_mdl, batch_size=512):
+        self.tenant_id = tenant_id
+        self.kb_id = kb_id
+        self.embd_mdl = embd_mdl
+        self.batch_size = batch_size
+        self.entities = {}
+        self.relations = {}
+        self._known_entities = {}
+        self._known_relations = {}
+        self._entity_ids = defaultdict(list)
+        self._relation_ids = defaultdict(list)
+        self._fetched_entities = set()
+        self._fetched_relations = set()
+
+    def prefetch(self, entity_names, relation_pairs=()):
+        names = list(set([n for n in entity_names if n not in self._fetched_entities]))
+        for b in range(0, len(names), self.batch_size):
+            flds = _search_all(self.tenant_id, self.kb_id, ["content_with_weight", "entity_kwd"],
+                               {"knowledge_graph_kwd": ["entity"], "entity_kwd": names[b:b + self.batch_size]})
+            for id, fld in flds.items():
+                nm = fld.get("entity_kwd")
+                self._entity_ids[nm].append(id)
+                try:
+                    self._known_entities[nm] = json.loads(fld["content_with_weight"])
+                except Exception:
+                    continue
+        self._fetched_entities.update(names)
+
+        pairs = list(set([tuple(sorted(p)) for p in relation_pairs]) - self._fetched_relations)
+        for b in range(0, len(pairs), self.relation_batch_size):
+            batch = pairs[b:b + self.relation_batch_size]
+            wanted = set(batch)
+            ents = list(set([n for p in batch for n in p]))
+            flds = _search_all(self.tenant_id, self.kb_id, ["content_with_weight", "from_entity_kwd", "to_entity_kwd"],
+                               {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": ents, "to_entity_kwd": ents})
+            for id, fld in flds.items():
+                key = tuple(sorted([fld.get("from_entity_kwd", ""), fld.get("to_entity_kwd", "")]))
+                if key not in wanted:
+                    continue
+                self._relation_ids[key].append(id)
+                try:
+                    self._known_relations[key] = json.loads(fld["content_with_weight"])
+                except Exception:
+                    continue
+        self._fetched_relations.update(pairs)
+
+    def get_entity(self, ent_name):
+        if ent_name in self.entities:
+            return self.entities[ent_name]
+        if ent_name not in self._fetched_entities:
+            self.prefetch([ent_name])
+        return self._known_entities.get(ent_name, [])
+
+    def set_entity(self, ent_name, meta):
+        self.entities[ent_name] = meta
+
+    def get_relation(self, from_ent_name, to_ent_name, size=1):
+        key = tuple(sorted([from_ent_name, to_ent_name]))
+        if key in self.relations:
+            return self.relations[key][2]
+        if key not in self._fetched_relations:
+            self.prefetch([], [key])
+        return self._known_relations.get(key, [])
+
+    def set_relation(self, from_ent_name, to_ent_name, meta):
+        self.relations[tuple(sorted([from_ent_name, to_ent_name]))] = (from_ent_name, to_ent_name, meta)
+
+    def flush(self):
+        idxnm = search.index_name(self.tenant_id)
+        inserts, updates = [], []
+
+        # entities are embedded by name: an existing one keeps its vector
+        names = []
+        for nm, meta in self.entities.items():
+            if nm not in self._entity_ids:
+                names.append(nm)
+            elif meta != self._known_entities.get(nm):
+                # fields maintained outside the extraction (pagerank, n-hop paths) are left as they are
+                chunk = entity_chunk(self.kb_id, nm, meta)
+                updates.extend([{"id": id, **chunk} for id in self._entity_ids[nm]])
+        vectors = embed_with_cache(self.embd_mdl, [(nm, nm) for nm in names])
+        for nm, ebd in zip(names, vectors):
+            chunk = entity_chunk(self.kb_id, nm, self.entities[nm])
+            if ebd is not None:
+                chunk["q_%d_vec" % len(ebd)] = ebd
+            inserts.append({"id": chunk_id(chunk), **chunk})
+
+        # relations are embedded with their description
+        keys = []
+        for k, (f, t, meta) in self.relations.items():
+            known = self._known_relations.get(k)
+            if k not in self._relation_ids or (known or {}).get("description") != meta["description"]:
+                keys.append(k)
+            elif meta != known:
+                chunk = relation_chunk(self.kb_id, f, t, meta)
+                updates.extend([{"id": id, **chunk} for id in self._relation_ids[k]])
+        items = []
+        for k in keys:
+            f, t, meta = self.relations[k]
+            txt = f"{f}->{t}: {meta['description']}"
+            items.append((txt, txt))
+        vectors = embed_with_cache(self.embd_mdl, items)
+        for k, ebd in zip(keys, vectors):
+            f, t, meta = self.relations[k]
+            chunk = relation_chunk(self.kb_id, f, t, meta)
+            if ebd is not None:
+                chunk["q_%d_vec" % len(ebd)] = ebd
+            if k in self._relation_ids:
+                updates.extend([{"id": id, **chunk} for id in self._relation_ids[k]])
+            else:
+                inserts.append({"id": chunk_id(chunk), **chunk})
+
+        for b in range(0, len(inserts), self.batch_size):
+            errors = settings.docStoreConn.insert(inserts[b:b + self.batch_size], idxnm, self.kb_id)
+            if errors:
+                logging.error(f"GraphWriteBuffer.flush failed to write {len(errors)} chunks: {errors[:3]}")
+        for b in range(0, len(updates), self.batch_size):
+            errors = settings.docStoreConn.updateBatch(updates[b:b + self.batch_size], idxnm, self.kb_id)
+            if errors:
+                logging.error(f"GraphWriteBuffer.flush failed to update {len(errors)} chunks: {errors[:3]}")
+        logging.info(f"GraphWriteBuffer.flush wrote {len(self.entities)} entities and {len(self.relations)} relations: "
+                     f"{len(inserts)} new chunks, {len(updates)} updated, {len(names) + len(keys)} embedded")
+        self.entities.clear()
+        self.relations.clear()
+
+
+GRAPH_SNAPSHOT_NAME = "graphrag_snapshot.z"
+
+
+def load_graph_snapshot(kb_id):
+    """
+    Read the compressed snapshot of the KB graph from the object storage.
+    Returns (graph, doc_ids) or (None, []) if there is none.
+    """
+    try:
+        if not STORAGE_IMPL.obj_exist(kb_id, GRAPH_SNAPSHOT_NAME):
+            return None, []
+        obj = json.loads(zlib.decompress(STORAGE_IMPL.get(kb_id, GRAPH_SNAPSHOT_NAME)))
+        return json_graph.node_link_graph(obj["graph"], edges="edges"), obj["doc_ids"]
+    except Exception as e:
+        logging.exception(f"Fail to load graph snapshot of kb {kb_id}: {e}")
+    return None, []
+
+
+def save_graph_snapshot(kb_id, graph, doc_ids):
+    obj = {"doc_ids": list(doc_ids), "graph": nx.node_link_data(graph, edges="edges")}
+    STORAGE_IMPL.put(kb_id, GRAPH_SNAPSHOT_NAME,
+                     zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")))
+
+
+def _search_all(tenant_id, kb_id, fields, condition, bs=1000):
+    res = {}
+    for es_res in settings.docStoreConn.searchPages(fields, {"kb_id": kb_id, **condition},
+                                                    search.index_name(tenant_id), [kb_id], bs):
+        res.update(settings.docStoreConn.getFields(es_res, fields))
+    return res
+
+
+def get_subgraph_doc_ids(tenant_id, kb_id) -> set[str]:
+    """Ids of the documents whose subgraph has been written, i.e. the deltas of the KB graph."""
+    doc_ids = set()
+    for d in _search_all(tenant_id, kb_id, ["source_id"], {"knowledge_graph_kwd": ["subgraph"]}).values():
+        doc_ids.update(d.get("source_id") or [])
+    return doc_ids
+
+
+def get_subgraphs(tenant_id, kb_id, doc_ids) -> dict[str, nx.Graph]:
+    res = {}
+    doc_ids = list(doc_ids)
+    for b in range(0, len(doc_ids), 128):
+        flds = _search_all(tenant_id, kb_id, ["content_with_weight", "source_id"],
+                           {"knowledge_graph_kwd": ["subgraph"], "source_id": doc_ids[b:b + 128]})
+        for d in flds.values():
+            try:
+                g = json_graph.node_link_graph(json.loads(d["content_with_weight"]), edges="edges")
+            except Exception:
+                continue
+            for doc_id in d.get("source_id") or []:
+                res[doc_id] = g
+    return res
+
+
+def get_community_reports(tenant_id, kb_id) -> dict[str, dict]:
+    """Title (`docnm_kwd`) and member entities (`entities_kwd`) of the community reports of the KB, by chunk id."""
+    return _search_all(tenant_id, kb_id, ["docnm_kwd", "entities_kwd"], {"knowledge_graph_kwd": ["community_report"]})
+
+
+def _get_graph_manifest(tenant_id, kb_id, fields=["source_id", "removed_kwd"]):
+    res = settings.docStoreConn.search(fields, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["graph"]}, [], OrderByExpr(),
+                                       0, 1, search.index_name(tenant_id), [kb_id])
+    flds = settings.docStoreConn.getFields(res, fields)
+    for id, d in flds.items():
+        return id, d
+    return None, {}
+
+
 async def does_graph_contains(tenant_id, kb_id, doc_id):
-    # Get doc_ids of graph
-    fields = ["source_id"]
-    condition = {
-        "knowledge_graph_kwd": ["graph"],
-        "removed_kwd": "N",
-    }
-    res = await trio.to_thread.run_sync(lambda: settings.docStoreConn.search(fields, [], condition, [], OrderByExpr(), 0, 1, search.index_name(tenant_id), [kb_id]))
-    fields2 = settings.docStoreConn.getFields(res, fields)
-    graph_doc_ids = set()
-    for chunk_id in fields2.keys():
-        graph_doc_ids = set(fields2[chunk_id]["source_id"])
-    return doc_id in graph_doc_ids
+    doc_ids = await get_graph_doc_ids(tenant_id, kb_id)
+    return doc_id in doc_ids
+
 
 async def get_graph_doc_ids(tenant_id, kb_id) -> list[str]:
-    conds = {
-        "fields": ["source_id"],
-        "removed_kwd": "N",
-        "size": 1,
-        "knowledge_graph_kwd": ["graph"]
-    }
-    res = await trio.to_thread.run_sync(lambda: settings.retrievaler.search(conds, search.index_name(tenant_id), [kb_id]))
-    doc_ids = []
-    if res.total == 0:
-        return doc_ids
-    for id in res.ids:
-        doc_ids = res.field[id]["source_id"]
-    return doc_ids
+    def _doc_ids():
+        _, manifest = _get_graph_manifest(tenant_id, kb_id)
+        if manifest.get("removed_kwd") == "Y":
+            return []
+        return list(set(manifest.get("source_id") or []) | get_subgraph_doc_ids(tenant_id, kb_id))
+    return await trio.to_thread.run_sync(_doc_ids)
 
 
-async def get_graph(tenant_id, kb_id):
-    conds = {
-        "fields": ["content_with_weight", "source_id"],
-        "removed_kwd": "N",
-        "size": 1,
-        "knowledge_graph_kwd": ["graph"]
-    }
-    res = await trio.to_thread.run_sync(lambda: settings.retrievaler.search(conds, search.index_name(tenant_id), [kb_id]))
-    if res.total == 0:
-        return None, []
-    for id in res.ids:
+# KB id -> (doc ids of the snapshot, graph, doc ids folded into the graph), of the last graphs merged by this process
+_graph_cache = OrderedDict()
+GRAPH_CACHE_SIZE = 4
+
+
+def _cache_graph(kb_id, snapshot_doc_ids, graph, doc_ids):
+    _graph_cache.pop(kb_id, None)
+    if graph is None:
+        return
+    _graph_cache[kb_id] = (frozenset(snapshot_doc_ids), graph, list(doc_ids))
+    while len(_graph_cache) > GRAPH_CACHE_SIZE:
+        _graph_cache.popitem(last=False)
+
+
+def forget_graph(kb_id):
+    """Drop the graph of the KB kept by this process, e.g. when it was changed but not saved."""
+    _graph_cache.pop(kb_id, None)
+
+
+def _load_graph(tenant_id, kb_id):
+    _, manifest = _get_graph_manifest(tenant_id, kb_id)
+    if manifest.get("removed_kwd") == "Y":
+        forget_graph(kb_id)
+        return None, [], [], set(), True
+    graph, doc_ids = None, []
+    snapshot_doc_ids = manifest.get("source_id") or []
+    cached = _graph_cache.get(kb_id)
+    if manifest and cached and cached[0] == frozenset(snapshot_doc_ids):
+        # the snapshot didn't change since this process last merged the graph: only fold the new subgraphs in
+        _, graph, doc_ids = cached
+    elif manifest:
+        graph, doc_ids = load_graph_snapshot(kb_id)
+    if manifest and graph is None:
+        # graphs written before snapshots existed only live in the manifest chunk
+        _, d = _get_graph_manifest(tenant_id, kb_id, ["content_with_weight", "source_id"])
         try:
-            return json_graph.node_link_graph(json.loads(res.field[id]["content_with_weight"]), edges="edges"), \
-                   res.field[id]["source_id"]
+            obj = json.loads(d["content_with_weight"])
+            # newer manifests only hold the view of a snapshot, which can't be read
+            if "node_count" in obj:
+                return None, [], [], set(), True
+            graph = json_graph.node_link_graph(obj, edges="edges")
+            doc_ids = d.get("source_id") or []
         except Exception:
-            continue
-    result = await rebuild_graph(tenant_id, kb_id)
-    return result
+            return None, [], [], set(), True
+    new_doc_ids = list(get_subgraph_doc_ids(tenant_id, kb_id) - set(doc_ids))
+    merged = set()
+    for doc_id, subgraph in get_subgraphs(tenant_id, kb_id, new_doc_ids).items():
+        graph = subgraph.copy() if graph is None else graph_merge(graph, subgraph)
+        merged.update(subgraph.nodes())
+    doc_ids = list(doc_ids) + new_doc_ids
+    _cache_graph(kb_id, snapshot_doc_ids, graph, doc_ids)
+    pending = list(set(doc_ids) - set(snapshot_doc_ids))
+    return graph, doc_ids, pending, merged, False
+
+
+async def load_graph(tenant_id, kb_id):
+    """
+    The KB graph is stored as a compressed snapshot in the object storage plus
+    the subgraphs of the documents added since, which are merged in on load.
+    The entity and relation chunks remain the source of truth when the snapshot
+    is invalidated by a document removal or cannot be read. The graph is kept
+    in memory by the process that merges it, which then reads neither the
+    snapshot nor the subgraphs it already folded in until the snapshot changes.
+    Returns (graph, doc_ids, doc_ids not in the snapshot yet, nodes of the
+    subgraphs merged by this call).
+    """
+    graph, doc_ids, pending, merged, stale = await trio.to_thread.run_sync(lambda: _load_graph(tenant_id, kb_id))
+    if stale:
+        graph, doc_ids = await rebuild_graph(tenant_id, kb_id)
+        return graph, doc_ids or [], doc_ids or [], set(graph.nodes()) if graph else set()
+    return graph, doc_ids, pending, merged
+
+
+async def get_graph(tenant_id, kb_id):
+    graph, doc_ids, _, _ = await load_graph(tenant_id, kb_id)
+    return graph, doc_ids
 
 
 async def set_graph(tenant_id, kb_id, graph, docids):
+    """
+    Write the snapshot of the whole graph to the object storage. The manifest
+    chunk only keeps the doc ids of the snapshot and the capped part of the
+    graph the knowledge graph view shows, and is rewritten under its existing
+    id so that only one of them exists per KB.
+    """
     chunk = {
-        "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False,
-                                          indent=2),
+        "content_with_weight": json.dumps(graph_view(graph), ensure_ascii=False),
         "knowledge_graph_kwd": "graph",
         "kb_id": kb_id,
         "source_id": list(docids),
         "available_int": 0,
         "removed_kwd": "N"
-    }     
-    res = await trio.to_thread.run_sync(lambda: settings.retrievaler.search({"knowledge_graph_kwd": "graph", "size": 1, "fields": []}, search.index_name(tenant_id), [kb_id]))
-    if res.ids:
-        await trio.to_thread.run_sync(lambda: settings.docStoreConn.update({"knowledge_graph_kwd": "graph"}, chunk,
-                                     search.index_name(tenant_id), kb_id))
-    else:
-        await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert([{"id": chunk_id(chunk), **chunk}], search.index_name(tenant_id), kb_id))
-
-
-def is_continuous_subsequence(subseq, seq):
-    def find_all_indexes(tup, value):
-        indexes = []
-        start = 0
-        while True:
-            try:
-                index = tup.index(value, start)
-                indexes.append(index)
-                start = index + 1
-            except ValueError:
-                break
-        return indexes
-
-    index_list = find_all_indexes(seq,subseq[0])
-    for idx in index_list:
-        if idx!=len(seq)-1:
-            if seq[idx+1]==subseq[-1]:
-                return True
-    return False
-
-
-def merge_tuples(list1, list2):
-    result = []
-    for tup in list1:
-        last_element = tup[-1]
-        if last_element in tup[:-1]:
-            result.append(tup)
-        else:
-            matching_tuples = [t for t in list2 if t[0] == last_element]
-            already_match_flag = 0
-            for match in matching_tuples:
-                matchh = (match[1], match[0])
-                if is_continuous_subsequence(match, tup) or is_continuous_subsequence(matchh, tup):
-                    continue
-                already_match_flag = 1
-                merged_tuple = tup + match[1:]
-                result.append(merged_tuple)
-            if not already_match_flag:
-                result.append(tup)
-    return result
-
-
-async def update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, graph, n_hop):
-    def n_neighbor(id):
-        nonlocal graph, n_hop
-        count = 0
-        source_edge = list(graph.edges(id))
-        if not source_edge:
-            return []
-        count = count + 1
-        while count < n_hop:
-            count = count + 1
-            sc_edge = deepcopy(source_edge)
-            source_edge = []
-            for pair in sc_edge:
-                append_edge = list(graph.edges(pair[-1]))
-                for tuples in merge_tuples([pair], append_edge):
-                    source_edge.append(tuples)
-        nbrs = []
-        for path in source_edge:
-            n = {"path": path, "weights": []}
-            wts = nx.get_edge_attributes(graph, 'weight')
-            for i in range(len(path)-1):
-                f, t = path[i], path[i+1]
-                n["weights"].append(wts.get((f, t), 0))
-            nbrs.append(n)
-        return nbrs
-
-    pr = nx.pagerank(graph)
+    }
+    await trio.to_thread.run_sync(lambda: save_graph_snapshot(kb_id, graph, docids))
+    _cache_graph(kb_id, docids, graph, docids)
+    id, _ = await trio.to_thread.run_sync(lambda: _get_graph_manifest(tenant_id, kb_id, ["source_id"]))
+    await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert([{"id": id or chunk_id(chunk), **chunk}], search.index_name(tenant_id), kb_id))
+
+
+GRAPH_PAGERANK_NAME = "graphrag_pagerank.z"
+
+
+def load_graph_pagerank(kb_id) -> dict:
+    """The entity ranks last written to the doc store, kept next to the graph snapshot."""
+    try:
+        if STORAGE_IMPL.obj_exist(kb_id, GRAPH_PAGERANK_NAME):
+            return json.loads(zlib.decompress(STORAGE_IMPL.get(kb_id, GRAPH_PAGERANK_NAME)))
+    except Exception as e:
+        logging.exception(f"Fail to load pagerank of kb {kb_id}: {e}")
+    return {}
+
+
+def save_graph_pagerank(kb_id, ranks: dict):
+    STORAGE_IMPL.put(kb_id, GRAPH_PAGERANK_NAME,
+                     zlib.compress(json.dumps(ranks, ensure_ascii=False, separators=(",", ":")).encode("utf-8")))
+
+
+def _write_entity_ranks(tenant_id, kb_id, graph, ranks: dict, n_hop, batch_size=512):
+    idxnm = search.index_name(tenant_id)
+    names = list(ranks.keys())
+    for b in range(0, len(names), batch_size):
+        batch = names[b:b + batch_size]
+        res = settings.retrievaler.search({"fields": ["entity_kwd"], "entity_kwd": batch, "size": len(batch) * 4,
+                                           "knowledge_graph_kwd": ["entity"]}, idxnm, [kb_id])
+        rows = []
+        for id in res.ids:
+            n = res.field[id].get("entity_kwd")
+            if isinstance(n, list):
+                n = n[0]
+            if n not in ranks:
+                continue
+            rows.append({"id": id, "rank_flt": ranks[n],
+                         "n_hop_with_weight": json.dumps(n_hop_paths(graph, n, n_hop), ensure_ascii=False)})
+        errors = settings.docStoreConn.updateBatch(rows, idxnm, kb_id)
+        if errors:
+            logging.error(f"Fail to write the ranks of {len(errors)} entities: {errors[:3]}")
+
+
+async def update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, graph, n_hop, merged=None):
+    """
+    Rank the entities with PageRank, warm-started from the ranks written last
+    time, and write back in bulk only the ranks that moved noticeably, along
+    with the n-hop paths of those entities and of the ones within reach of
+    the `merged` nodes, whose paths the merge changed. Without `merged`,
+    every entity is written.
+    """
+    previous = await trio.to_thread.run_sync(lambda: load_graph_pagerank(kb_id))
+    pr = await trio.to_thread.run_sync(lambda: pagerank(graph, nstart=previous))
     for n, p in pr.items():
         graph.nodes[n]["pagerank"] = p
-        try:
-            await trio.to_thread.run_sync(lambda: settings.docStoreConn.update({"entity_kwd": n, "kb_id": kb_id},
-                                         {"rank_flt": p,
-                                          "n_hop_with_weight": json.dumps( (n), ensure_ascii=False)},
-                                         search.index_name(tenant_id), kb_id))
-        except Exception as e:
-            logging.exception(e)
+
+    changed = changed_ranks(pr, previous)
+    reached = n_hop_neighbourhood(graph, graph.nodes() if merged is None else merged, n_hop)
+    ranks = {n: pr[n] for n in reached if n in pr}
+    ranks.update(changed)
+    if ranks:
+        await trio.to_thread.run_sync(lambda: _write_entity_ranks(tenant_id, kb_id, graph, ranks, n_hop))
+        written = {n: r for n, r in previous.items() if n in pr}
+        written.update(ranks)
+        await trio.to_thread.run_sync(lambda: save_graph_pagerank(kb_id, written))
+    logging.info(f"update_nodes_pagerank_nhop_neighbour wrote {len(ranks)}/{len(pr)} entities, "
+                 f"{len(changed)} ranks moved")
 
     ty2ents = defaultdict(list)
     for p, r in sorted(pr.items(), key=lambda x: x[1], reverse=True):
@@ -515,29 +797,53 @@ async def update_nodes_pagerank_nhop_neighbour(tenant_id, kb_id, graph, n_hop):
     res = await trio.to_thread.run_sync(lambda: settings.retrievaler.search({"knowledge_graph_kwd": "ty2ents", "size": 1, "fields": []},
                                       search.index_name(tenant_id), [kb_id]))
     if res.ids:
-        await trio.to_thread.run_sync(lambda: settings.docStoreConn.update({"knowledge_graph_kwd": "ty2ents"},
+        await trio.to_thread.run_sync(lambda: settings.docStoreConn.update({"knowledge_graph_kwd": "ty2ents", "kb_id": kb_id},
                                      chunk,
                                      search.index_name(tenant_id), kb_id))
     else:
         await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert([{"id": chunk_id(chunk), **chunk}], search.index_name(tenant_id), kb_id))
+    REDIS_CONN.set(entity_type2samples_key(kb_id), chunk["content_with_weight"], 24 * 3600)
 
 
-async def get_entity_type2sampels(idxnms, kb_ids: list):
-    es_res = await trio.to_thread.run_sync(lambda: settings.retrievaler.search({"knowledge_graph_kwd": "ty2ents", "kb_id": kb_ids,
-                                       "size": 10000,
-                                       "fields": ["content_with_weight"]},
-                                      idxnms, kb_ids))
+def entity_type2samples_key(kb_id):
+    return f"graphrag:ty2ents:{kb_id}"
 
-    res = defaultdict(list)
-    for id in es_res.ids:
-        smp = es_res.field[id].get("content_with_weight")
-        if not smp:
-            continue
-        try:
-            smp = json.loads(smp)
-        except Exception as e:
-            logging.exception(e)
 
+def get_entity_type2sampels(idxnms, kb_ids: list):
+    """
+    Type to top-ranked entities pool of the KBs. Each KB's pool is cached in
+    Redis and refreshed whenever its ranks are recomputed.
+    """
+    pools = {}
+    missing = []
+    for kb_id in kb_ids:
+        cached = REDIS_CONN.get(entity_type2samples_key(kb_id))
+        if cached:
+            pools[kb_id] = json.loads(cached)
+        else:
+            missing.append(kb_id)
+
+    if missing:
+        es_res = settings.retrievaler.search({"knowledge_graph_kwd": "ty2ents",
+                                              "size": 10000,
+                                              "fields": ["content_with_weight", "kb_id"]},
+                                             idxnms, missing)
+        for id in es_res.ids:
+            smp = es_res.field[id].get("content_with_weight")
+            if not smp:
+                continue
+            try:
+                smp = json.loads(smp)
+            except Exception as e:
+                logging.exception(e)
+                continue
+            kb_id = es_res.field[id].get("kb_id")
+            kb_id = kb_id[0] if isinstance(kb_id, list) else kb_id
+            pools[kb_id] = smp
+            REDIS_CONN.set(entity_type2samples_key(kb_id), json.dumps(smp, ensure_ascii=False), 24 * 3600)
+
+    res = defaultdict(list)
+    for smp in pools.values():
         for ty, ents in smp.items():
             res[ty].extend(ents)
     return res
@@ -558,31 +864,19 @@ async def rebuild_graph(tenant_id, kb_id):
     graph = nx.Graph()
     src_ids = []
     flds = ["entity_kwd", "entity_type_kwd", "from_entity_kwd", "to_entity_kwd", "weight_int", "knowledge_graph_kwd", "source_id"]
-    bs = 256
-    for i in range(0, 39*bs, bs):
-        es_res = await trio.to_thread.run_sync(lambda: settings.docStoreConn.search(flds, [],
-                                 {"kb_id": kb_id, "knowledge_graph_kwd": ["entity", "relation"]},
-                                 [],
-                                 OrderByExpr(),
-                                 i, bs, search.index_name(tenant_id), [kb_id]
-                                 ))
-        tot = settings.docStoreConn.getTotal(es_res)
-        if tot == 0:
-            return None, None
-
-        es_res = settings.docStoreConn.getFields(es_res, flds)
-        for id, d in es_res.items():
-            src_ids.extend(d.get("source_id", []))
-            if d["knowledge_graph_kwd"] == "entity":
-                graph.add_node(d["entity_kwd"], entity_type=d["entity_type_kwd"])
-            elif "from_entity_kwd" in d and "to_entity_kwd" in d:
-                graph.add_edge(
-                    d["from_entity_kwd"],
-                    d["to_entity_kwd"],
-                    weight=int(d["weight_int"])
-                )
-
-        if len(es_res.keys()) < 128:
-            return graph, list(set(src_ids))
+    es_res = await trio.to_thread.run_sync(lambda: _search_all(tenant_id, kb_id, flds, {"knowledge_graph_kwd": ["entity", "relation"]}))
+    if not es_res:
+        return None, None
+
+    for id, d in es_res.items():
+        src_ids.extend(d.get("source_id", []))
+        if d["knowledge_graph_kwd"] == "entity":
+            graph.add_node(d["entity_kwd"], entity_type=d["entity_type_kwd"])
+        elif "from_entity_kwd" in d and "to_entity_kwd" in d:
+            graph.add_edge(
+                d["from_entity_kwd"],
+                d["to_entity_kwd"],
+                weight=int(d["weight_int"])
+            )
 
     return graph, list(set(src_ids))
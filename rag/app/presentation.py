@@ -23,6 +23,7 @@ from PIL import Image
 from rag.nlp import tokenize, is_english
 from rag.nlp import rag_tokenizer
 from deepdoc.parser import PdfParser, PptParser, PlainParser
+from deepdoc.parser.pdf_parser import LazyPageImage
 from PyPDF2 import PdfReader as pdf2_read
 
 
@@ -74,7 +75,8 @@ class Pdf(PdfParser):
         for i in range(len(self.boxes)):
             lines = "\n".join([b["text"] for b in self.boxes[i]
                               if not self.__garbage(b["text"])])
-            res.append((lines, self.page_images[i]))
+            img = self.page_images[i]
+            res.append((lines, img.image() if isinstance(img, LazyPageImage) else img))
         callback(0.9, "Page {}~{}: Parsing finished".format(
             from_page, min(to_page, self.total_page)))
         return res
@@ -16,9 +16,9 @@
 
 import copy
 import re
-from io import BytesIO
+from io import BytesIO, StringIO
+from itertools import islice
 from xpinyin import Pinyin
-import numpy as np
 import pandas as pd
 # from openpyxl import load_workbook, Workbook
 from dateutil.parser import parse as datetime_parse
@@ -32,50 +32,30 @@ from deepdoc.parser import ExcelParser
 class Excel(ExcelParser):
     def __call__(self, fnm, binary=None, from_page=0,
                  to_page=10000000000, callback=None):
-        if not binary:
-            wb = Excel._load_excel_to_workbook(fnm)
-        else:
-            wb = Excel._load_excel_to_workbook(BytesIO(binary))
-        total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
-
-        res, fails, done = [], [], 0
+        res = []
         rn = 0
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for sheetname, rows, _ in Excel._iter_sheets(BytesIO(binary) if binary else fnm):
+            if rn >= to_page:
+                break
+            header = next(rows, None)
+            if header is None:
                 continue
-            headers = [cell.value for cell in rows[0]]
-            missed = set([i for i, h in enumerate(headers) if h is None])
-            headers = [
-                cell.value for i,
-                cell in enumerate(
-                    rows[0]) if i not in missed]
+            missed = set([i for i, h in enumerate(header) if h is None])
+            headers = [h for i, h in enumerate(header) if i not in missed]
             if not headers:
                 continue
+            # rows before the task's range are only counted, the ones after it aren't read
+            rn += sum(1 for _ in islice(rows, max(0, from_page - rn)))
             data = []
-            for i, r in enumerate(rows[1:]):
+            for r in islice(rows, max(0, to_page - rn)):
                 rn += 1
-                if rn - 1 < from_page:
-                    continue
-                if rn - 1 >= to_page:
-                    break
-                row = [
-                    cell.value for ii,
-                    cell in enumerate(r) if ii not in missed]
-                if len(row) != len(headers):
-                    fails.append(str(i))
-                    continue
-                data.append(row)
-                done += 1
-            if np.array(data).size == 0:
+                r = (tuple(r) + (None,) * len(header))[:len(header)]
+                data.append([v for i, v in enumerate(r) if i not in missed])
+            if not data:
                 continue
-            res.append(pd.DataFrame(np.array(data), columns=headers))
+            res.append(pd.DataFrame(data, columns=headers, dtype=object))
 
-        callback(0.3, ("Extract records: {}~{}".format(from_page + 1, min(to_page, from_page + rn)) + (
-            f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
+        callback(0.3, "Extract records: {}~{}".format(from_page + 1, min(to_page, rn)))
         return res
 
 
@@ -95,32 +75,37 @@ def trans_bool(s):
 
 
 def column_data_type(arr):
+    """
+    The type most values of a column parse as, and the values converted to
+    it, None where they don't convert. Values are matched as a whole column
+    and each distinct value is converted once.
+    """
     arr = list(arr)
-    counts = {"int": 0, "float": 0, "text": 0, "datetime": 0, "bool": 0}
     trans = {t: f for f, t in
              [(int, "int"), (float, "float"), (trans_datatime, "datetime"), (trans_bool, "bool"), (str, "text")]}
-    for a in arr:
-        if a is None:
-            continue
-        if re.match(r"[+-]?[0-9]{,19}(\.0+)?$", str(a).replace("%%", "")):
-            counts["int"] += 1
-        elif re.match(r"[+-]?[0-9.]{,19}$", str(a).replace("%%", "")):
-            counts["float"] += 1
-        elif re.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", str(a), flags=re.IGNORECASE):
-            counts["bool"] += 1
-        elif trans_datatime(str(a)):
-            counts["datetime"] += 1
-        else:
-            counts["text"] += 1
+    strs = pd.Series([str(a) for a in arr if a is not None], dtype=object)
+    plain = strs.str.replace("%%", "", regex=False)
+    is_int = plain.str.match(r"[+-]?[0-9]{,19}(\.0+)?$").astype(bool)
+    is_float = ~is_int & plain.str.match(r"[+-]?[0-9.]{,19}$").astype(bool)
+    rest = ~(is_int | is_float)
+    is_bool = rest & strs.str.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", case=False).astype(bool)
+    rest &= ~is_bool
+    dates = {v: bool(trans_datatime(v)) for v in strs[rest].unique()}
+    is_datetime = rest & strs.map(lambda v: dates.get(v, False)).astype(bool)
+    counts = {"int": int(is_int.sum()), "float": int(is_float.sum()),
+              "text": int((rest & ~is_datetime).sum()), "datetime": int(is_datetime.sum()),
+              "bool": int(is_bool.sum())}
     counts = sorted(counts.items(), key=lambda x: x[1] * -1)
     ty = counts[0][0]
-    for i in range(len(arr)):
-        if arr[i] is None:
-            continue
+
+    def convert(v):
         try:
-            arr[i] = trans[ty](str(arr[i]))
+            return trans[ty](v)
         except Exception:
-            arr[i] = None
+            return None
+
+    converted = {v: convert(v) for v in strs.unique()}
+    arr = [None if a is None else converted[str(a)] for a in arr]
     # if ty == "text":
     #    if len(arr) > 128 and uni / len(arr) < 0.1:
     #        ty = "keyword"
@@ -155,25 +140,24 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000,
     elif re.search(r"\.(txt|csv)$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
         txt = get_text(filename, binary)
-        lines = txt.split("\n")
+        # lines are split as they are read, the ones after the task's range aren't
+        lines = StringIO(txt, newline="\n")
+        delimiter = kwargs.get("delimiter", "\t")
         fails = []
-        headers = lines[0].split(kwargs.get("delimiter", "\t"))
+        headers = next(lines, "").rstrip("\n").split(delimiter)
         rows = []
-        for i, line in enumerate(lines[1:]):
-            if i < from_page:
-                continue
-            if i >= to_page:
-                break
-            row = [field for field in line.split(kwargs.get("delimiter", "\t"))]
+        i = from_page
+        for i, line in enumerate(islice(lines, from_page, to_page), start=from_page):
+            row = (line[:-1] if line.endswith("\n") else line).split(delimiter)
             if len(row) != len(headers):
                 fails.append(str(i))
                 continue
             rows.append(row)
 
-        callback(0.3, ("Extract records: {}~{}".format(from_page, min(len(lines), to_page)) + (
+        callback(0.3, ("Extract records: {}~{}".format(from_page, i + 1) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
 
-        dfs = [pd.DataFrame(np.array(rows), columns=headers)]
+        dfs = [pd.DataFrame(rows, columns=headers, dtype=object)]
 
     else:
         raise NotImplementedError(
@@ -201,34 +185,41 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000,
                     "",
                     str(n)),
                 '_')[0] for n in clmns]
-        clmn_tys = []
+        clmn_tys, values = [], []
         for j in range(len(clmns)):
-            cln, ty = column_data_type(df[clmns[j]])
+            cln, ty = column_data_type(df.iloc[:, j])
             clmn_tys.append(ty)
-            df[clmns[j]] = cln
+            values.append(cln)
             if ty == "text":
                 txts.extend([str(c) for c in cln if c])
         clmns_map = [(py_clmns[i].lower() + fieds_map[clmn_tys[i]], str(clmns[i]).replace("_", " "))
                      for i in range(len(clmns))]
 
         eng = lang.lower() == "english"  # is_english(txts)
-        for ii, row in df.iterrows():
+        title_tks = rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+        # per column: the field, whether each row has a value, the value and what is indexed of it
+        columns = []
+        for j in range(len(clmns)):
+            cln = values[j]
+            present = [not (v is None or pd.isna(v) or not str(v)) for v in cln]
+            if clmn_tys[j] == "text":
+                tks = {v: rag_tokenizer.tokenize(v) for v in set(v for v, p in zip(cln, present) if p)}
+                indexed = [tks[v] if p else None for v, p in zip(cln, present)]
+            else:
+                indexed = cln
+            columns.append((clmns_map[j][0], clmns[j], present, cln, indexed))
+
+        for ii in range(len(df)):
             d = {
                 "docnm_kwd": filename,
-                "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+                "title_tks": title_tks
             }
             row_txt = []
-            for j in range(len(clmns)):
-                if row[clmns[j]] is None:
-                    continue
-                if not str(row[clmns[j]]):
-                    continue
-                if not isinstance(row[clmns[j]], pd.Series) and pd.isna(row[clmns[j]]):
+            for fld, name, present, cln, indexed in columns:
+                if not present[ii]:
                     continue
-                fld = clmns_map[j][0]
-                d[fld] = row[clmns[j]] if clmn_tys[j] != "text" else rag_tokenizer.tokenize(
-                    row[clmns[j]])
-                row_txt.append("{}:{}".format(clmns[j], row[clmns[j]]))
+                d[fld] = indexed[ii]
+                row_txt.append("{}:{}".format(name, cln[ii]))
             if not row_txt:
                 continue
             tokenize(d, "; ".join(row_txt), eng)
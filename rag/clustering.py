@@ -0,0 +1,145 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Clustering of RAPTOR layers. Kept free of heavy imports since the BIC fits
+run in spawned worker processes that import this module.
+"""
+import logging
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.mixture import GaussianMixture
+
+from rag.utils.process_pool import SpawnProcessPoolExecutor
+
+CLUSTERING_METHODS = ["gmm", "spherical", "minibatch"]
+# points used for the BIC search of the minibatch method
+MINIBATCH_SAMPLE_SIZE = 2000
+
+_pool = None
+_pool_size = 0
+
+
+def _executor(workers):
+    global _pool, _pool_size
+    if workers <= 1:
+        return None
+    if _pool is None or _pool_size != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = SpawnProcessPoolExecutor(max_workers=workers)
+        _pool_size = workers
+    return _pool
+
+
+def _bic(embeddings, n, random_state, covariance_type):
+    gm = GaussianMixture(n_components=n, random_state=random_state, covariance_type=covariance_type)
+    gm.fit(embeddings)
+    return gm.bic(embeddings)
+
+
+def _coarse_grid(max_clusters):
+    grid = [1]
+    while grid[-1] < max_clusters - 1:
+        grid.append(min(max_clusters - 1, grid[-1] * 2))
+    return grid
+
+
+class BICSearch:
+    """
+    Number of mixture components minimising the BIC over 1..max_clusters-1.
+    BICs are first computed on a doubling grid, stopping once `patience`
+    grid points in a row are worse than the best one, then every n between
+    the best grid point's neighbours is fitted. Fits of one round run in
+    parallel on a process pool; the result only depends on `random_state`.
+    """
+
+    def __init__(self, workers=1, patience=2, covariance_type="full"):
+        self.workers = workers
+        self.patience = patience
+        self.covariance_type = covariance_type
+
+    def _bics(self, embeddings, ns, random_state):
+        pool = _executor(self.workers)
+        if pool is None or len(ns) == 1:
+            return [_bic(embeddings, n, random_state, self.covariance_type) for n in ns]
+        futures = [pool.submit(_bic, embeddings, n, random_state, self.covariance_type) for n in ns]
+        return [f.result() for f in futures]
+
+    def __call__(self, embeddings: np.ndarray, max_clusters: int, random_state: int) -> int:
+        max_clusters = min(max_clusters, len(embeddings))
+        if max_clusters <= 2:
+            return 1
+        bics = {}
+        grid = _coarse_grid(max_clusters)
+        step = max(1, self.workers)
+        best, worse = None, 0
+        for i in range(0, len(grid), step):
+            ns = grid[i:i + step]
+            # patience applies point by point in grid order, the fits past the stop are dropped,
+            # so that the points searched don't depend on the number of workers
+            for n, b in zip(ns, self._bics(embeddings, ns, random_state)):
+                bics[n] = b
+                if best is None or b < bics[best]:
+                    best, worse = n, 0
+                else:
+                    worse += 1
+                if worse >= self.patience:
+                    break
+            if worse >= self.patience:
+                break
+
+        i = grid.index(best)
+        lo = grid[i - 1] + 1 if i > 0 else 1
+        hi = grid[i + 1] - 1 if i + 1 < len(grid) else max_clusters - 1
+        ns = [n for n in range(lo, hi + 1) if n not in bics]
+        for n, b in zip(ns, self._bics(embeddings, ns, random_state)):
+            bics[n] = b
+        # smallest n on ties, as np.argmin over an ascending range
+        return min(bics.keys(), key=lambda n: (bics[n], n))
+
+
+def cluster_embeddings(embeddings: np.ndarray, max_clusters: int, random_state: int, threshold: float,
+                       method="gmm", workers=1) -> tuple[int, list]:
+    """
+    Cluster one RAPTOR layer and return (number of clusters, label of each
+    embedding). `gmm` fits full-covariance mixtures, `spherical` restricts
+    them to spherical covariances and `minibatch` picks the number of
+    clusters on a sample and assigns the labels with MiniBatchKMeans.
+    """
+    if method not in CLUSTERING_METHODS:
+        logging.warning(f"Unknown RAPTOR clustering method {method}, use gmm.")
+        method = "gmm"
+    covariance_type = "full" if method == "gmm" else "spherical"
+    sample = embeddings
+    if method == "minibatch" and len(embeddings) > MINIBATCH_SAMPLE_SIZE:
+        rng = np.random.RandomState(random_state)
+        sample = embeddings[rng.choice(len(embeddings), MINIBATCH_SAMPLE_SIZE, replace=False)]
+
+    n_clusters = BICSearch(workers, covariance_type=covariance_type)(sample, max_clusters, random_state)
+    if n_clusters == 1:
+        return 1, [0 for _ in range(len(embeddings))]
+
+    if method == "minibatch":
+        km = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, batch_size=1024, n_init=3)
+        return n_clusters, km.fit_predict(embeddings).tolist()
+
+    gm = GaussianMixture(n_components=n_clusters, random_state=random_state, covariance_type=covariance_type)
+    gm.fit(embeddings)
+    probs = gm.predict_proba(embeddings)
+    lbls = [np.where(prob > threshold)[0] for prob in probs]
+    lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
+    return n_clusters, lbls
@@ -0,0 +1,162 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Dynamic batching of the local embedding and rerank models. Inputs from all
+threads of the process are queued per model and one worker thread runs them
+in batches of inputs of similar length, so that many small concurrent calls
+share a few large forward passes instead of queueing on the model's lock.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from rag.settings import LOCAL_BATCH_TOKENS, LOCAL_BATCH_SIZE, LOCAL_BATCH_WAIT_MS
+from rag.utils import run_blocking
+
+
+class _Input:
+    __slots__ = ("kind", "item", "cost", "future", "at")
+
+    def __init__(self, kind, item, cost, at):
+        self.kind = kind
+        self.item = item
+        self.cost = max(1, cost)
+        self.future = Future()
+        self.at = at
+
+
+class BatchScheduler:
+    """
+    Queue of the inputs of one local model, run by one worker thread. A
+    batch holds inputs of a single kind (e.g. documents or queries): the
+    oldest waiting input and those closest to it in length, as long as
+    batch size x longest cost stays within `max_tokens`. A batch that isn't
+    full runs `max_wait` seconds after its oldest input was queued.
+    `run(kind, items)` returns the results aligned with `items`.
+    """
+
+    def __init__(self, name, run, max_tokens=LOCAL_BATCH_TOKENS, max_size=LOCAL_BATCH_SIZE,
+                 max_wait=LOCAL_BATCH_WAIT_MS / 1000.0):
+        self.name = name
+        self.run = run
+        self.max_tokens = max_tokens
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._queue = []
+        self._pid = None
+        self._stats = {"batches": 0, "items": 0, "tokens": 0, "busy": 0.0, "wait": 0.0, "max_queue": 0}
+
+    def submit(self, kind, items, costs) -> list[Future]:
+        now = time.time()
+        inputs = [_Input(kind, item, cost, now) for item, cost in zip(items, costs)]
+        with self._cond:
+            if self._pid != os.getpid():
+                # first call, or first one since the process was forked
+                self._pid = os.getpid()
+                threading.Thread(target=self._work, name=f"batch-{self.name}", daemon=True).start()
+            self._queue.extend(inputs)
+            self._stats["max_queue"] = max(self._stats["max_queue"], len(self._queue))
+            self._cond.notify()
+        return [i.future for i in inputs]
+
+    def map(self, kind, items, costs) -> list:
+        return [f.result() for f in self.submit(kind, items, costs)]
+
+    def _pick(self, anchor):
+        """The batch around `anchor` and whether it is full."""
+        candidates = sorted((i for i in self._queue if i.kind == anchor.kind),
+                            key=lambda i: (abs(i.cost - anchor.cost), i.at))
+        batch, longest = [], 0
+        for i in candidates:
+            if batch and (len(batch) >= self.max_size or max(longest, i.cost) * (len(batch) + 1) > self.max_tokens):
+                return batch, True
+            batch.append(i)
+            longest = max(longest, i.cost)
+        return batch, False
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                while not self._queue:
+                    self._cond.wait()
+                anchor = self._queue[0]
+                batch, full = self._pick(anchor)
+                wait = anchor.at + self.max_wait - time.time()
+                if full or wait <= 0:
+                    break
+                self._cond.wait(wait)
+            taken = set(map(id, batch))
+            self._queue = [i for i in self._queue if id(i) not in taken]
+            return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            start = time.time()
+            try:
+                # a greenlet in gevent mode: the forward pass runs on a native thread
+                results = run_blocking(self.run, batch[0].kind, [i.item for i in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"{self.name} returned {len(results)} results for {len(batch)} inputs")
+                for i, res in zip(batch, results):
+                    i.future.set_result(res)
+            except Exception as e:
+                logging.exception(f"BatchScheduler {self.name} failed a batch of {len(batch)}")
+                for i in batch:
+                    if not i.future.done():
+                        i.future.set_exception(e)
+            with self._cond:
+                st = self._stats
+                st["batches"] += 1
+                st["items"] += len(batch)
+                st["tokens"] += sum(i.cost for i in batch)
+                st["busy"] += time.time() - start
+                st["wait"] += sum(start - i.at for i in batch)
+
+    def stats(self) -> dict:
+        """Queue depth, batch sizes, inputs per busy second and mean queueing time, since the process started."""
+        with self._cond:
+            st = self._stats
+            return {"queue": len(self._queue),
+                    "max_queue": st["max_queue"],
+                    "batches": st["batches"],
+                    "avg_batch": "{:.1f}".format(st["items"] / st["batches"] if st["batches"] else 0.0),
+                    "items_per_sec": "{:.1f}".format(st["items"] / st["busy"] if st["busy"] else 0.0),
+                    "tokens_per_sec": "{:.1f}".format(st["tokens"] / st["busy"] if st["busy"] else 0.0),
+                    "avg_wait_ms": "{:.1f}".format(st["wait"] / st["items"] * 1000.0 if st["items"] else 0.0)}
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def scheduler(name, model, run) -> BatchScheduler | None:
+    """The scheduler batching the inputs of `model`, None if batching is disabled."""
+    if LOCAL_BATCH_TOKENS <= 0 or model is None:
+        return None
+    key = (name, id(model))
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = BatchScheduler(name, run)
+        return _schedulers[key]
+
+
+def stats() -> dict:
+    with _schedulers_lock:
+        return {s.name: s.stats() for s in _schedulers.values()}
@@ -829,11 +829,18 @@ class GeminiChat(Base):
         self.model = GenerativeModel(model_name=self.model_name)
         self.model._client = _client
 
-    def chat(self, system, history, gen_conf):
-        from google.generativeai.types import content_types
+    def _model(self, system):
+        # a model of its own: the client is shared by the tenant's concurrent calls
+        from google.generativeai import GenerativeModel
 
-        if system:
-            self.model._system_instruction = content_types.to_content(system)
+        if not system:
+            return self.model
+        model = GenerativeModel(model_name=self.model_name, system_instruction=system)
+        model._client = self.model._client
+        return model
+
+    def chat(self, system, history, gen_conf):
+        model = self._model(system)
         for k in list(gen_conf.keys()):
             if k not in ["temperature", "top_p", "max_tokens"]:
                 del gen_conf[k]
@@ -846,7 +853,7 @@ class GeminiChat(Base):
                 item['parts'] = item.pop('content')
 
         try:
-            response = self.model.generate_content(
+            response = model.generate_content(
                 history,
                 generation_config=gen_conf)
             ans = response.text
@@ -855,10 +862,7 @@ class GeminiChat(Base):
             return "**ERROR**: " + str(e), 0
 
     def chat_streamly(self, system, history, gen_conf):
-        from google.generativeai.types import content_types
-
-        if system:
-            self.model._system_instruction = content_types.to_content(system)
+        model = self._model(system)
         for k in list(gen_conf.keys()):
             if k not in ["temperature", "top_p", "max_tokens"]:
                 del gen_conf[k]
@@ -869,7 +873,7 @@ class GeminiChat(Base):
                 item['parts'] = item.pop('content')
         ans = ""
         try:
-            response = self.model.generate_content(
+            response = model.generate_content(
                 history,
                 generation_config=gen_conf, stream=True)
             for resp in response:
@@ -1132,13 +1136,10 @@ class ReplicateChat(Base):
 
         self.model_name = model_name
         self.client = Client(api_token=key)
-        self.system = ""
 
     def chat(self, system, history, gen_conf):
         if "max_tokens" in gen_conf:
             del gen_conf["max_tokens"]
-        if system:
-            self.system = system
         prompt = "\n".join(
             [item["role"] + ":" + item["content"] for item in history[-5:]]
         )
@@ -1146,7 +1147,7 @@ class ReplicateChat(Base):
         try:
             response = self.client.run(
                 self.model_name,
-                input={"system_prompt": self.system, "prompt": prompt, **gen_conf},
+                input={"system_prompt": system, "prompt": prompt, **gen_conf},
             )
             ans = "".join(response)
             return ans, num_tokens_from_string(ans)
@@ -1156,8 +1157,6 @@ class ReplicateChat(Base):
     def chat_streamly(self, system, history, gen_conf):
         if "max_tokens" in gen_conf:
             del gen_conf["max_tokens"]
-        if system:
-            self.system = system
         prompt = "\n".join(
             [item["role"] + ":" + item["content"] for item in history[-5:]]
         )
@@ -1165,7 +1164,7 @@ class ReplicateChat(Base):
         try:
             response = self.client.run(
                 self.model_name,
-                input={"system_prompt": self.system, "prompt": prompt, **gen_conf},
+                input={"system_prompt": system, "prompt": prompt, **gen_conf},
             )
             for resp in response:
                 ans += resp
@@ -1291,11 +1290,8 @@ class BaiduYiyanChat(Base):
         sk = key.get("yiyan_sk", "")
         self.client = qianfan.ChatCompletion(ak=ak, sk=sk)
         self.model_name = model_name.lower()
-        self.system = ""
 
     def chat(self, system, history, gen_conf):
-        if system:
-            self.system = system
         gen_conf["penalty_score"] = (
                                             (gen_conf.get("presence_penalty", 0) + gen_conf.get("frequency_penalty",
                                                                                                 0)) / 2
@@ -1308,7 +1304,7 @@ class BaiduYiyanChat(Base):
             response = self.client.do(
                 model=self.model_name,
                 messages=history,
-                system=self.system,
+                system=system,
                 **gen_conf
             ).body
             ans = response['result']
@@ -1318,8 +1314,6 @@ class BaiduYiyanChat(Base):
             return ans + "\n**ERROR**: " + str(e), 0
 
     def chat_streamly(self, system, history, gen_conf):
-        if system:
-            self.system = system
         gen_conf["penalty_score"] = (
                                             (gen_conf.get("presence_penalty", 0) + gen_conf.get("frequency_penalty",
                                                                                                 0)) / 2
@@ -1333,7 +1327,7 @@ class BaiduYiyanChat(Base):
             response = self.client.do(
                 model=self.model_name,
                 messages=history,
-                system=self.system,
+                system=system,
                 stream=True,
                 **gen_conf
             )
@@ -1356,11 +1350,8 @@ class AnthropicChat(Base):
 
         self.client = anthropic.Anthropic(api_key=key)
         self.model_name = model_name
-        self.system = ""
 
     def chat(self, system, history, gen_conf):
-        if system:
-            self.system = system
         if "presence_penalty" in gen_conf:
             del gen_conf["presence_penalty"]
         if "frequency_penalty" in gen_conf:
@@ -1371,7 +1362,7 @@ class AnthropicChat(Base):
             response = self.client.messages.create(
                 model=self.model_name,
                 messages=history,
-                system=self.system,
+                system=system,
                 stream=False,
                 **gen_conf,
             ).to_dict()
@@ -1390,8 +1381,6 @@ class AnthropicChat(Base):
             return ans + "\n**ERROR**: " + str(e), 0
 
     def chat_streamly(self, system, history, gen_conf):
-        if system:
-            self.system = system
         if "presence_penalty" in gen_conf:
             del gen_conf["presence_penalty"]
         if "frequency_penalty" in gen_conf:
@@ -1403,7 +1392,7 @@ class AnthropicChat(Base):
             response = self.client.messages.create(
                 model=self.model_name,
                 messages=history,
-                system=self.system,
+                system=system,
                 stream=True,
                 **gen_conf,
             )
@@ -1433,7 +1422,6 @@ class GoogleChat(Base):
 
         scopes = ["https://www.googleapis.com/auth/cloud-platform"]
         self.model_name = model_name
-        self.system = ""
 
         if "claude" in self.model_name:
             from anthropic import AnthropicVertex
@@ -1467,8 +1455,6 @@ class GoogleChat(Base):
             self.client = glm.GenerativeModel(model_name=self.model_name)
 
     def chat(self, system, history, gen_conf):
-        if system:
-            self.system = system
 
         if "claude" in self.model_name:
             if "max_tokens" in gen_conf:
@@ -1477,7 +1463,7 @@ class GoogleChat(Base):
                 response = self.client.messages.create(
                     model=self.model_name,
                     messages=history,
-                    system=self.system,
+                    system=system,
                     stream=False,
                     **gen_conf,
                 ).json()
@@ -1496,7 +1482,10 @@ class GoogleChat(Base):
             except Exception as e:
                 return "\n**ERROR**: " + str(e), 0
         else:
-            self.client._system_instruction = self.system
+            import vertexai.generative_models as glm
+
+            # a model of its own: the client is shared by the tenant's concurrent calls
+            client = glm.GenerativeModel(model_name=self.model_name, system_instruction=system or None)
             if "max_tokens" in gen_conf:
                 gen_conf["max_output_tokens"] = gen_conf["max_tokens"]
             for k in list(gen_conf.keys()):
@@ -1508,7 +1497,7 @@ class GoogleChat(Base):
                 if "content" in item:
                     item["parts"] = item.pop("content")
             try:
-                response = self.client.generate_content(
+                response = client.generate_content(
                     history, generation_config=gen_conf
                 )
                 ans = response.text
@@ -1517,8 +1506,6 @@ class GoogleChat(Base):
                 return "**ERROR**: " + str(e), 0
 
     def chat_streamly(self, system, history, gen_conf):
-        if system:
-            self.system = system
 
         if "claude" in self.model_name:
             if "max_tokens" in gen_conf:
@@ -1529,7 +1516,7 @@ class GoogleChat(Base):
                 response = self.client.messages.create(
                     model=self.model_name,
                     messages=history,
-                    system=self.system,
+                    system=system,
                     stream=True,
                     **gen_conf,
                 )
@@ -1544,7 +1531,10 @@ class GoogleChat(Base):
 
             yield total_tokens
         else:
-            self.client._system_instruction = self.system
+            import vertexai.generative_models as glm
+
+            # a model of its own: the client is shared by the tenant's concurrent calls
+            client = glm.GenerativeModel(model_name=self.model_name, system_instruction=system or None)
             if "max_tokens" in gen_conf:
                 gen_conf["max_output_tokens"] = gen_conf["max_tokens"]
             for k in list(gen_conf.keys()):
@@ -1557,7 +1547,7 @@ class GoogleChat(Base):
                     item["parts"] = item.pop("content")
             ans = ""
             try:
-                response = self.model.generate_content(
+                response = client.generate_content(
                     history, generation_config=gen_conf, stream=True
                 )
                 for resp in response:
@@ -29,7 +29,8 @@ import asyncio
 
 from api import settings
 from api.utils.file_utils import get_home_cache_dir
-from rag.utils import num_tokens_from_string, truncate
+from rag.llm import batching
+from rag.utils import num_tokens_from_string, run_blocking, truncate
 import google.generativeai as genai
 import json
 
@@ -93,20 +94,33 @@ class DefaultEmbedding(Base):
         self._model = DefaultEmbedding._model
         self._model_name = DefaultEmbedding._model_name
 
+    def _batcher(self):
+        return batching.scheduler(f"{self.__class__.__name__}/{self._model_name}", self._model, self._run_batch)
+
+    def _run_batch(self, kind, texts):
+        if kind == "query":
+            return self._model.encode_queries(texts).tolist()
+        return self._model.encode(texts).tolist()
+
     def encode(self, texts: list):
         batch_size = 16
         texts = [truncate(t, 2048) for t in texts]
-        token_count = 0
-        for t in texts:
-            token_count += num_tokens_from_string(t)
+        costs = [num_tokens_from_string(t) for t in texts]
+        token_count = sum(costs)
+        batcher = self._batcher()
+        if batcher:
+            return np.array(batcher.map("doc", texts, costs)), token_count
         ress = []
         for i in range(0, len(texts), batch_size):
-            ress.extend(self._model.encode(texts[i:i + batch_size]).tolist())
+            ress.extend(run_blocking(self._model.encode, texts[i:i + batch_size]).tolist())
         return np.array(ress), token_count
 
     def encode_queries(self, text: str):
         token_count = num_tokens_from_string(text)
-        return self._model.encode_queries([text]).tolist()[0], token_count
+        batcher = self._batcher()
+        if batcher:
+            return batcher.map("query", [text], [token_count])[0], token_count
+        return run_blocking(self._model.encode_queries, [text]).tolist()[0], token_count
 
 
 class OpenAIEmbed(Base):
@@ -297,13 +311,22 @@ class FastEmbed(DefaultEmbedding):
         self._model = DefaultEmbedding._model
         self._model_name = model_name
 
+    def _run_batch(self, kind, texts):
+        if kind == "query":
+            return [e.tolist() for e in self._model.query_embed(texts)]
+        return [e.tolist() for e in self._model.embed(texts, batch_size=len(texts))]
+
     def encode(self, texts: list):
         # Using the internal tokenizer to encode the texts and get the total
         # number of tokens
         encodings = self._model.model.tokenizer.encode_batch(texts)
-        total_tokens = sum(len(e) for e in encodings)
+        costs = [len(e) for e in encodings]
+        total_tokens = sum(costs)
 
-        embeddings = [e.tolist() for e in self._model.embed(texts, batch_size=16)]
+        batcher = self._batcher()
+        if batcher:
+            return np.array(batcher.map("doc", texts, costs)), total_tokens
+        embeddings = run_blocking(lambda: [e.tolist() for e in self._model.embed(texts, batch_size=16)])
 
         return np.array(embeddings), total_tokens
 
@@ -311,7 +334,10 @@ class FastEmbed(DefaultEmbedding):
         # Using the internal tokenizer to encode the texts and get the total
         # number of tokens
         encoding = self._model.model.tokenizer.encode(text)
-        embedding = next(self._model.query_embed(text)).tolist()
+        batcher = self._batcher()
+        if batcher:
+            return np.array(batcher.map("query", [text], [len(encoding.ids)])[0]), len(encoding.ids)
+        embedding = run_blocking(lambda: next(self._model.query_embed(text)).tolist())
 
         return np.array(embedding), len(encoding.ids)
 
@@ -355,20 +381,33 @@ class YoudaoEmbed(Base):
                     model_name_or_path=model_name.replace(
                         "maidalun1020", "InfiniFlow"))
 
+    def _batcher(self):
+        return batching.scheduler(self.__class__.__name__, YoudaoEmbed._client, self._run_batch)
+
+    @staticmethod
+    def _run_batch(kind, texts):
+        return list(YoudaoEmbed._client.encode(texts))
+
     def encode(self, texts: list):
         batch_size = 10
         res = []
-        token_count = 0
-        for t in texts:
-            token_count += num_tokens_from_string(t)
+        costs = [num_tokens_from_string(t) for t in texts]
+        token_count = sum(costs)
+        batcher = self._batcher()
+        if batcher:
+            return np.array(batcher.map("doc", texts, costs)), token_count
         for i in range(0, len(texts), batch_size):
-            embds = YoudaoEmbed._client.encode(texts[i:i + batch_size])
+            embds = run_blocking(YoudaoEmbed._client.encode, texts[i:i + batch_size])
             res.extend(embds)
         return np.array(res), token_count
 
     def encode_queries(self, text):
-        embds = YoudaoEmbed._client.encode([text])
-        return np.array(embds[0]), num_tokens_from_string(text)
+        token_count = num_tokens_from_string(text)
+        batcher = self._batcher()
+        if batcher:
+            return np.array(batcher.map("query", [text], [token_count])[0]), token_count
+        embds = run_blocking(YoudaoEmbed._client.encode, [text])
+        return np.array(embds[0]), token_count
 
 
 class JinaEmbed(Base):
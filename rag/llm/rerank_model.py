@@ -28,7 +28,8 @@ from yarl import URL
 
 from api import settings
 from api.utils.file_utils import get_home_cache_dir
-from rag.utils import num_tokens_from_string, truncate
+from rag.llm import batching
+from rag.utils import num_tokens_from_string, run_blocking, truncate
 import json
 
 
@@ -140,14 +141,25 @@ class DefaultRerank(Base):
             scores = [scores]
         return scores
 
+    def _batcher(self):
+        return batching.scheduler(self.__class__.__name__, self._model, self._run_batch)
+
+    def _run_batch(self, kind, pairs):
+        return self._process_batch(pairs, max_batch_size=len(pairs)).tolist()
+
+    def _scores(self, pairs, batch_size):
+        """Scores of (query, text) pairs, batched with the concurrent calls if enabled, and the tokens of the texts."""
+        costs = [num_tokens_from_string(t) for _, t in pairs]
+        batcher = self._batcher()
+        if batcher and pairs:
+            query_cost = num_tokens_from_string(pairs[0][0])
+            return np.array(batcher.map("pair", pairs, [query_cost + c for c in costs])), sum(costs)
+        return np.array(run_blocking(self._process_batch, pairs, max_batch_size=batch_size)), sum(costs)
+
     def similarity(self, query: str, texts: list):
         pairs = [(query, truncate(t, 2048)) for t in texts]
-        token_count = 0
-        for _, t in pairs:
-            token_count += num_tokens_from_string(t)
         batch_size = 4096
-        res = self._process_batch(pairs, max_batch_size=batch_size)
-        return np.array(res), token_count
+        return self._scores(pairs, batch_size)
 
 
 class JinaRerank(Base):
@@ -194,15 +206,13 @@ class YoudaoRerank(DefaultRerank):
                                 "maidalun1020", "InfiniFlow"))
 
         self._model = YoudaoRerank._model
+        self._dynamic_batch_size = 8
+        self._min_batch_size = 1
 
     def similarity(self, query: str, texts: list):
         pairs = [(query, truncate(t, self._model.max_length)) for t in texts]
-        token_count = 0
-        for _, t in pairs:
-            token_count += num_tokens_from_string(t)
         batch_size = 8
-        res = self._process_batch(pairs, max_batch_size=batch_size)
-        return np.array(res), token_count
+        return self._scores(pairs, batch_size)
 
 
 class XInferenceRerank(Base):
@@ -18,7 +18,7 @@ import re
 from dataclasses import dataclass
 
 from rag.settings import TAG_FLD, PAGERANK_FLD
-from rag.utils import rmSpace
+from rag.utils import rmSpace, run_blocking
 from rag.nlp import rag_tokenizer, query
 import numpy as np
 from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
@@ -206,25 +206,29 @@ class Dealer:
         assert len(ans_v[0]) == len(chunk_v[0]), "The dimension of query and chunk do not match: {} vs. {}".format(
             len(ans_v[0]), len(chunk_v[0]))
 
-        chunks_tks = [rag_tokenizer.tokenize(self.qryr.rmWWW(ck)).split()
-                      for ck in chunks]
-        cites = {}
-        thr = 0.63
-        while thr > 0.3 and len(cites.keys()) == 0 and pieces_ and chunks_tks:
-            for i, a in enumerate(pieces_):
-                sim, tksim, vtsim = self.qryr.hybrid_similarity(ans_v[i],
-                                                                chunk_v,
-                                                                rag_tokenizer.tokenize(
-                                                                    self.qryr.rmWWW(pieces_[i])).split(),
-                                                                chunks_tks,
-                                                                tkweight, vtweight)
-                mx = np.max(sim) * 0.99
-                logging.debug("{} SIM: {}".format(pieces_[i], mx))
-                if mx < thr:
-                    continue
-                cites[idx[i]] = list(
-                    set([str(ii) for ii in range(len(chunk_v)) if sim[ii] > mx]))[:4]
-            thr *= 0.8
+        def cite():
+            chunks_tks = [rag_tokenizer.tokenize(self.qryr.rmWWW(ck)).split()
+                          for ck in chunks]
+            cites = {}
+            thr = 0.63
+            while thr > 0.3 and len(cites.keys()) == 0 and pieces_ and chunks_tks:
+                for i, a in enumerate(pieces_):
+                    sim, tksim, vtsim = self.qryr.hybrid_similarity(ans_v[i],
+                                                                    chunk_v,
+                                                                    rag_tokenizer.tokenize(
+                                                                        self.qryr.rmWWW(pieces_[i])).split(),
+                                                                    chunks_tks,
+                                                                    tkweight, vtweight)
+                    mx = np.max(sim) * 0.99
+                    logging.debug("{} SIM: {}".format(pieces_[i], mx))
+                    if mx < thr:
+                        continue
+                    cites[idx[i]] = list(
+                        set([str(ii) for ii in range(len(chunk_v)) if sim[ii] > mx]))[:4]
+                thr *= 0.8
+            return cites
+
+        cites = run_blocking(cite)
 
         res = ""
         seted = set([])
@@ -323,7 +327,7 @@ class Dealer:
             tks = content_ltks + title_tks + important_kwd
             ins_tw.append(tks)
 
-        tksim = self.qryr.token_similarity(keywords, ins_tw)
+        tksim = run_blocking(self.qryr.token_similarity, keywords, ins_tw)
         vtsim, _ = rerank_mdl.similarity(query, [rmSpace(" ".join(tks)) for tks in ins_tw])
         ## For rank feature(tag_fea) scores.
         rank_fea = self._rank_feature_scores(rank_feature, sres)
@@ -368,8 +372,8 @@ class Dealer:
                                                        vector_similarity_weight,
                                                        rank_feature=rank_feature)
             else:
-                sim, tsim, vsim = self.rerank(
-                    sres, question, 1 - vector_similarity_weight, vector_similarity_weight,
+                sim, tsim, vsim = run_blocking(
+                    self.rerank, sres, question, 1 - vector_similarity_weight, vector_similarity_weight,
                     rank_feature=rank_feature)
             idx = np.argsort(sim * -1)[(page - 1) * page_size:page * page_size]
         else:
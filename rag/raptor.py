@@ -13,12 +13,15 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import json
 import logging
 import re
+import zlib
+
 import umap
 import numpy as np
-from sklearn.mixture import GaussianMixture
 import trio
+import xxhash
 
 from graphrag.utils import (
     get_llm_cache,
@@ -27,14 +30,41 @@ from graphrag.utils import (
     set_llm_cache,
     chat_limiter,
 )
+from rag.clustering import cluster_embeddings, BICSearch
+from rag.settings import RAPTOR_CLUSTER_WORKERS
 from rag.utils import truncate
+from rag.utils.storage_factory import STORAGE_IMPL
+
+
+def raptor_tree_name(doc_id):
+    return f"raptor_tree_{doc_id}.z"
+
+
+def load_raptor_tree(kb_id, doc_id, signature):
+    """The tree of the last RAPTOR run over the document if it was built with the same `signature`."""
+    try:
+        if not STORAGE_IMPL.obj_exist(kb_id, raptor_tree_name(doc_id)):
+            return None
+        tree = json.loads(zlib.decompress(STORAGE_IMPL.get(kb_id, raptor_tree_name(doc_id))))
+        if tree.get("signature") == signature:
+            return tree
+    except Exception as e:
+        logging.exception(f"Fail to load RAPTOR tree of doc {doc_id}: {e}")
+    return None
+
+
+def save_raptor_tree(kb_id, doc_id, signature, tree):
+    obj = {"signature": signature, **tree}
+    STORAGE_IMPL.put(kb_id, raptor_tree_name(doc_id),
+                     zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")))
 
 
 class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
     def __init__(
-        self, max_cluster, llm_model, embd_model, prompt, max_token=512, threshold=0.1
+        self, max_cluster, llm_model, embd_model, prompt, max_token=512, threshold=0.1, clustering="gmm"
     ):
         self._max_cluster = max_cluster
+        self._clustering = clustering
         self._llm_model = llm_model
         self._embd_model = embd_model
         self._threshold = threshold
@@ -66,24 +96,25 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
         return embds
 
     def _get_optimal_clusters(self, embeddings: np.ndarray, random_state: int):
-        max_clusters = min(self._max_cluster, len(embeddings))
-        n_clusters = np.arange(1, max_clusters)
-        bics = []
-        for n in n_clusters:
-            gm = GaussianMixture(n_components=n, random_state=random_state)
-            gm.fit(embeddings)
-            bics.append(gm.bic(embeddings))
-        optimal_clusters = n_clusters[np.argmin(bics)]
-        return optimal_clusters
-
-    async def __call__(self, chunks, random_state, callback=None):
-        layers = [(0, len(chunks))]
+        return BICSearch(RAPTOR_CLUSTER_WORKERS)(embeddings, self._max_cluster, random_state)
+
+    async def __call__(self, chunks, random_state, callback=None, tree=None):
+        """
+        Build the summary layers over `chunks`, a list of (text, embedding).
+        `tree` is the `self.tree` of a previous run over the same document:
+        its clusters whose members are all still in a layer are kept with
+        their summary and embedding, and only the rest of the layer is
+        clustered and summarized again.
+        """
+        self.tree = {"layers": []}
         start, end = 0, len(chunks)
         if len(chunks) <= 1:
             return []
         chunks = [(s, a) for s, a in chunks if s and len(a) > 0]
+        end = len(chunks)
+        prev_layers = (tree or {}).get("layers", [])
 
-        async def summarize(ck_idx: list[int]):
+        async def summarize(ck_idx: list[int], layer: list):
             nonlocal chunks
             texts = [chunks[i][0] for i in ck_idx]
             len_per_chunk = int(
@@ -113,59 +144,68 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
             logging.debug(f"SUM: {cnt}")
             embds = await self._embedding_encode(cnt)
             chunks.append((cnt, embds))
+            layer.append({"members": [node_key(chunks[i][0]) for i in ck_idx], "summary": cnt,
+                          "embedding": np.asarray(embds).tolist()})
+
+        def kept_clusters(prev_layer):
+            index = {node_key(chunks[i][0]): i for i in range(start, end)}
+            kept, used = [], set()
+            for c in prev_layer:
+                ck_idx = [index.get(k) for k in c["members"]]
+                if not ck_idx or None in ck_idx or used.intersection(ck_idx):
+                    continue
+                used.update(ck_idx)
+                kept.append(c)
+            return kept, [i for i in range(start, end) if i not in used]
 
-        labels = []
         while end - start > 1:
-            embeddings = [embd for _, embd in chunks[start:end]]
-            if len(embeddings) == 2:
-                await summarize([start, start + 1])
-                if callback:
-                    callback(
-                        msg="Cluster one layer: {} -> {}".format(
-                            end - start, len(chunks) - end
-                        )
-                    )
-                labels.extend([0, 0])
-                layers.append((end, len(chunks)))
-                start = end
-                end = len(chunks)
-                continue
-
-            n_neighbors = int((len(embeddings) - 1) ** 0.8)
-            reduced_embeddings = umap.UMAP(
-                n_neighbors=max(2, n_neighbors),
-                n_components=min(12, len(embeddings) - 2),
-                metric="cosine",
-            ).fit_transform(embeddings)
-            n_clusters = self._get_optimal_clusters(reduced_embeddings, random_state)
-            if n_clusters == 1:
-                lbls = [0 for _ in range(len(reduced_embeddings))]
-            else:
-                gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
-                gm.fit(reduced_embeddings)
-                probs = gm.predict_proba(reduced_embeddings)
-                lbls = [np.where(prob > self._threshold)[0] for prob in probs]
-                lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
-
-            async with trio.open_nursery() as nursery:
-                for c in range(n_clusters):
-                    ck_idx = [i + start for i in range(len(lbls)) if lbls[i] == c]
-                    assert len(ck_idx) > 0
-                    async with chat_limiter:
-                        nursery.start_soon(lambda: summarize(ck_idx))
-
-            assert len(chunks) - end == n_clusters, "{} vs. {}".format(
-                len(chunks) - end, n_clusters
+            layer_no = len(self.tree["layers"])
+            kept, rest = kept_clusters(prev_layers[layer_no] if layer_no < len(prev_layers) else [])
+            if len(kept) + min(len(rest), 1) >= end - start:
+                # reusing would not shrink the layer, cluster it all over again
+                kept, rest = [], list(range(start, end))
+            layer = []
+            for c in kept:
+                chunks.append((c["summary"], np.array(c["embedding"])))
+                layer.append(c)
+
+            if 0 < len(rest) <= 2:
+                await summarize(rest, layer)
+            elif rest:
+                embeddings = [chunks[i][1] for i in rest]
+                n_neighbors = int((len(embeddings) - 1) ** 0.8)
+                reduced_embeddings = umap.UMAP(
+                    n_neighbors=max(2, n_neighbors),
+                    n_components=min(12, len(embeddings) - 2),
+                    metric="cosine",
+                ).fit_transform(embeddings)
+                n_clusters, lbls = await trio.to_thread.run_sync(
+                    lambda: cluster_embeddings(reduced_embeddings, self._max_cluster, random_state, self._threshold,
+                                               self._clustering, RAPTOR_CLUSTER_WORKERS)
+                )
+
+                async with trio.open_nursery() as nursery:
+                    for c in range(n_clusters):
+                        ck_idx = [rest[i] for i in range(len(lbls)) if lbls[i] == c]
+                        assert len(ck_idx) > 0
+                        async with chat_limiter:
+                            nursery.start_soon(summarize, ck_idx, layer)
+
+            assert len(chunks) - end == len(layer), "{} vs. {}".format(
+                len(chunks) - end, len(layer)
             )
-            labels.extend(lbls)
-            layers.append((end, len(chunks)))
+            self.tree["layers"].append(layer)
             if callback:
                 callback(
-                    msg="Cluster one layer: {} -> {}".format(
-                        end - start, len(chunks) - end
+                    msg="Cluster one layer: {} -> {}, {} summaries reused".format(
+                        end - start, len(chunks) - end, len(kept)
                     )
                 )
             start = end
             end = len(chunks)
 
         return chunks
+
+
+def node_key(text: str) -> str:
+    return xxhash.xxh64(text.encode("utf-8")).hexdigest()
@@ -15,6 +15,7 @@
 #
 import os
 import logging
+import tempfile
 from api.utils import get_base_config, decrypt_database_config
 from api.utils.file_utils import get_project_base_directory
 
@@ -33,6 +34,33 @@ except Exception:
     REDIS = {}
     pass
 DOC_MAXIMUM_SIZE = int(os.environ.get("MAX_CONTENT_LENGTH", 128 * 1024 * 1024))
+# Number of PDF pages rendered and kept in memory at a time; 0 renders the whole task range up front.
+PDF_STREAMING_WINDOW = int(os.environ.get("PDF_STREAMING_WINDOW", 0))
+# Build text boxes from the PDF's own text layer on born-digital pages instead of running OCR.
+PDF_TEXT_LAYER_FIRST = int(os.environ.get("PDF_TEXT_LAYER_FIRST", 1))
+# Number of document subgraphs merged on load before the GraphRAG snapshot of a KB is rewritten.
+GRAPH_SNAPSHOT_INTERVAL = int(os.environ.get("GRAPH_SNAPSHOT_INTERVAL", 16))
+# Worker processes fitting the Gaussian mixtures of RAPTOR's cluster-number search; 1 fits them in-process.
+RAPTOR_CLUSTER_WORKERS = int(os.environ.get("RAPTOR_CLUSTER_WORKERS", 4))
+# Token budget of the chunks packed into one GraphRAG extraction prompt; 0 sends every chunk on its own.
+GRAPHRAG_PACK_TOKENS = int(os.environ.get("GRAPHRAG_PACK_TOKENS", 1024))
+# Share of a community's members (1 - Jaccard) that may change before its GraphRAG report is regenerated.
+GRAPHRAG_COMMUNITY_CHANGE_THRESHOLD = float(os.environ.get("GRAPHRAG_COMMUNITY_CHANGE_THRESHOLD", 0.2))
+# Padded tokens (batch size x longest input) of one forward pass of a local embedding or rerank model; 0 disables batching.
+LOCAL_BATCH_TOKENS = int(os.environ.get("LOCAL_BATCH_TOKENS", 16384))
+# Inputs in one forward pass of a local embedding or rerank model.
+LOCAL_BATCH_SIZE = int(os.environ.get("LOCAL_BATCH_SIZE", 64))
+# Milliseconds a local model waits for more inputs before running a batch that isn't full.
+LOCAL_BATCH_WAIT_MS = int(os.environ.get("LOCAL_BATCH_WAIT_MS", 5))
+# Worker processes rendering PDF pages in parallel; 0 or 1 renders them in-process, one page at a time, which
+# deepdoc/vision/t_render.py measured faster. Raise it only where that benchmark shows the workers ahead.
+PDF_RENDER_WORKERS = int(os.environ.get("PDF_RENDER_WORKERS", 0))
+# Bytes of one part of a streamed upload or download of the object store.
+STORAGE_PART_SIZE = int(os.environ.get("STORAGE_PART_SIZE", 16 * 1024 * 1024))
+# Bytes of document files kept on local disk for the tasks parsing them; 0 fetches every task's file from the store.
+STORAGE_CACHE_SIZE = int(os.environ.get("STORAGE_CACHE_SIZE", 4 * 1024 * 1024 * 1024))
+# Directory of that cache, shared by the task executors of a host.
+STORAGE_CACHE_DIR = os.environ.get("STORAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ragflow_storage_cache"))
 
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_QUEUE_RETENTION = 60*60
@@ -47,4 +75,17 @@ def print_rag_settings():
     logging.info(f"MAX_CONTENT_LENGTH: {DOC_MAXIMUM_SIZE}")
     logging.info(f"SERVER_QUEUE_MAX_LEN: {SVR_QUEUE_MAX_LEN}")
     logging.info(f"SERVER_QUEUE_RETENTION: {SVR_QUEUE_RETENTION}")
+    logging.info(f"PDF_STREAMING_WINDOW: {PDF_STREAMING_WINDOW}")
+    logging.info(f"PDF_TEXT_LAYER_FIRST: {PDF_TEXT_LAYER_FIRST}")
+    logging.info(f"PDF_RENDER_WORKERS: {PDF_RENDER_WORKERS}")
+    logging.info(f"GRAPH_SNAPSHOT_INTERVAL: {GRAPH_SNAPSHOT_INTERVAL}")
+    logging.info(f"RAPTOR_CLUSTER_WORKERS: {RAPTOR_CLUSTER_WORKERS}")
+    logging.info(f"GRAPHRAG_PACK_TOKENS: {GRAPHRAG_PACK_TOKENS}")
+    logging.info(f"GRAPHRAG_COMMUNITY_CHANGE_THRESHOLD: {GRAPHRAG_COMMUNITY_CHANGE_THRESHOLD}")
+    logging.info(f"LOCAL_BATCH_TOKENS: {LOCAL_BATCH_TOKENS}")
+    logging.info(f"LOCAL_BATCH_SIZE: {LOCAL_BATCH_SIZE}")
+    logging.info(f"LOCAL_BATCH_WAIT_MS: {LOCAL_BATCH_WAIT_MS}")
+    logging.info(f"STORAGE_PART_SIZE: {STORAGE_PART_SIZE}")
+    logging.info(f"STORAGE_CACHE_SIZE: {STORAGE_CACHE_SIZE}")
+    logging.info(f"STORAGE_CACHE_DIR: {STORAGE_CACHE_DIR}")
     logging.info(f"MAX_FILE_COUNT_PER_USER: {int(os.environ.get('MAX_FILE_NUM_PER_USER', 0))}")
\ No newline at end of file
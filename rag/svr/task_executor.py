@@ -35,6 +35,7 @@ import json
 import xxhash
 import copy
 import re
+from contextlib import AsyncExitStack, asynccontextmanager
 from functools import partial
 from io import BytesIO
 from multiprocessing.context import TimeoutError
@@ -58,11 +59,14 @@ from api.versions import get_ragflow_version
 from api.db.db_models import close_connection
 from rag.app import laws, paper, presentation, manual, qa, table, book, resume, picture, naive, one, audio, \
     email, tag
+from rag.llm import batching
 from rag.nlp import search, rag_tokenizer
-from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
+from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor, load_raptor_tree, \
+    save_raptor_tree
 from rag.settings import DOC_MAXIMUM_SIZE, SVR_QUEUE_NAME, print_rag_settings, TAG_FLD, PAGERANK_FLD
 from rag.utils import num_tokens_from_string
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.storage_cache import storage_cache
 from rag.utils.storage_factory import STORAGE_IMPL
 from graphrag.utils import chat_limiter
 
@@ -197,8 +201,41 @@ async def collect():
     return redis_msg, task
 
 
-async def get_storage_binary(bucket, name):
-    return await trio.to_thread.run_sync(lambda: STORAGE_IMPL.get(bucket, name))
+async def get_storage_binary(bucket, name, version=None):
+    cache = storage_cache()
+    if cache is None:
+        return await trio.to_thread.run_sync(lambda: STORAGE_IMPL.get(bucket, name))
+    return await trio.to_thread.run_sync(lambda: cache.get(bucket, name, version))
+
+
+class SharedBinary:
+    def __init__(self):
+        self.lock = trio.Lock()
+        self.binary = None
+        self.users = 0
+
+
+SHARED_BINARIES = {}
+
+
+@asynccontextmanager
+async def shared_storage_binary(bucket, name, version=None):
+    """
+    The file's contents, held once by this executor for all the tasks of the
+    document it runs at the same time.
+    """
+    key = (bucket, name, version)
+    shared = SHARED_BINARIES.setdefault(key, SharedBinary())
+    shared.users += 1
+    try:
+        async with shared.lock:
+            if shared.binary is None:
+                shared.binary = await get_storage_binary(bucket, name, version)
+        yield shared.binary
+    finally:
+        shared.users -= 1
+        if shared.users == 0:
+            SHARED_BINARIES.pop(key, None)
 
 
 async def build_chunks(task, progress_callback):
@@ -208,36 +245,39 @@ async def build_chunks(task, progress_callback):
         return []
 
     chunker = FACTORY[task["parser_id"].lower()]
-    try:
-        st = timer()
-        bucket, name = File2DocumentService.get_storage_address(doc_id=task["doc_id"])
-        binary = await get_storage_binary(bucket, name)
-        logging.info("From minio({}) {}/{}".format(timer() - st, task["location"], task["name"]))
-    except TimeoutError:
-        progress_callback(-1, "Internal server error: Fetch file from minio timeout. Could you try it again.")
-        logging.exception(
-            "Minio {}/{} got timeout: Fetch file from minio timeout.".format(task["location"], task["name"]))
-        raise
-    except Exception as e:
-        if re.search("(No such file|not found)", str(e)):
-            progress_callback(-1, "Can not find file <%s> from minio. Could you try it again?" % task["name"])
-        else:
-            progress_callback(-1, "Get file from minio: %s" % str(e).replace("'", ""))
-        logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
-        raise
+    async with AsyncExitStack() as stack:
+        try:
+            st = timer()
+            bucket, name = File2DocumentService.get_storage_address(doc_id=task["doc_id"])
+            # a document's file is written once, at upload: the same name uploaded again is another document
+            version = f'{task["doc_id"]}:{task["size"]}'
+            binary = await stack.enter_async_context(shared_storage_binary(bucket, name, version))
+            logging.info("From minio({}) {}/{}".format(timer() - st, task["location"], task["name"]))
+        except TimeoutError:
+            progress_callback(-1, "Internal server error: Fetch file from minio timeout. Could you try it again.")
+            logging.exception(
+                "Minio {}/{} got timeout: Fetch file from minio timeout.".format(task["location"], task["name"]))
+            raise
+        except Exception as e:
+            if re.search("(No such file|not found)", str(e)):
+                progress_callback(-1, "Can not find file <%s> from minio. Could you try it again?" % task["name"])
+            else:
+                progress_callback(-1, "Get file from minio: %s" % str(e).replace("'", ""))
+            logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
+            raise
 
-    try:
-        async with chunk_limiter:
-            cks = await trio.to_thread.run_sync(lambda: chunker.chunk(task["name"], binary=binary, from_page=task["from_page"],
-                                to_page=task["to_page"], lang=task["language"], callback=progress_callback,
-                                kb_id=task["kb_id"], parser_config=task["parser_config"], tenant_id=task["tenant_id"]))
-        logging.info("Chunking({}) {}/{} done".format(timer() - st, task["location"], task["name"]))
-    except TaskCanceledException:
-        raise
-    except Exception as e:
-        progress_callback(-1, "Internal server error while chunking: %s" % str(e).replace("'", ""))
-        logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
-        raise
+        try:
+            async with chunk_limiter:
+                cks = await trio.to_thread.run_sync(lambda: chunker.chunk(task["name"], binary=binary, from_page=task["from_page"],
+                                    to_page=task["to_page"], lang=task["language"], callback=progress_callback,
+                                    kb_id=task["kb_id"], parser_config=task["parser_config"], tenant_id=task["tenant_id"]))
+            logging.info("Chunking({}) {}/{} done".format(timer() - st, task["location"], task["name"]))
+        except TaskCanceledException:
+            raise
+        except Exception as e:
+            progress_callback(-1, "Internal server error while chunking: %s" % str(e).replace("'", ""))
+            logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
+            raise
 
     docs = []
     doc = {
@@ -414,7 +454,8 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
 async def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
     chunks = []
     vctr_nm = "q_%d_vec"%vector_size
-    for d in settings.retrievaler.chunk_list(row["doc_id"], row["tenant_id"], [str(row["kb_id"])],
+    # paging stops at the default result window of Elasticsearch
+    for d in settings.retrievaler.chunk_list(row["doc_id"], row["tenant_id"], [str(row["kb_id"])], max_count=10000,
                                              fields=["content_with_weight", vctr_nm]):
         chunks.append((d["content_with_weight"], np.array(d[vctr_nm])))
 
@@ -424,10 +465,17 @@ async def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
         embd_mdl,
         row["parser_config"]["raptor"]["prompt"],
         row["parser_config"]["raptor"]["max_token"],
-        row["parser_config"]["raptor"]["threshold"]
+        row["parser_config"]["raptor"]["threshold"],
+        row["parser_config"]["raptor"].get("clustering", "gmm")
     )
+    # summaries stay valid as long as the prompt and the models producing them do
+    signature = xxhash.xxh64(json.dumps([row["parser_config"]["raptor"]["prompt"],
+                                         row["parser_config"]["raptor"]["max_token"],
+                                         chat_mdl.llm_name, embd_mdl.llm_name]).encode("utf-8")).hexdigest()
+    tree = await trio.to_thread.run_sync(lambda: load_raptor_tree(row["kb_id"], row["doc_id"], signature))
     original_length = len(chunks)
-    chunks = await raptor(chunks, row["parser_config"]["raptor"]["random_seed"], callback)
+    chunks = await raptor(chunks, row["parser_config"]["raptor"]["random_seed"], callback, tree)
+    await trio.to_thread.run_sync(lambda: save_raptor_tree(row["kb_id"], row["doc_id"], signature, raptor.tree))
     doc = {
         "doc_id": row["doc_id"],
         "kb_id": [str(row["kb_id"])],
@@ -612,6 +660,7 @@ async def report_status():
                 LAG_TASKS = int(group_info.get("lag", 0))
 
             current = copy.deepcopy(CURRENT_TASKS)
+            cache = storage_cache()
             heartbeat = json.dumps({
                 "name": CONSUMER_NAME,
                 "now": now.astimezone().isoformat(timespec="milliseconds"),
@@ -621,6 +670,8 @@ async def report_status():
                 "done": DONE_TASKS,
                 "failed": FAILED_TASKS,
                 "current": current,
+                "local_inference": batching.stats(),
+                "storage_cache": cache.stats() if cache else {},
             })
             REDIS_CONN.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
             logging.info(f"{CONSUMER_NAME} reported heartbeat: {heartbeat}")
@@ -0,0 +1,25 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# Entry script of the task executor, taking the same arguments as rag/svr/task_executor.py.
+# The worker processes of its pools run their parent's entry script again before any work:
+# everything is imported in the `__main__` block, which they skip.
+
+if __name__ == "__main__":
+    import trio
+
+    from rag.svr.task_executor import main
+
+    trio.run(main)
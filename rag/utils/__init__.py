@@ -16,6 +16,7 @@
 
 import os
 import re
+import sys
 import tiktoken
 from api.utils.file_utils import get_project_base_directory
 
@@ -31,6 +32,25 @@ def singleton(cls, *args, **kw):
     return _singleton
 
 
+def run_blocking(fn, *args, **kwargs):
+    """
+    fn(*args, **kwargs), on a native thread of the pool of gevent's hub when
+    the process is monkey-patched by gevent (API_SERVER_MODE=gevent) and this
+    is a greenlet, e.g. serving a connection. CPU-bound work, such as the
+    forward pass of a local model or tokenizing, would otherwise stall every
+    other connection. The pool is bounded, and `fn` must not wait on gevent's
+    primitives.
+    """
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is None or not monkey.is_module_patched("threading"):
+        return fn(*args, **kwargs)
+    import gevent
+    if not isinstance(gevent.getcurrent(), gevent.Greenlet):
+        # already on a native thread, e.g. one of the pool or one running trio for run_trio
+        return fn(*args, **kwargs)
+    return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+
+
 def rmSpace(txt):
     txt = re.sub(r"([^a-z0-9.,\)>]) +([^ ])", r"\1\2", txt, flags=re.IGNORECASE)
     return re.sub(r"([^ ]) +([^a-z0-9.,\(<])", r"\1\2", txt, flags=re.IGNORECASE)
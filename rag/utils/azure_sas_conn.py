@@ -60,6 +60,19 @@ class RAGFlowAzureSasBlob:
                 self.__open__()
                 time.sleep(1)
 
+    def put_file(self, bucket, fnm, file, size=-1):
+        """Upload from a readable file object in blocks, without holding it in memory."""
+        start = file.tell()
+        for _ in range(3):
+            try:
+                file.seek(start)
+                return self.conn.upload_blob(name=fnm, data=file, length=size if size >= 0 else None,
+                                             max_block_size=settings.STORAGE_PART_SIZE)
+            except Exception:
+                logging.exception(f"Fail put {bucket}/{fnm}")
+                self.__open__()
+                time.sleep(1)
+
     def rm(self, bucket, fnm):
         try:
             self.conn.delete_blob(fnm)
@@ -77,6 +90,17 @@ class RAGFlowAzureSasBlob:
                 time.sleep(1)
         return
 
+    def get_file(self, bucket, fnm, file):
+        """Stream the object into a writable file object. Returns the bytes written, None on failure."""
+        for _ in range(1):
+            try:
+                return self.conn.download_blob(fnm).readinto(file)
+            except Exception:
+                logging.exception(f"fail get {bucket}/{fnm}")
+                self.__open__()
+                time.sleep(1)
+        return
+
     def obj_exist(self, bucket, fnm):
         try:
             return self.conn.get_blob_client(fnm).exists()
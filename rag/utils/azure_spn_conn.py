@@ -68,6 +68,20 @@ class RAGFlowAzureSpnBlob:
                 self.__open__()
                 time.sleep(1)
 
+    def put_file(self, bucket, fnm, file, size=-1):
+        """Upload from a readable file object in chunks, without holding it in memory."""
+        start = file.tell()
+        for _ in range(3):
+            try:
+                file.seek(start)
+                client = self.conn.get_file_client(fnm)
+                return client.upload_data(file, length=size if size >= 0 else None, overwrite=True,
+                                          chunk_size=settings.STORAGE_PART_SIZE)
+            except Exception:
+                logging.exception(f"Fail put {bucket}/{fnm}")
+                self.__open__()
+                time.sleep(1)
+
     def rm(self, bucket, fnm):
         try:
             self.conn.delete_file(fnm)
@@ -86,6 +100,18 @@ class RAGFlowAzureSpnBlob:
                 time.sleep(1)
         return
 
+    def get_file(self, bucket, fnm, file):
+        """Stream the object into a writable file object. Returns the bytes written, None on failure."""
+        for _ in range(1):
+            try:
+                client = self.conn.get_file_client(fnm)
+                return client.download_file().readinto(file)
+            except Exception:
+                logging.exception(f"fail get {bucket}/{fnm}")
+                self.__open__()
+                time.sleep(1)
+        return
+
     def obj_exist(self, bucket, fnm):
         try:
             client = self.conn.get_file_client(fnm)
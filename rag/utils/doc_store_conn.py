@@ -208,6 +208,20 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def searchPages(self, selectFields: list[str], condition: dict, indexNames: str | list[str],
+                    knowledgebaseIds: list[str], pageSize: int = 1000):
+        """
+        Yield the results of `search`, page after page, until every document matching the condition was returned
+        """
+        offset = 0
+        while True:
+            res = self.search(selectFields, [], dict(condition), [], OrderByExpr().asc("id"), offset, pageSize,
+                              indexNames, knowledgebaseIds)
+            yield res
+            if len(self.getChunkIds(res)) < pageSize:
+                break
+            offset += pageSize
+
     @abstractmethod
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         """
@@ -229,6 +243,13 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    @abstractmethod
+    def updateBatch(self, rows: list[dict], indexName: str, knowledgebaseId: str) -> list[str]:
+        """
+        Set the given fields of a bulk of rows identified by their "id", leaving the other fields untouched
+        """
+        raise NotImplementedError("Not implemented")
+
     @abstractmethod
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         """
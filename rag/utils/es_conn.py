@@ -150,25 +150,7 @@ class ESConnection(DocStoreConnection):
         assert isinstance(indexNames, list) and len(indexNames) > 0
         assert "_id" not in condition
 
-        bqry = Q("bool", must=[])
-        condition["kb_id"] = knowledgebaseIds
-        for k, v in condition.items():
-            if k == "available_int":
-                if v == 0:
-                    bqry.filter.append(Q("range", available_int={"lt": 1}))
-                else:
-                    bqry.filter.append(
-                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
-                continue
-            if not v:
-                continue
-            if isinstance(v, list):
-                bqry.filter.append(Q("terms", **{k: v}))
-            elif isinstance(v, str) or isinstance(v, int):
-                bqry.filter.append(Q("term", **{k: v}))
-            else:
-                raise Exception(
-                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        bqry = self._filter_query(condition, knowledgebaseIds)
 
         s = Search()
         vector_similarity_weight = 0.5
@@ -257,6 +239,61 @@ class ESConnection(DocStoreConnection):
         logger.error("ESConnection.search timeout for 3 times!")
         raise Exception("ESConnection.search timeout.")
 
+    def _filter_query(self, condition: dict, knowledgebaseIds: list[str]):
+        bqry = Q("bool", must=[])
+        condition["kb_id"] = knowledgebaseIds
+        for k, v in condition.items():
+            if k == "available_int":
+                if v == 0:
+                    bqry.filter.append(Q("range", available_int={"lt": 1}))
+                else:
+                    bqry.filter.append(
+                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
+                continue
+            if not v:
+                continue
+            if isinstance(v, list):
+                bqry.filter.append(Q("terms", **{k: v}))
+            elif isinstance(v, str) or isinstance(v, int):
+                bqry.filter.append(Q("term", **{k: v}))
+            else:
+                raise Exception(
+                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        return bqry
+
+    def searchPages(self, selectFields: list[str], condition: dict, indexNames: str | list[str],
+                    knowledgebaseIds: list[str], pageSize: int = 1000):
+        """
+        from + size stops at the max_result_window of the index (10000 hits):
+        pages through a point in time with search_after instead.
+        """
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        assert "_id" not in condition
+        query = self._filter_query(dict(condition), knowledgebaseIds).to_dict()
+        pit = self.es.open_point_in_time(index=indexNames, keep_alive="5m")["id"]
+        try:
+            after = None
+            while True:
+                q = {"query": query, "size": pageSize, "sort": [{"_shard_doc": "asc"}],
+                     "pit": {"id": pit, "keep_alive": "5m"}, "_source": selectFields}
+                if after:
+                    q["search_after"] = after
+                res = self.es.search(body=q, timeout="600s", track_total_hits=False)
+                if str(res.get("timed_out", "")).lower() == "true":
+                    raise Exception("Es Timeout.")
+                pit = res.get("pit_id", pit)
+                hits = res["hits"]["hits"]
+                yield res
+                if len(hits) < pageSize:
+                    break
+                after = hits[-1]["sort"]
+        finally:
+            try:
+                self.es.close_point_in_time(body={"id": pit})
+            except Exception:
+                logger.exception("ESConnection.searchPages fails to close the point in time")
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
             try:
@@ -313,6 +350,38 @@ class ESConnection(DocStoreConnection):
                     continue
         return res
 
+    def updateBatch(self, rows: list[dict], indexName: str, knowledgebaseId: str) -> list[str]:
+        operations = []
+        for d in rows:
+            d_copy = copy.deepcopy(d)
+            meta_id = d_copy.pop("id")
+            operations.append(
+                {"update": {"_index": indexName, "_id": meta_id}})
+            operations.append({"doc": d_copy})
+
+        res = []
+        for _ in range(ATTEMPT_TIME):
+            try:
+                res = []
+                r = self.es.bulk(index=(indexName), operations=operations,
+                                 refresh=False, timeout="60s")
+                if re.search(r"False", str(r["errors"]), re.IGNORECASE):
+                    return res
+
+                for item in r["items"]:
+                    if "update" in item and "error" in item["update"]:
+                        res.append(str(item["update"]["_id"]) + ":" + str(item["update"]["error"]))
+                return res
+            except Exception as e:
+                res.append(str(e))
+                logger.warning("ESConnection.updateBatch got exception: " + str(e))
+                res = []
+                if re.search(r"(Timeout|time out)", str(e), re.IGNORECASE):
+                    res.append(str(e))
+                    time.sleep(3)
+                    continue
+        return res
+
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -552,6 +552,17 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         return True
 
+    def updateBatch(self, rows: list[dict], indexName: str, knowledgebaseId: str) -> list[str]:
+        res = []
+        for d in rows:
+            d_copy = copy.deepcopy(d)
+            chunkId = d_copy.pop("id")
+            try:
+                self.update({"id": chunkId}, d_copy, indexName, knowledgebaseId)
+            except Exception as e:
+                res.append(f"{chunkId}:{e}")
+        return res
+
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
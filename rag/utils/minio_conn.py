@@ -76,6 +76,24 @@ class RAGFlowMinio:
                 self.__open__()
                 time.sleep(1)
 
+    def put_file(self, bucket, fnm, file, size=-1):
+        """Upload from a readable file object in parts, without holding it in memory."""
+        start = file.tell()
+        for _ in range(3):
+            try:
+                if not self.conn.bucket_exists(bucket):
+                    self.conn.make_bucket(bucket)
+
+                file.seek(start)
+                r = self.conn.put_object(bucket, fnm, file, size,
+                                         part_size=settings.STORAGE_PART_SIZE
+                                         )
+                return r
+            except Exception:
+                logging.exception(f"Fail to put {bucket}/{fnm}:")
+                self.__open__()
+                time.sleep(1)
+
     def rm(self, bucket, fnm):
         try:
             self.conn.remove_object(bucket, fnm)
@@ -86,7 +104,31 @@ class RAGFlowMinio:
         for _ in range(1):
             try:
                 r = self.conn.get_object(bucket, filename)
-                return r.read()
+                try:
+                    return r.read()
+                finally:
+                    r.close()
+                    r.release_conn()
+            except Exception:
+                logging.exception(f"Fail to get {bucket}/{filename}")
+                self.__open__()
+                time.sleep(1)
+        return
+
+    def get_file(self, bucket, filename, file):
+        """Stream the object into a writable file object. Returns the bytes written, None on failure."""
+        for _ in range(1):
+            try:
+                r = self.conn.get_object(bucket, filename)
+                try:
+                    size = 0
+                    for chunk in r.stream(settings.STORAGE_PART_SIZE):
+                        file.write(chunk)
+                        size += len(chunk)
+                    return size
+                finally:
+                    r.close()
+                    r.release_conn()
             except Exception:
                 logging.exception(f"Fail to get {bucket}/{filename}")
                 self.__open__()
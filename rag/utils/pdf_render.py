@@ -0,0 +1,232 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Rasterization of PDF pages. pdfium, which pdfplumber renders with, is not
+thread-safe even across documents, so pages are rendered by a pool of
+worker processes, each with its own pdfium, and handed back through shared
+memory. Without workers, pages are rendered in-process under a lock that
+only pdfium calls take; pdfplumber's char extraction needs no lock at all.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
+
+import pypdfium2 as pdfium
+from PIL import Image
+
+from rag.settings import PDF_RENDER_WORKERS
+from rag.utils.process_pool import SpawnProcessPoolExecutor
+
+# serializes pdfium calls of the process
+PDFIUM_LOCK = threading.Lock()
+# documents of collected renderers, closed by the next renderer holding PDFIUM_LOCK:
+# left to their finalizers, they would be closed by pdfium without the lock
+_orphans = deque()
+# documents a worker keeps open between the pages it is asked for
+WORKER_DOCUMENTS = 4
+SHM_DIR = "/dev/shm"
+
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+
+def _executor(workers):
+    global _pool, _pool_size
+    if workers <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool_size != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = SpawnProcessPoolExecutor(max_workers=workers)
+            _pool_size = workers
+        return _pool
+
+
+def _close_orphans():
+    # with PDFIUM_LOCK held
+    while _orphans:
+        _orphans.popleft().close()
+
+
+def _render(pdf, index, resolution):
+    # the same call pdfplumber's Page.to_image makes
+    page = pdf[index]
+    try:
+        bitmap = page.render(scale=resolution / 72, no_smoothtext=True, no_smoothpath=True,
+                             no_smoothimage=True, prefer_bgrx=True)
+        return bitmap.to_pil().convert("RGB")
+    finally:
+        page.close()
+
+
+_documents = OrderedDict()
+
+
+def _document(key, path):
+    pdf = _documents.pop(key, None)
+    if pdf is None:
+        pdf = pdfium.PdfDocument(path)
+    _documents[key] = pdf
+    while len(_documents) > WORKER_DOCUMENTS:
+        _documents.popitem(last=False)[1].close()
+    return pdf
+
+
+def _shm_has_room(size):
+    # a full /dev/shm (64MB in a default Docker container) kills the writer with SIGBUS
+    try:
+        return shutil.disk_usage(SHM_DIR).free >= 2 * size
+    except OSError:
+        return False
+
+
+def _render_in_worker(key, path, index, resolution):
+    img = _render(_document(key, path), index, resolution)
+    data = img.tobytes()
+    if not _shm_has_room(len(data)):
+        return img.size, data
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    shm.close()
+    return img.size, shm.name
+
+
+def _count_in_worker(key, path):
+    return len(_document(key, path))
+
+
+def _image(size, data):
+    if not isinstance(data, str):
+        return Image.frombytes("RGB", size, data)
+    shm = shared_memory.SharedMemory(name=data)
+    try:
+        buf = shm.buf[:size[0] * size[1] * 3]
+        mapped = Image.frombuffer("RGB", size, buf, "raw", "RGB", 0, 1)
+        img = mapped.copy()
+        del mapped
+        buf.release()
+        return img
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+class PdfRenderer:
+    """
+    Renders the pages of one PDF, given as a path, bytes or a seekable file
+    object, at `resolution` DPI. With several `PDF_RENDER_WORKERS`, paths
+    and bytes are rendered by the worker pool, several pages of a document
+    at a time; file objects, like uploads whose thumbnail is needed, are
+    rendered in-process since copying them for the workers costs more than
+    rendering one page.
+    """
+
+    def __init__(self, source, workers=None):
+        workers = PDF_RENDER_WORKERS if workers is None else workers
+        self._pool = _executor(workers) if not hasattr(source, "read") else None
+        self._workers = workers
+        self._pdf = None
+        self._path = None
+        self._tmp = None
+        self._key = uuid.uuid4().hex
+        self._total = None
+        if self._pool is None:
+            with PDFIUM_LOCK:
+                _close_orphans()
+                self._pdf = pdfium.PdfDocument(source)
+        elif isinstance(source, str):
+            self._path = source
+        else:
+            fd, self._tmp = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, "wb") as f:
+                f.write(source)
+            self._path = self._tmp
+
+    def __len__(self):
+        if self._total is None:
+            if self._pool is None:
+                with PDFIUM_LOCK:
+                    self._total = len(self._pdf)
+            else:
+                self._total = self._pool.submit(_count_in_worker, self._key, self._path).result()
+        return self._total
+
+    def render(self, index, resolution):
+        return self.render_pages([index], resolution)[0]
+
+    def render_pages(self, indexes, resolution) -> list:
+        """Images of the pages at `indexes`, rendered in parallel by the workers."""
+        if self._pool is None:
+            images = []
+            for i in indexes:
+                with PDFIUM_LOCK:
+                    images.append(_render(self._pdf, i, resolution))
+            return images
+
+        # as many pages in flight as there are workers, which bounds the shared memory in use
+        images, futures = [], deque()
+        try:
+            for i in indexes:
+                futures.append(self._pool.submit(_render_in_worker, self._key, self._path, i, resolution))
+                if len(futures) >= self._workers:
+                    images.append(_image(*futures.popleft().result()))
+            while futures:
+                images.append(_image(*futures.popleft().result()))
+        finally:
+            for f in futures:
+                if not f.cancel():
+                    try:
+                        _image(*f.result())
+                    except Exception:
+                        pass
+        return images
+
+    def close(self):
+        if self._pdf is not None:
+            with PDFIUM_LOCK:
+                self._pdf.close()
+                _close_orphans()
+            self._pdf = None
+        self._remove_tmp()
+
+    def _remove_tmp(self):
+        if getattr(self, "_tmp", None):
+            try:
+                os.remove(self._tmp)
+            except OSError:
+                logging.exception(f"PdfRenderer fails to remove {self._tmp}")
+            self._tmp = None
+
+    def __del__(self):
+        # page images keep their renderer for re-rendering and don't always close it;
+        # PDFIUM_LOCK can't be taken here, the collection may run while this thread holds it
+        if getattr(self, "_pdf", None) is not None:
+            _orphans.append(self._pdf)
+            self._pdf = None
+        self._remove_tmp()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
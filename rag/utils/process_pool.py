@@ -0,0 +1,34 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Process pools for the CPU-bound work of the servers. Workers are spawned,
+since the servers run threads, which fork doesn't mix well with. A spawned
+child runs the entry script of its parent again, as `__mp_main__`, before
+the functions it is given: the task executor is therefore started from
+rag/svr/task_executor_entry.py, which imports nothing outside of its
+`__main__` block, rather than from rag/svr/task_executor.py, which sets up
+logging and imports every parser. Workers then only import the modules of
+the functions they run.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+class SpawnProcessPoolExecutor(ProcessPoolExecutor):
+
+    def __init__(self, max_workers=None, initializer=None, initargs=()):
+        super().__init__(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                         initializer=initializer, initargs=initargs)
@@ -142,6 +142,62 @@ class RedisDB:
             self.__open__()
         return None
 
+    def hset(self, key: str, field: str, value: str, exp=3600):
+        try:
+            pipeline = self.REDIS.pipeline(transaction=True)
+            pipeline.hset(key, field, value)
+            pipeline.expire(key, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.hset " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def hgetall(self, key: str):
+        try:
+            return self.REDIS.hgetall(key)
+        except Exception as e:
+            logging.warning("RedisDB.hgetall " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
+    def hincrby(self, key: str, field: str, amount: int):
+        try:
+            self.REDIS.hincrby(key, field, amount)
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.hincrby " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def hdel(self, key: str, field: str):
+        try:
+            self.REDIS.hdel(key, field)
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.hdel " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def rename(self, key: str, new_key: str):
+        try:
+            self.REDIS.rename(key, new_key)
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.rename " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def delete(self, key: str):
+        try:
+            self.REDIS.delete(key)
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.delete " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
     def zadd(self, key: str, member: str, score: float):
         try:
             self.REDIS.zadd(key, {member: score})
@@ -287,10 +343,15 @@ class RedisDistributedLock:
         else:
             self.lock_value = str(uuid.uuid4())
         self.timeout = timeout
-        self.lock = Lock(REDIS_CONN.REDIS, lock_key, timeout=timeout, blocking_timeout=blocking_timeout)
+        # the token isn't thread-local: async callers acquire, extend and release from different threads
+        self.lock = Lock(REDIS_CONN.REDIS, lock_key, timeout=timeout, blocking_timeout=blocking_timeout,
+                         thread_local=False)
 
     def acquire(self):
-        return self.lock.acquire()
+        return self.lock.acquire(token=self.lock_value)
+
+    def reacquire(self):
+        return self.lock.reacquire()
 
     def release(self):
         return self.lock.release()
@@ -16,9 +16,10 @@
 
 import logging
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 import time
-from io import BytesIO
+from io import BytesIO, SEEK_END
 from rag.utils import singleton
 from rag import settings
 
@@ -79,6 +80,11 @@ class RAGFlowS3:
     def list(self, bucket, dir, recursive=True):
         return []
 
+    @staticmethod
+    def _transfer_config():
+        return TransferConfig(multipart_threshold=settings.STORAGE_PART_SIZE,
+                              multipart_chunksize=settings.STORAGE_PART_SIZE)
+
     def put(self, bucket, fnm, binary):
         logging.debug(f"bucket name {bucket}; filename :{fnm}:")
         for _ in range(1):
@@ -94,6 +100,24 @@ class RAGFlowS3:
                 self.__open__()
                 time.sleep(1)
 
+    def put_file(self, bucket, fnm, file, size=-1):
+        """Upload from a readable file object in parts, without holding it in memory."""
+        logging.debug(f"bucket name {bucket}; filename :{fnm}:")
+        start = file.tell()
+        for _ in range(1):
+            try:
+                if not self.bucket_exists(bucket):
+                    self.conn.create_bucket(Bucket=bucket)
+                    logging.info(f"create bucket {bucket} ********")
+                file.seek(start)
+                r = self.conn.upload_fileobj(file, bucket, fnm, Config=self._transfer_config())
+
+                return r
+            except Exception:
+                logging.exception(f"Fail put {bucket}/{fnm}")
+                self.__open__()
+                time.sleep(1)
+
     def rm(self, bucket, fnm):
         try:
             self.conn.delete_object(Bucket=bucket, Key=fnm)
@@ -112,6 +136,19 @@ class RAGFlowS3:
                 time.sleep(1)
         return
 
+    def get_file(self, bucket, fnm, file):
+        """Stream the object into a writable file object. Returns the bytes written, None on failure."""
+        for _ in range(1):
+            try:
+                start = file.tell()
+                self.conn.download_fileobj(bucket, fnm, file, Config=self._transfer_config())
+                return file.seek(0, SEEK_END) - start
+            except Exception:
+                logging.exception(f"fail get {bucket}/{fnm}")
+                self.__open__()
+                time.sleep(1)
+        return
+
     def obj_exist(self, bucket, fnm):
         try:
 
@@ -0,0 +1,171 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from filelock import FileLock
+
+from rag import settings
+from rag.utils.storage_factory import STORAGE_IMPL
+
+
+class StorageCache:
+    """
+    Files of the object store kept on local disk, so that the tasks of one
+    document, run concurrently or one after the other by the executors of a
+    host, download it once. Contents are stored under their sha256 in
+    `blobs/`; `refs/` maps an object (bucket, name and version) to the
+    digest of its contents. The version must change with the contents, as a
+    name can be written again once its object is removed; objects are only
+    cached when given one. The object is downloaded by a single process at a
+    time, streamed to disk, and the least recently used blobs are removed
+    once they take more than `capacity` bytes.
+    """
+
+    def __init__(self, root=settings.STORAGE_CACHE_DIR, capacity=settings.STORAGE_CACHE_SIZE):
+        self.root = root
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._stats = {"hit": 0, "miss": 0}
+        for d in ("blobs", "refs", "tmp"):
+            os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    def _ref(self, bucket, name, version):
+        key = hashlib.sha256(f"{bucket}/{name}:{version}".encode("utf-8")).hexdigest()
+        return os.path.join(self.root, "refs", key)
+
+    def _blob(self, digest):
+        return os.path.join(self.root, "blobs", digest)
+
+    def get(self, bucket, name, version=None) -> bytes | None:
+        """Contents of the object, from the local disk if another task already fetched this version of it."""
+        if version is None:
+            return STORAGE_IMPL.get(bucket, name)
+        for _ in range(2):
+            path = self.path(bucket, name, version)
+            if path is None:
+                return None
+            try:
+                with open(path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                # evicted between the lookup and the read
+                continue
+        return STORAGE_IMPL.get(bucket, name)
+
+    def path(self, bucket, name, version) -> str | None:
+        """Local path of the object's contents, downloading them first if they aren't cached."""
+        ref = self._ref(bucket, name, version)
+        with FileLock(ref + ".lock"):
+            blob = self._lookup(ref)
+            if blob:
+                self._record(True)
+                return blob
+            blob = self._fetch(bucket, name)
+            if blob is None:
+                return None
+            self._write(ref, os.path.basename(blob))
+        self._record(False)
+        self._evict(keep=blob)
+        return blob
+
+    def _lookup(self, ref):
+        try:
+            with open(ref) as f:
+                digest = f.read().strip()
+            if not digest:
+                return None
+            blob = self._blob(digest)
+            os.utime(blob)
+            return blob
+        except FileNotFoundError:
+            return None
+
+    def _fetch(self, bucket, name):
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if STORAGE_IMPL.get_file(bucket, name, f) is None:
+                    return None
+            sha = hashlib.sha256()
+            with open(tmp, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(chunk)
+            blob = self._blob(sha.hexdigest())
+            if os.path.exists(blob):
+                os.utime(blob)
+            else:
+                os.replace(tmp, blob)
+            return blob
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _write(self, ref, digest):
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        with os.fdopen(fd, "w") as f:
+            f.write(digest)
+        os.replace(tmp, ref)
+
+    def _evict(self, keep):
+        blobs = []
+        for entry in os.scandir(os.path.join(self.root, "blobs")):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(b[1] for b in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self.capacity:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        if total > self.capacity:
+            logging.warning(f"StorageCache {self.root} holds {total} bytes, more than {self.capacity}")
+
+    def _record(self, hit):
+        with self._lock:
+            self._stats["hit" if hit else "miss"] += 1
+
+    def stats(self) -> dict:
+        """Lookups and hit rate, since the process started."""
+        with self._lock:
+            n = self._stats["hit"] + self._stats["miss"]
+            return {"lookups": n, "hit_rate": "{:.3f}".format(self._stats["hit"] / n if n else 0.0)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def storage_cache() -> StorageCache | None:
+    """The cache of this process, None if it is disabled."""
+    global _cache
+    if settings.STORAGE_CACHE_SIZE <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = StorageCache()
+        return _cache
@@ -0,0 +1,73 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import pytest
+
+from api.utils.api_utils import AnswerStreamEncoder
+
+ANSWERS = [
+    {"answer": "He", "reference": {}, "audio_binary": None},
+    {"answer": "Hello", "reference": {}, "audio_binary": None},
+    {"answer": "Hello world.", "reference": {}, "audio_binary": None},
+    # the final answer gets its citations inserted
+    {"answer": "Hello ##0$$ world.", "reference": {"chunks": [{"id": "c0"}]}, "audio_binary": None,
+     "prompt": "p", "created_at": 1.0},
+]
+
+
+def decode(events):
+    # what a client of stream_version 2 does
+    answer, answers = "", []
+    for event in events:
+        answer = event["answer"] if "answer" in event else answer + event.get("delta", "")
+        answers.append(answer)
+    return answers
+
+
+def test_version_1_sends_whole_answers():
+    encoder = AnswerStreamEncoder()
+    for ans in ANSWERS:
+        assert encoder.encode(dict(ans)) == ans
+    assert AnswerStreamEncoder(None).version == 1
+    assert AnswerStreamEncoder(1).encode({"answer": "a", "delta": "a"}) == {"answer": "a"}
+
+
+def test_version_2_sends_deltas():
+    encoder = AnswerStreamEncoder("2")
+    events = [encoder.encode(dict(ans)) for ans in ANSWERS]
+    assert events[:3] == [{"seq": 0, "delta": "He"}, {"seq": 1, "delta": "llo"}, {"seq": 2, "delta": " world."}]
+    assert events[3] == {"seq": 3, "answer": "Hello ##0$$ world.", "reference": {"chunks": [{"id": "c0"}]},
+                         "prompt": "p", "created_at": 1.0}
+    assert decode(events) == [ans["answer"] for ans in ANSWERS]
+
+
+def test_version_2_passes_the_deltas_of_producers():
+    encoder = AnswerStreamEncoder(2)
+    assert encoder.encode({"answer": "ab", "delta": "b"}) == {"seq": 0, "delta": "b"}
+    assert encoder.encode({"answer": "abc", "delta": "c"}) == {"seq": 1, "delta": "c"}
+    assert encoder.encode({"answer": "abc", "reference": {}}) == {"seq": 2, "delta": ""}
+
+
+def test_version_2_resends_an_answer_that_was_rewritten():
+    encoder = AnswerStreamEncoder(2)
+    events = [encoder.encode({"answer": a}) for a in ["Thinking", "Thinking...", "Answer", "Answer!", ""]]
+    assert [e.get("answer") for e in events] == [None, None, "Answer", None, ""]
+    assert decode(events) == ["Thinking", "Thinking...", "Answer", "Answer!", ""]
+
+
+@pytest.mark.parametrize("version", ["two", [2], {"v": 2}])
+def test_a_version_that_isnt_an_integer_is_rejected(version):
+    with pytest.raises(ValueError, match="stream_version"):
+        AnswerStreamEncoder(version)
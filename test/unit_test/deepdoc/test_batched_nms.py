@@ -0,0 +1,93 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import numpy as np
+import pytest
+
+from deepdoc.vision.operators import batched_nms, nms
+
+
+def iou_filter(boxes, scores, iou_threshold):
+    # the per-class filter Recognizer.postprocess ran before batched_nms
+    def compute_iou(box, boxes):
+        xmin = np.maximum(box[0], boxes[:, 0])
+        ymin = np.maximum(box[1], boxes[:, 1])
+        xmax = np.minimum(box[2], boxes[:, 2])
+        ymax = np.minimum(box[3], boxes[:, 3])
+        intersection_area = np.maximum(0, xmax - xmin) * np.maximum(0, ymax - ymin)
+        box_area = (box[2] - box[0]) * (box[3] - box[1])
+        boxes_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        return intersection_area / (box_area + boxes_area - intersection_area)
+
+    sorted_indices = np.argsort(scores)[::-1]
+    keep_boxes = []
+    while sorted_indices.size > 0:
+        box_id = sorted_indices[0]
+        keep_boxes.append(box_id)
+        ious = compute_iou(boxes[box_id, :], boxes[sorted_indices[1:], :])
+        sorted_indices = sorted_indices[np.where(ious < iou_threshold)[0] + 1]
+    return keep_boxes
+
+
+def per_class(suppress, boxes, scores, class_ids, iou_thresh):
+    indices = []
+    for class_id in np.unique(class_ids):
+        class_indices = np.where(class_ids == class_id)[0]
+        keep = suppress(boxes[class_indices, :], scores[class_indices], iou_thresh)
+        indices.extend(class_indices[keep])
+    return [int(i) for i in indices]
+
+
+def random_boxes(rng, n, n_classes):
+    xy = rng.uniform(0, 800, size=(n, 2))
+    wh = rng.uniform(5, 200, size=(n, 2))
+    boxes = np.concatenate([xy, xy + wh], axis=1).astype(np.float32)
+    # near duplicates, so that suppression happens
+    boxes[n // 2:] = boxes[:n - n // 2] + rng.normal(0, 4, size=(n - n // 2, 4)).astype(np.float32)
+    scores = rng.permutation(n).astype(np.float32) / n
+    class_ids = rng.integers(0, n_classes, size=n)
+    return boxes, scores, class_ids
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_same_boxes_as_per_class_nms(seed):
+    rng = np.random.default_rng(seed)
+    boxes, scores, class_ids = random_boxes(rng, 120, 5)
+    assert batched_nms(boxes, scores, class_ids, 0.45, pixel_offset=1) == per_class(nms, boxes, scores, class_ids, 0.45)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_same_boxes_as_per_class_iou_filter(seed):
+    rng = np.random.default_rng(seed)
+    boxes, scores, class_ids = random_boxes(rng, 120, 5)
+    assert batched_nms(boxes, scores, class_ids, 0.2, strict=True) == \
+        per_class(iou_filter, boxes, scores, class_ids, 0.2)
+
+
+def test_threshold_comparison():
+    # two boxes overlapping at an IoU of exactly 1/3
+    boxes = np.array([[0, 0, 2, 1], [1, 0, 3, 1]], dtype=np.float32)
+    scores = np.array([0.9, 0.8], dtype=np.float32)
+    class_ids = np.array([0, 0])
+    assert batched_nms(boxes, scores, class_ids, 1 / 3) == [0, 1]
+    assert batched_nms(boxes, scores, class_ids, 1 / 3, strict=True) == [0]
+
+
+def test_classes_do_not_suppress_each_other():
+    boxes = np.array([[0, 0, 10, 10], [0, 0, 10, 10], [0, 0, 10, 10]], dtype=np.float32)
+    scores = np.array([0.5, 0.9, 0.7], dtype=np.float32)
+    class_ids = np.array([1, 0, 1])
+    assert batched_nms(boxes, scores, class_ids, 0.5) == [1, 2]
+    assert batched_nms(np.zeros((0, 4)), np.zeros(0), np.zeros(0), 0.5) == []
@@ -0,0 +1,152 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+from functools import cmp_to_key
+
+import pytest
+
+from deepdoc.vision.geometry import BoxIndex, cluster_lines, sort_by_rows
+
+
+def overlapped_area(a, b, ratio=True):
+    # Recognizer.overlapped_area
+    if b["x0"] > a["x1"] or b["x1"] < a["x0"] or b["bottom"] < a["top"] or b["top"] > a["bottom"]:
+        return 0
+    w = min(b["x1"], a["x1"]) - max(b["x0"], a["x0"])
+    h = min(b["bottom"], a["bottom"]) - max(b["top"], a["top"])
+    ov = w * h if a["x1"] - a["x0"] != 0 and a["bottom"] - a["top"] != 0 else 0
+    if ov > 0 and ratio:
+        ov /= (a["x1"] - a["x0"]) * (a["bottom"] - a["top"])
+    return ov
+
+
+def find_overlapped(box, boxes):
+    # the linear scan Recognizer.find_overlapped did with naive=True
+    best_i, best = None, 0
+    for i, b in enumerate(boxes):
+        ov = overlapped_area(b, box)
+        if ov <= best:
+            continue
+        best_i, best = i, ov
+    return best_i
+
+
+def find_overlapped_with_threashold(box, boxes, thr):
+    best_i, best, _best = None, thr, 0
+    for i, b in enumerate(boxes):
+        ov, _ov = overlapped_area(box, b), overlapped_area(b, box)
+        if (ov, _ov) < (best, _best):
+            continue
+        best_i, best, _best = i, ov, _ov
+    return best_i
+
+
+def random_boxes(rng, n, page_height=1000):
+    boxes = []
+    for _ in range(n):
+        x0, top = rng.uniform(0, 500), rng.uniform(0, page_height)
+        boxes.append({"x0": x0, "x1": x0 + rng.uniform(1, 200), "top": top, "bottom": top + rng.uniform(1, 60)})
+    return boxes
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_box_index_matches_linear_scans(seed):
+    rng = random.Random(seed)
+    boxes = random_boxes(rng, 200)
+    index = BoxIndex(boxes)
+    for box in random_boxes(rng, 100):
+        assert index.find_overlapped(box) == find_overlapped(box, boxes)
+        assert index.find_overlapped_with_threashold(box, 0.3) == find_overlapped_with_threashold(box, boxes, 0.3)
+        covered = sum(overlapped_area(b, box, False) for b in boxes)
+        assert index.covered_area(box) == pytest.approx(covered)
+
+
+def test_box_index_with_boxes_taller_than_the_page():
+    boxes = [{"x0": 0, "x1": 10, "top": 0, "bottom": 5}, {"x0": 0, "x1": 10, "top": 100, "bottom": 105}]
+    index = BoxIndex(boxes)
+    tall = {"x0": 0, "x1": 10, "top": -1e6, "bottom": 1e6}
+    assert list(index.candidates(tall)) == [0, 1]
+    assert index.find_overlapped({"x0": 20, "x1": 30, "top": 0, "bottom": 5}) is None
+    assert BoxIndex([]).find_overlapped(tall) is None
+
+
+def test_cluster_lines_groups_by_threshold():
+    tops = [10, 52, 11, 50, 12.5]
+    x0s = [30, 5, 10, 40, 20]
+    order = cluster_lines(tops, x0s, 3)
+    # two lines, around 11 and 51, each read left to right
+    assert list(order) == [2, 4, 0, 1, 3]
+
+
+def test_cluster_lines_is_a_total_order():
+    rng = random.Random(0)
+    tops = [rng.choice([0, 1, 2, 3, 10, 11, 12]) + rng.random() for _ in range(300)]
+    x0s = [rng.uniform(0, 500) for _ in range(300)]
+    order = list(cluster_lines(tops, x0s, 1.5))
+    shuffled = list(range(300))
+    rng.shuffle(shuffled)
+    # the same boxes in another order end up in the same reading order
+    again = cluster_lines([tops[i] for i in shuffled], [x0s[i] for i in shuffled], 1.5)
+    assert [shuffled[i] for i in again] == order
+
+
+def test_cluster_lines_doesnt_chain_staggered_boxes():
+    # each box is within the threshold of the previous one, not of the first one of its line
+    tops = [0, 4, 8, 12, 16, 20]
+    x0s = [50, 40, 30, 20, 10, 0]
+    assert list(cluster_lines(tops, x0s, 5)) == [1, 0, 3, 2, 5, 4]
+
+
+def sort_Y_firstly(arr, threashold):
+    # Recognizer.sort_Y_firstly as it was, a pairwise comparator with a threshold
+    def cmp(c1, c2):
+        diff = c1["top"] - c2["top"]
+        if abs(diff) < threashold:
+            diff = c1["x0"] - c2["x0"]
+        return diff
+    return sorted(arr, key=cmp_to_key(cmp))
+
+
+def random_layouts(rng):
+    # rows of side by side layouts, their tops a few points apart
+    rows = []
+    for _ in range(rng.randint(1, 12)):
+        height = rng.uniform(15, 200)
+        x0s = sorted(rng.sample(range(0, 500, 20), rng.randint(1, 3)))
+        rows.append([(x0, height * rng.uniform(0.5, 1)) for x0 in x0s])
+    heights = [h for row in rows for _, h in row]
+    thr = sum(heights) / len(heights) / 2
+    layouts, top = [], rng.uniform(0, 50)
+    for row in rows:
+        for x0, h in row:
+            t = top + rng.uniform(0, 3)
+            layouts.append({"x0": x0, "x1": x0 + 20, "top": t, "bottom": t + h})
+        top += max(max(h for _, h in row), thr) + 3 + rng.uniform(0, 30)
+    rng.shuffle(layouts)
+    return layouts, thr
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_layouts_are_ordered_as_before(seed):
+    # layout_recognizer sorts the layouts of a page with half their mean height as threshold
+    layouts, thr = random_layouts(random.Random(seed))
+    assert sort_by_rows(layouts, thr) == sort_Y_firstly(layouts, thr)
+
+
+def test_sort_by_rows():
+    boxes = [{"top": 20, "x0": 5}, {"top": 0, "x0": 50}, {"top": 1, "x0": 10}]
+    assert sort_by_rows(boxes, 2) == [boxes[2], boxes[1], boxes[0]]
+    assert cluster_lines([], [], 1).tolist() == []
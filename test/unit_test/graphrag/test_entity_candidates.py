@@ -0,0 +1,77 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+import string
+
+from graphrag.entity_candidates import MinHashLSH, candidate_pairs, char_ngrams, normalize_name
+
+
+def random_name(rng, length=16):
+    return "".join(rng.choice(string.ascii_uppercase) for _ in range(length))
+
+
+def with_typo(rng, name):
+    i = rng.randrange(len(name))
+    return name[:i] + rng.choice(string.ascii_uppercase.replace(name[i], "")) + name[i + 1:]
+
+
+def test_normalize_name_and_ngrams():
+    assert normalize_name("Microsoft Corp.") == "microsoftcorp"
+    assert char_ngrams("A.B-C") == {"abc"}
+    assert char_ngrams("Abcd") == {"abc", "bcd"}
+    assert char_ngrams("北京大学") == {"北京", "京大", "大学"}
+    assert char_ngrams("--") == set()
+
+
+def test_minhash_is_deterministic():
+    grams = char_ngrams("ARTIFICIAL INTELLIGENCE")
+    assert (MinHashLSH().signature(grams) == MinHashLSH().signature(grams)).all()
+    assert len(MinHashLSH(num_perm=64, bands=16).band_keys(grams)) == 16
+
+
+def test_names_with_the_same_key_are_paired():
+    pairs = candidate_pairs(["Microsoft Corp", "APPLE", "microsoft corp.", "Apple", "--"])
+    assert ("Microsoft Corp", "microsoft corp.") in pairs
+    assert ("APPLE", "Apple") in pairs
+    assert all("--" not in p for p in pairs)
+
+
+def test_near_duplicates_are_found_among_unrelated_names():
+    rng = random.Random(0)
+    names = [random_name(rng) for _ in range(500)]
+    typos = {name: with_typo(rng, name) for name in names[:100]}
+    pairs = set(candidate_pairs(names + list(typos.values())))
+
+    found = sum((a, b) in pairs for a, b in typos.items())
+    assert found >= 90
+    # unrelated random names seldom share a band: far fewer pairs than all of them
+    assert len(pairs) < 5 * len(typos)
+
+
+def test_oversized_blocks_are_windowed():
+    names = ["Entity"] * 200
+    pairs = candidate_pairs(names, max_block_size=8)
+    assert len(pairs) == sum(min(7, 199 - i) for i in range(200))
+
+
+def test_nearest_neighbours_by_embedding_are_paired():
+    names = ["United States", "USA", "Canada"]
+    vectors = [[1.0, 0.1, 0.0], [0.98, 0.12, 0.0], [0.0, 0.0, 1.0]]
+    assert ("United States", "USA") not in candidate_pairs(names)
+    pairs = candidate_pairs(names, vectors=vectors)
+    assert ("United States", "USA") in pairs
+    assert all("Canada" not in p for p in pairs)
+    assert candidate_pairs(names, vectors=[None, vectors[1], None]) == candidate_pairs(names)
@@ -0,0 +1,123 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+
+import networkx as nx
+import pytest
+
+from graphrag.graph_analytics import changed_ranks, graph_view, n_hop_neighbourhood, n_hop_paths, pagerank
+
+
+def random_graph(seed, n=200, p=0.03):
+    rng = random.Random(seed)
+    graph = nx.gnp_random_graph(n, p, seed=seed)
+    for f, t in graph.edges():
+        graph.edges[f, t]["weight"] = rng.randint(1, 10)
+    # isolated nodes are the dangling ones
+    graph.add_nodes_from(range(n, n + 5))
+    return graph
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pagerank_matches_networkx(seed):
+    graph = random_graph(seed)
+    ranks = pagerank(graph)
+    expected = nx.pagerank(graph, weight="weight")
+    assert ranks.keys() == expected.keys()
+    for n, r in expected.items():
+        assert ranks[n] == pytest.approx(r, abs=1e-5)
+    assert sum(ranks.values()) == pytest.approx(1.0)
+
+
+def test_pagerank_of_a_directed_graph():
+    graph = nx.gnp_random_graph(100, 0.05, seed=7, directed=True)
+    ranks = pagerank(graph)
+    for n, r in nx.pagerank(graph).items():
+        assert ranks[n] == pytest.approx(r, abs=1e-5)
+
+
+def test_pagerank_warm_start_after_a_delta():
+    graph = random_graph(0)
+    previous = pagerank(graph)
+    graph.add_edge(0, 300, weight=3)
+    graph.add_edge(300, 301, weight=1)
+    ranks = pagerank(graph, nstart=previous)
+    # it stops as the cold start does, once an iteration moves the ranks by less than N * tol,
+    # which is within alpha / (1 - alpha) times that of the fixed point
+    exact = nx.pagerank(graph, weight="weight", tol=1e-12)
+    assert sum(abs(ranks[n] - r) for n, r in exact.items()) < 0.85 / 0.15 * len(graph) * 1e-6
+    assert {300, 301} <= changed_ranks(ranks, previous).keys()
+
+
+def test_pagerank_of_an_empty_graph():
+    assert pagerank(nx.Graph()) == {}
+
+
+def test_changed_ranks():
+    assert changed_ranks({"a": 1.0, "b": 2.0, "c": 3.0}, {"a": 1.001, "b": 1.0}) == {"b": 2.0, "c": 3.0}
+
+
+def test_n_hop_paths():
+    graph = nx.Graph()
+    graph.add_edge("a", "b", weight=1)
+    graph.add_edge("b", "c", weight=2)
+    graph.add_edge("a", "c", weight=3)
+    paths = sorted((p["path"], p["weights"]) for p in n_hop_paths(graph, "a", 2))
+    assert paths == [(("a", "b", "c"), [1, 2]), (("a", "c", "b"), [3, 2])]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n_hop", [1, 2, 3])
+def test_n_hop_neighbourhood_covers_the_changed_paths(seed, n_hop):
+    graph = random_graph(seed, n=120)
+    rng = random.Random(seed)
+    # a subgraph merged in: new edges, and new weights for some of the existing ones
+    subgraph = nx.Graph()
+    for _ in range(4):
+        f, t = rng.randrange(130), rng.randrange(130)
+        if f != t:
+            subgraph.add_edge(f, t, weight=rng.randint(1, 10))
+    merged = nx.compose(graph, subgraph)
+
+    reached = n_hop_neighbourhood(merged, subgraph.nodes(), n_hop)
+    assert set(subgraph.nodes()) <= reached
+    for n in graph:
+        if n not in reached:
+            assert n_hop_paths(merged, n, n_hop) == n_hop_paths(graph, n, n_hop)
+    assert n_hop_neighbourhood(merged, ["missing"], n_hop) == set()
+
+
+def test_graph_view_is_what_the_knowledge_graph_view_showed():
+    graph = random_graph(3, n=400, p=0.05)
+    graph.add_edge(1, 1, weight=100)
+    for n, r in pagerank(graph).items():
+        graph.nodes[n]["pagerank"] = r
+        graph.nodes[n]["entity_type"] = "T"
+
+    # how kb_app cut the node-link data of the whole graph
+    full = nx.node_link_data(graph, edges="edges")
+    nodes = sorted(full["nodes"], key=lambda x: x.get("pagerank", 0), reverse=True)[:256]
+    ids = {o["id"] for o in nodes}
+    edges = [o for o in full["edges"] if o["source"] != o["target"] and o["source"] in ids and o["target"] in ids]
+    edges = sorted(edges, key=lambda x: x.get("weight", 0), reverse=True)[:128]
+
+    view = graph_view(graph)
+    assert view["nodes"] == nodes
+    assert sorted(e["weight"] for e in view["edges"]) == sorted(e["weight"] for e in edges)
+    assert all(e["source"] in ids and e["target"] in ids and e["source"] != e["target"] for e in view["edges"])
+    assert (view["node_count"], view["edge_count"]) == (405, graph.number_of_edges())
+    # still node-link data
+    assert nx.node_link_graph(view, edges="edges").number_of_nodes() == 256
@@ -0,0 +1,98 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rag.llm.batching import BatchScheduler
+
+
+class Model:
+    """Upper-cases its inputs, recording the batches it is given."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, kind, items):
+        with self.lock:
+            self.batches.append((kind, list(items)))
+        time.sleep(self.delay)
+        return [f"{kind}:{item.upper()}" for item in items]
+
+
+def test_results_are_aligned_with_the_inputs_of_each_call():
+    model = Model(delay=0.005)
+    scheduler = BatchScheduler("test", model, max_tokens=400, max_size=16, max_wait=0.01)
+    rng = random.Random(0)
+    calls = [[f"t{c}i{i}" + "x" * rng.randrange(20) for i in range(rng.randrange(1, 6))] for c in range(64)]
+
+    def call(c):
+        kind = "query" if c % 3 == 0 else "doc"
+        return kind, scheduler.map(kind, calls[c], [len(t) for t in calls[c]])
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(call, range(len(calls))))
+    for items, (kind, res) in zip(calls, results):
+        assert res == [f"{kind}:{item.upper()}" for item in items]
+
+    # concurrent calls share batches, each of one kind and within the limits
+    assert len(model.batches) < len(calls)
+    kinds = {item: kind for items, (kind, _) in zip(calls, results) for item in items}
+    for kind, items in model.batches:
+        assert all(kinds[item] == kind for item in items)
+        assert len(items) <= 16
+        assert len(items) * max(len(t) for t in items) <= 400
+    assert scheduler.stats()["queue"] == 0
+
+
+def test_inputs_of_similar_length_are_batched_together():
+    model = Model()
+    scheduler = BatchScheduler("test", model, max_tokens=202, max_size=8, max_wait=0.5)
+    items = ["a", "b" * 100, "cc", "d" * 101]
+    assert scheduler.map("doc", items, [len(i) for i in items]) == ["doc:" + i.upper() for i in items]
+    assert [b for _, b in model.batches] == [["a", "cc"], ["b" * 100, "d" * 101]]
+
+
+def test_a_partial_batch_runs_after_max_wait():
+    model = Model()
+    scheduler = BatchScheduler("test", model, max_tokens=1000, max_size=64, max_wait=0.05)
+    start = time.time()
+    assert scheduler.map("doc", ["a"], [1]) == ["doc:A"]
+    assert 0.04 <= time.time() - start < 1
+    # an input longer than max_tokens still runs, alone
+    assert scheduler.map("doc", ["x" * 2000], [2000]) == ["doc:" + "X" * 2000]
+
+
+def test_failures_reach_the_callers():
+    def run(kind, items):
+        if "boom" in items:
+            raise RuntimeError("boom")
+        if "short" in items:
+            return []
+        return items
+
+    scheduler = BatchScheduler("test", run, max_tokens=1000, max_size=64, max_wait=0.01)
+    with pytest.raises(RuntimeError):
+        scheduler.map("doc", ["boom"], [4])
+    with pytest.raises(ValueError):
+        scheduler.map("doc", ["short"], [5])
+    # the worker carries on
+    assert scheduler.map("doc", ["ok"], [2]) == ["ok"]
@@ -0,0 +1,99 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from rag import clustering
+from rag.clustering import BICSearch, _coarse_grid, cluster_embeddings
+
+
+def blobs(n_centers, per_center=40, dim=4, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(-20, 20, (n_centers, dim))
+    return np.vstack([c + rng.normal(0, 0.5, (per_center, dim)) for c in centers])
+
+
+def exhaustive(embeddings, max_clusters, random_state, covariance_type="full"):
+    # the search RAPTOR did before BICSearch
+    max_clusters = min(max_clusters, len(embeddings))
+    ns = np.arange(1, max_clusters)
+    bics = [clustering._bic(embeddings, n, random_state, covariance_type) for n in ns]
+    return int(ns[np.argmin(bics)])
+
+
+def test_coarse_grid():
+    assert _coarse_grid(3) == [1, 2]
+    assert _coarse_grid(10) == [1, 2, 4, 8, 9]
+    assert _coarse_grid(64) == [1, 2, 4, 8, 16, 32, 63]
+
+
+@pytest.mark.parametrize("n_centers", [2, 3, 5, 7])
+def test_bic_search_matches_the_exhaustive_search(n_centers):
+    embeddings = blobs(n_centers, seed=n_centers)
+    assert BICSearch()(embeddings, 16, 224) == exhaustive(embeddings, 16, 224) == n_centers
+
+
+def test_bic_search_fits_fewer_mixtures(monkeypatch):
+    fitted = []
+    bic = clustering._bic
+
+    def counting_bic(embeddings, n, random_state, covariance_type):
+        fitted.append(n)
+        return bic(embeddings, n, random_state, covariance_type)
+
+    monkeypatch.setattr(clustering, "_bic", counting_bic)
+    assert BICSearch(covariance_type="spherical")(blobs(3), 64, 224) == 3
+    assert len(fitted) == len(set(fitted)) < 20
+
+
+def test_bic_search_with_few_embeddings():
+    embeddings = blobs(2, per_center=1)
+    assert BICSearch()(embeddings, 10, 224) == 1
+    assert BICSearch()(blobs(2), 2, 224) == 1
+
+
+def test_bic_search_on_a_pool_finds_the_same_number():
+    embeddings = blobs(4, seed=4)
+    assert BICSearch(workers=2)(embeddings, 16, 224) == BICSearch()(embeddings, 16, 224) == 4
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        f = Future()
+        f.set_result(fn(*args))
+        return f
+
+
+@pytest.mark.parametrize("workers", [1, 2, 3, 4, 8])
+def test_bic_search_doesnt_depend_on_the_workers(monkeypatch, workers):
+    # worse at 4 and 8, so the search stops there and misses the dip at 16
+    curve = {1: 10.0, 2: 5.0, 3: 6.0, 4: 7.0, 8: 8.0, 16: 1.0, 32: 9.0, 63: 9.0}
+    monkeypatch.setattr(clustering, "_bic", lambda embeddings, n, random_state, covariance_type: curve.get(n, 20.0))
+    monkeypatch.setattr(clustering, "_executor", lambda workers: InlineExecutor() if workers > 1 else None)
+    assert BICSearch(workers=workers)(blobs(2), 64, 224) == 2
+
+
+@pytest.mark.parametrize("method", ["gmm", "spherical", "minibatch"])
+def test_cluster_embeddings(method):
+    embeddings = blobs(3, seed=3)
+    n_clusters, labels = cluster_embeddings(embeddings, 10, 224, 0.1, method=method)
+    assert n_clusters == 3
+    assert len(labels) == len(embeddings)
+    # the points of a blob share their label
+    assert len({int(lbl) for lbl in labels[:40]}) == 1
+    assert len({int(lbl) for lbl in labels}) == 3
@@ -0,0 +1,59 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+
+# an entry script laid out as rag/svr/task_executor_entry.py, starting a server module
+ENTRY = """
+if __name__ == "__main__":
+    import server
+    server.main()
+"""
+
+SERVER = """
+import os
+import threading
+import time
+
+from rag.utils.process_pool import SpawnProcessPoolExecutor
+
+print("server imported by", os.getpid(), flush=True)
+
+
+def main():
+    # a thread of the server, running while the workers start
+    threading.Thread(target=time.sleep, args=(2,), daemon=True).start()
+    with SpawnProcessPoolExecutor(max_workers=3) as pool:
+        list(pool.map(time.sleep, [0.5] * 3))
+        pids = {pool.submit(os.getpid).result() for _ in range(9)}
+    assert os.getpid() not in pids
+    print("workers", len(pids), flush=True)
+"""
+
+
+def test_workers_dont_import_the_server(tmp_path):
+    (tmp_path / "entry.py").write_text(ENTRY)
+    (tmp_path / "server.py").write_text(SERVER)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+    out = subprocess.run([sys.executable, str(tmp_path / "entry.py")], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    lines = out.stdout.splitlines()
+    assert len([line for line in lines if line.startswith("server imported by")]) == 1
+    assert lines[-1] != "workers 1" and lines[-1].startswith("workers ")
@@ -0,0 +1,99 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+import types
+
+import pytest
+from valkey.exceptions import LockNotOwnedError
+from valkey.lock import Lock
+
+from rag.utils import redis_conn
+from rag.utils.redis_conn import RedisDistributedLock
+
+
+class FakeValkey:
+    """The commands and scripts of valkey's Lock, over a dict."""
+
+    class Encoder:
+        def encode(self, value):
+            return value.encode() if isinstance(value, str) else value
+
+    def __init__(self):
+        self.data = {}
+
+    def get_encoder(self):
+        return self.Encoder()
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value, nx=False, px=None):
+        if nx and name in self.data:
+            return None
+        self.data[name] = value
+        return True
+
+    class Script:
+        def __init__(self, script):
+            self.script = script
+
+        def __call__(self, keys, args, client):
+            owned = client.data.get(keys[0]) == args[0]
+            if owned and self.script == Lock.LUA_RELEASE_SCRIPT:
+                del client.data[keys[0]]
+            return int(owned)
+
+    def register_script(self, script):
+        return self.Script(script)
+
+
+def in_thread(fn):
+    res = []
+    t = threading.Thread(target=lambda: res.append(fn()))
+    t.start()
+    t.join()
+    return res[0]
+
+
+@pytest.fixture
+def valkey(monkeypatch):
+    client = FakeValkey()
+    monkeypatch.setattr(redis_conn, "REDIS_CONN", types.SimpleNamespace(REDIS=client))
+    return client
+
+
+def test_lock_is_released_from_another_thread(valkey):
+    lock = RedisDistributedLock("merge_lock", timeout=60, blocking_timeout=0)
+    assert in_thread(lock.acquire)
+    assert valkey.data["merge_lock"] == lock.lock_value.encode()
+    assert not RedisDistributedLock("merge_lock", timeout=60, blocking_timeout=0).acquire()
+
+    assert in_thread(lock.reacquire)
+    lock.release()
+    assert "merge_lock" not in valkey.data
+    assert in_thread(RedisDistributedLock("merge_lock", timeout=60, blocking_timeout=0).acquire)
+
+
+def test_lock_taken_over_is_not_released(valkey):
+    lock = RedisDistributedLock("merge_lock", timeout=60, blocking_timeout=0)
+    assert lock.acquire()
+    # expired and taken by another holder
+    valkey.data["merge_lock"] = b"other"
+    with pytest.raises(LockNotOwnedError):
+        lock.reacquire()
+    with pytest.raises(LockNotOwnedError):
+        lock.release()
+    assert valkey.data["merge_lock"] == b"other"
@@ -0,0 +1,79 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import subprocess
+import sys
+
+import pytest
+
+from rag.utils import run_blocking
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+
+# an API server in gevent mode: a connection busy on the CPU while another one ticks
+SERVER = """
+from gevent import monkey
+monkey.patch_all()
+
+import time
+
+import gevent
+
+from rag.utils import run_blocking
+
+
+def cpu():
+    start = time.time()
+    while time.time() - start < 0.5:
+        sum(range(1000))
+    return 42
+
+
+ticks = []
+
+
+def tick():
+    for _ in range(20):
+        ticks.append(time.time())
+        gevent.sleep(0.02)
+
+
+def serve():
+    ticker = gevent.spawn(tick)
+    gevent.sleep(0)
+    assert run_blocking(cpu) == 42
+    ticker.join()
+    print("max gap", max(b - a for a, b in zip(ticks, ticks[1:])), flush=True)
+    # from a native thread of the pool, it just runs
+    assert gevent.get_hub().threadpool.apply(run_blocking, (cpu,)) == 42
+
+
+gevent.spawn(serve).get()
+"""
+
+
+def test_run_blocking_without_gevent():
+    assert run_blocking(lambda a, b=0: a + b, 1, b=2) == 3
+
+
+def test_run_blocking_doesnt_stall_the_hub(tmp_path):
+    pytest.importorskip("gevent")
+    (tmp_path / "server.py").write_text(SERVER)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+    out = subprocess.run([sys.executable, str(tmp_path / "server.py")], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    assert float(out.stdout.split()[-1]) < 0.25
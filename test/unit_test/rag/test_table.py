@@ -0,0 +1,99 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import math
+import random
+import re
+
+import pytest
+
+from rag.app.table import column_data_type, trans_bool, trans_datatime
+
+
+def column_data_type_by_value(arr):
+    # column_data_type as it was, matching and converting value by value
+    arr = list(arr)
+    counts = {"int": 0, "float": 0, "text": 0, "datetime": 0, "bool": 0}
+    trans = {t: f for f, t in
+             [(int, "int"), (float, "float"), (trans_datatime, "datetime"), (trans_bool, "bool"), (str, "text")]}
+    for a in arr:
+        if a is None:
+            continue
+        if re.match(r"[+-]?[0-9]{,19}(\.0+)?$", str(a).replace("%%", "")):
+            counts["int"] += 1
+        elif re.match(r"[+-]?[0-9.]{,19}$", str(a).replace("%%", "")):
+            counts["float"] += 1
+        elif re.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", str(a), flags=re.IGNORECASE):
+            counts["bool"] += 1
+        elif trans_datatime(str(a)):
+            counts["datetime"] += 1
+        else:
+            counts["text"] += 1
+    counts = sorted(counts.items(), key=lambda x: x[1] * -1)
+    ty = counts[0][0]
+    for i in range(len(arr)):
+        if arr[i] is None:
+            continue
+        try:
+            arr[i] = trans[ty](str(arr[i]))
+        except Exception:
+            arr[i] = None
+    return arr, ty
+
+
+VALUES = [
+    lambda rng: rng.randint(-10 ** 6, 10 ** 6),
+    lambda rng: str(rng.randint(0, 999)),
+    lambda rng: f"{rng.randint(0, 99)}.0",
+    lambda rng: round(rng.uniform(-100, 100), 3),
+    lambda rng: f"{rng.randint(0, 99)}%%",
+    lambda rng: "1.2.3",
+    lambda rng: "",
+    lambda rng: rng.choice(["yes", "No", "TRUE", "false", "是", "否", "√", "×", "*"]),
+    lambda rng: f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+    lambda rng: rng.choice(["Jan 5 2021", "12/31/1999 10:00", "2020年"]),
+    lambda rng: rng.choice(["apple", "北京", "n/a", "foo bar", "1e5", "0x1F"]),
+    lambda rng: float("nan"),
+    lambda rng: None,
+]
+
+
+def same(a, b):
+    return a == b or (isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b))
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_column_data_type_matches_the_value_by_value_version(seed):
+    rng = random.Random(seed)
+    # columns mostly of one kind of value, with some others mixed in
+    kinds = rng.sample(VALUES, 3)
+    weights = [rng.randint(1, 10) for _ in kinds]
+    column = [rng.choices(kinds, weights)[0](rng) for _ in range(rng.randint(0, 60))]
+
+    arr, ty = column_data_type(column)
+    expected, expected_ty = column_data_type_by_value(column)
+    assert ty == expected_ty
+    assert len(arr) == len(expected)
+    assert all(same(a, b) for a, b in zip(arr, expected)), (column, arr, expected)
+
+
+def test_column_data_type():
+    assert column_data_type(["1", "2", None, "x"]) == ([1, 2, None, None], "int")
+    assert column_data_type(["1.5", "2", "3.25"]) == ([1.5, 2.0, 3.25], "float")
+    assert column_data_type(["Yes", "no", "maybe"]) == (["yes", "no", None], "bool")
+    assert column_data_type(["2024-01-02", "2024-03-04 05:06"]) == (
+        ["2024-01-02 00:00:00", "2024-03-04 05:06:00"], "datetime")
+    assert column_data_type(["a", 1, "b"]) == (["a", "1", "b"], "text")
+    assert column_data_type([]) == ([], "int")